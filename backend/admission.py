@@ -0,0 +1,192 @@
+"""
+Memory- and load-aware admission of new imapsync processes.
+
+The scheduler runs MAX_WORKERS threads, but a thread only starts another
+mailbox when the host has room for it. Every ADMISSION_SAMPLE_SECONDS the
+controller reads /proc: MemAvailable, the 1-minute load average and the RSS of
+this process's imapsync children. Inside a container MemAvailable describes the
+host, so when the cgroup has a memory limit (memory.max and memory.current, or
+memory.limit_in_bytes and memory.usage_in_bytes on cgroup v1, less inactive
+page cache) the smaller of the cgroup's and the host's free memory counts. A new child is expected to
+need as much as the running ones do on average (at least
+IMAPSYNC_RSS_ESTIMATE_MB), so
+
+    slots = (available - MEMORY_RESERVE_MB) / expected child RSS
+
+new children may start until the next sample, none while the load per CPU is
+above MAX_LOAD_PER_CPU. The effective concurrency therefore rises and falls
+with the host, within MIN_WORKERS (always allowed) and MAX_WORKERS.
+
+IMAPSYNC_MAX_MEMORY_MB caps each child's address space (imapsync has no memory
+option of its own), so a runaway folder fails that mailbox instead of getting
+the container OOM-killed. Without /proc (not Linux) only MAX_WORKERS applies.
+"""
+import os
+import threading
+import time
+
+MIN_WORKERS = int(os.getenv("MIN_WORKERS", 1))
+MEMORY_RESERVE_MB = int(os.getenv("MEMORY_RESERVE_MB", 512))
+IMAPSYNC_RSS_ESTIMATE_MB = int(os.getenv("IMAPSYNC_RSS_ESTIMATE_MB", 200))
+MAX_LOAD_PER_CPU = float(os.getenv("MAX_LOAD_PER_CPU", 2.0))
+ADMISSION_SAMPLE_SECONDS = float(os.getenv("ADMISSION_SAMPLE_SECONDS", 2))
+IMAPSYNC_MAX_MEMORY_MB = int(os.getenv("IMAPSYNC_MAX_MEMORY_MB", 0))
+
+PROC = "/proc"
+CGROUP = "/sys/fs/cgroup"
+
+
+def read_meminfo(proc: str = PROC) -> dict:
+    """Values of /proc/meminfo in MB."""
+    values = {}
+    with open(os.path.join(proc, "meminfo")) as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            fields = rest.split()
+            if fields:
+                values[name] = int(fields[0]) // 1024  # kB
+    return values
+
+
+def _read_stat(path: str, name: str) -> int:
+    """One counter of a cgroup memory.stat file, 0 if missing."""
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.partition(" ")
+                if key == name:
+                    return int(value)
+    except (FileNotFoundError, PermissionError):
+        pass
+    return 0
+
+
+def read_cgroup_available_mb(cgroup: str = CGROUP):
+    """
+    Memory left under this cgroup's limit in MB, or None without a limit (or cgroup).
+    Usage counts page cache (logs, UID caches); its inactive part is reclaimable and
+    is subtracted, as the kernel would reclaim it before OOM-killing anything.
+    """
+    for directory, limit_file, usage_file, inactive in (
+            (cgroup, "memory.max", "memory.current", "inactive_file"),
+            (os.path.join(cgroup, "memory"), "memory.limit_in_bytes", "memory.usage_in_bytes",
+             "total_inactive_file")):
+        try:
+            with open(os.path.join(directory, limit_file)) as f:
+                limit = f.read().strip()
+            with open(os.path.join(directory, usage_file)) as f:
+                usage = int(f.read().strip())
+        except (FileNotFoundError, PermissionError):
+            continue
+        if limit == "max":
+            return None
+        usage -= min(usage, _read_stat(os.path.join(directory, "memory.stat"), inactive))
+        # cgroup v1 reports "no limit" as a huge number; min() with the host's headroom takes care of it
+        return max(0, int(limit) - usage) // (1024 * 1024)
+    return None
+
+
+def read_load(proc: str = PROC) -> float:
+    with open(os.path.join(proc, "loadavg")) as f:
+        return float(f.read().split()[0])
+
+
+def read_rss_mb(pid: int, proc: str = PROC):
+    """Resident set size of a process in MB, or None once it is gone."""
+    try:
+        with open(os.path.join(proc, str(pid), "status")) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) // 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    return None
+
+
+class AdmissionController:
+    def __init__(self, max_workers: int, min_workers: int = MIN_WORKERS, proc: str = PROC, child_pids=None,
+                 cgroup: str = CGROUP):
+        self.max_workers = max_workers
+        self.min_workers = max(1, min(min_workers, max_workers))
+        self.proc = proc
+        self.cgroup = cgroup
+        self.child_pids = child_pids or _imapsync_pids
+        self.enabled = os.path.exists(os.path.join(proc, "meminfo"))
+        self._lock = threading.Lock()
+        self._sampled_at = 0.0
+        self._budget = 0
+        self.last = {}
+        self.denied = 0
+
+    def _sample(self, running: int):
+        meminfo = read_meminfo(self.proc)
+        host_available = meminfo.get("MemAvailable", meminfo.get("MemFree", 0))
+        cgroup_available = read_cgroup_available_mb(self.cgroup)
+        available = host_available if cgroup_available is None else min(host_available, cgroup_available)
+        load = read_load(self.proc)
+        cpus = os.cpu_count() or 1
+        rss = [mb for mb in (read_rss_mb(pid, self.proc) for pid in self.child_pids()) if mb is not None]
+        per_child = max(IMAPSYNC_RSS_ESTIMATE_MB, sum(rss) // len(rss) if rss else 0)
+
+        headroom = available - MEMORY_RESERVE_MB
+        slots = max(0, headroom // per_child) if per_child else 0
+        overloaded = load / cpus > MAX_LOAD_PER_CPU
+        if overloaded:
+            slots = 0
+        limit = min(self.max_workers, max(self.min_workers, running + slots))
+        self._budget = max(0, limit - running)
+        self.last = {
+            "mem_available_mb": available,
+            "host_mem_available_mb": host_available,
+            "cgroup_mem_available_mb": cgroup_available,
+            "mem_total_mb": meminfo.get("MemTotal"),
+            "load_per_cpu": round(load / cpus, 2),
+            "children": len(rss),
+            "children_rss_mb": sum(rss),
+            "expected_child_mb": per_child,
+            "overloaded": overloaded,
+            "effective_limit": limit,
+        }
+
+    def admit(self, running: int) -> bool:
+        """True if one more mailbox may start now, with `running` already started by this process."""
+        if running >= self.max_workers:
+            return False
+        if not self.enabled or running < self.min_workers:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if now - self._sampled_at >= ADMISSION_SAMPLE_SECONDS:
+                try:
+                    self._sample(running)
+                except (OSError, ValueError) as e:
+                    print(f"Admission sample failed, allowing up to MAX_WORKERS: {e}")
+                    self._budget = self.max_workers - running
+                self._sampled_at = now
+            if self._budget > 0:
+                self._budget -= 1
+                return True
+            self.denied += 1
+            return False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"enabled": self.enabled, "min_workers": self.min_workers, "max_workers": self.max_workers,
+                    "denied": self.denied, **self.last}
+
+
+def _imapsync_pids():
+    from worker import active_processes
+    return [process.pid for process in list(active_processes.values())]
+
+
+def limit_child_memory(pid: int):
+    """Applies IMAPSYNC_MAX_MEMORY_MB to a freshly spawned imapsync (Linux only)."""
+    if IMAPSYNC_MAX_MEMORY_MB <= 0:
+        return
+    try:
+        import resource
+        limit = IMAPSYNC_MAX_MEMORY_MB * 1024 * 1024
+        resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, AttributeError, OSError, ValueError) as e:
+        print(f"Could not limit memory of imapsync {pid}: {e}")
@@ -0,0 +1,299 @@
+"""
+Job archival, deletion and retention.
+
+Archiving a finished job moves its mailbox rows to mailboxes_archive (without
+credentials) and its log files into one ARCHIVE_DIR/<job_id>.zip. Deleting a
+job removes its rows, logs, archive and the UID caches no other job shares.
+Archiving drops the job's search index lines (log_events) and throughput
+history with its mailboxes, since those are the biggest hot tables; the logs
+themselves stay readable from the zip. Both run in a background
+thread, BATCH_SIZE mailboxes per transaction, so the hot tables are never
+locked for long; a job is flagged 'archiving' / 'deleting' while in progress
+and the maintenance loop picks up any that were interrupted by a restart.
+
+Retention (checked every MAINTENANCE_INTERVAL seconds):
+  ARCHIVE_AFTER_DAYS  - archive completed jobs whose last mailbox finished longer ago than
+                        this (0 = never, the default: archiving drops the credentials that
+                        delta / cutover passes need)
+  PURGE_AFTER_DAYS    - delete archived jobs older than this (0 = keep forever)
+
+Usage: python archive.py   (runs one maintenance pass, e.g. from cron)
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import func, insert, select, literal, or_
+from database import SessionLocal, Job, Mailbox, ArchivedMailbox, SyncPass, ThroughputSample, LogEvent
+from throughput import delete_history
+from log_index import delete_events
+
+LOG_DIR = "logs"
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 0))
+PURGE_AFTER_DAYS = int(os.getenv("PURGE_AFTER_DAYS", 0))
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", 3600))
+
+# Jobs in these states must not have mailboxes claimed or re-queued
+BUSY_STATUSES = ("archiving", "archived", "deleting")
+
+# Mailbox states that mean a sync may still touch the row
+ACTIVE_MAILBOX_STATUSES = ("validating", "running")
+
+# delete_job leaves rows of syncs that are still being stopped until their final write;
+# how often it looks again
+DELETE_POLL_SECONDS = 1.0
+
+ARCHIVE_COLUMNS = (
+    "id", "job_id", "source_user", "target_user", "status", "message",
+    "data_transferred", "messages_transferred", "messages_skipped", "attempts",
+    "pass_number", "started_at", "finished_at", "last_synced_at",
+)
+
+# One archive/delete at a time per process; they are I/O bound and batch anyway
+_work_lock = threading.Lock()
+
+
+def archive_path(job_id: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"{job_id}.zip")
+
+
+def _next_batch(db, job_id: str, *columns):
+    return db.query(*columns).filter(Mailbox.job_id == job_id).order_by(Mailbox.id).limit(BATCH_SIZE).all()
+
+
+def _archive_logs(job_id: str, mailbox_ids):
+    """Adds the batch's logs to the job's zip; entries already there (re-run after a crash) are skipped."""
+    paths = [(mailbox_id, os.path.join(LOG_DIR, f"{mailbox_id}.log")) for mailbox_id in mailbox_ids]
+    paths = [(mailbox_id, path) for mailbox_id, path in paths if os.path.exists(path)]
+    if not paths:
+        return
+    import zipfile
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with zipfile.ZipFile(archive_path(job_id), mode="a", compression=zipfile.ZIP_DEFLATED) as archive:
+        existing = set(archive.namelist())
+        for mailbox_id, path in paths:
+            name = f"{mailbox_id}.log"
+            if name not in existing:
+                archive.write(path, arcname=name)
+
+
+def read_archived_log(job_id: str, mailbox_id: int):
+    import zipfile
+    try:
+        with zipfile.ZipFile(archive_path(job_id)) as archive:
+            return archive.read(f"{mailbox_id}.log").decode("utf-8", errors="replace")
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+def _unlink_logs(mailbox_ids):
+    for mailbox_id in mailbox_ids:
+        try:
+            os.unlink(os.path.join(LOG_DIR, f"{mailbox_id}.log"))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to delete log of mailbox {mailbox_id}: {e}")
+
+
+def _forget_probes(job_id: str):
+    # Only a process that ran syncs has loaded capabilities.py and remembers anything
+    capabilities = sys.modules.get("capabilities")
+    if capabilities:
+        capabilities.forget(job_id)
+
+
+def archive_job(job_id: str):
+    """Moves a job's mailboxes and logs to the archive, one batch per transaction."""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        archived = 0
+        while True:
+            ids = [row.id for row in _next_batch(db, job_id, Mailbox.id)]
+            if not ids:
+                break
+            _archive_logs(job_id, ids)
+            columns = [getattr(Mailbox, name) for name in ARCHIVE_COLUMNS]
+            db.execute(insert(ArchivedMailbox).from_select(
+                list(ARCHIVE_COLUMNS) + ["archived_at"],
+                select(*columns, literal(now)).where(Mailbox.id.in_(ids))
+            ))
+            db.query(Mailbox).filter(Mailbox.id.in_(ids)).delete(synchronize_session=False)
+            delete_history(db, mailbox_ids=ids)
+            delete_events(db, ids)
+            db.commit()
+            _unlink_logs(ids)
+            archived += len(ids)
+
+        delete_history(db, job_id=job_id)
+        db.query(Job).filter(Job.id == job_id, Job.status == "archiving") \
+            .update({Job.status: "archived", Job.archived_at: now}, synchronize_session=False)
+        db.commit()
+        _forget_probes(job_id)
+        print(f"Archived job {job_id}: {archived} mailboxes")
+    except Exception as e:
+        db.rollback()
+        print(f"Archiving job {job_id} failed (will resume on next maintenance pass): {e}")
+    finally:
+        db.close()
+
+
+def _unshared_pairs(db, job, rows):
+    """
+    The (job, mailbox) pairs of `rows` whose UID cache no other job's mailbox (live or
+    archived) uses; caches are keyed by host/user, so a later job for the same pair shares them.
+    """
+    from uid_cache import cache_key
+    keys = {cache_key(job, row): row for row in rows}
+    sources = {row.source_user.lower() for row in rows if row.source_user}
+    for model in (Mailbox, ArchivedMailbox):
+        others = db.query(Job.source_host, model.source_user, Job.target_host, model.target_user) \
+            .join(Job, Job.id == model.job_id) \
+            .filter(model.job_id != job.id, func.lower(model.source_user).in_(sources))
+        for other in others:
+            keys.pop(cache_key(other, other), None)
+    return [(job, row) for row in keys.values()]
+
+
+def delete_job(job_id: str):
+    """Deletes a job with its mailboxes, logs, UID caches and archive, one batch per transaction."""
+    from uid_cache import uid_caches
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job:
+            return
+        from worker import LEASE_SECONDS
+        # Stopped syncs still write their final status, samples and events; give up on a live
+        # lease only after this long
+        deadline = time.monotonic() + 2 * LEASE_SECONDS
+        while True:
+            query = db.query(Mailbox.id, Mailbox.source_user, Mailbox.target_user).filter(Mailbox.job_id == job_id)
+            waiting = time.monotonic() < deadline
+            if waiting:
+                lease_cutoff = datetime.utcnow() - timedelta(seconds=LEASE_SECONDS)
+                query = query.filter(or_(Mailbox.status != "running", Mailbox.heartbeat_at.is_(None),
+                                         Mailbox.heartbeat_at < lease_cutoff))
+            rows = query.order_by(Mailbox.id).limit(BATCH_SIZE).all()
+            if not rows:
+                if not waiting or not db.query(Mailbox.id).filter(Mailbox.job_id == job_id).first():
+                    break
+                db.commit()  # End the read transaction so the next look sees the owners' writes
+                time.sleep(DELETE_POLL_SECONDS)
+                continue
+            ids = [row.id for row in rows]
+            db.query(Mailbox).filter(Mailbox.id.in_(ids)).delete(synchronize_session=False)
+            delete_history(db, mailbox_ids=ids)
+            delete_events(db, ids)
+            db.commit()
+            _unlink_logs(ids)
+            uid_caches.remove(_unshared_pairs(db, job, rows))
+
+        while True:
+            ids = [row.id for row in db.query(ArchivedMailbox.id).filter(ArchivedMailbox.job_id == job_id)
+                   .limit(BATCH_SIZE).all()]
+            if not ids:
+                break
+            db.query(ArchivedMailbox).filter(ArchivedMailbox.id.in_(ids)).delete(synchronize_session=False)
+            delete_history(db, mailbox_ids=ids)
+            delete_events(db, ids)
+            db.commit()
+
+        try:
+            os.unlink(archive_path(job_id))
+        except FileNotFoundError:
+            pass
+
+        db.query(SyncPass).filter(SyncPass.job_id == job_id).delete(synchronize_session=False)
+        delete_history(db, job_id=job_id)
+        db.query(LogEvent).filter(LogEvent.job_id == job_id).delete(synchronize_session=False)
+        db.query(Job).filter(Job.id == job_id).delete(synchronize_session=False)
+        db.commit()
+        _forget_probes(job_id)
+        print(f"Deleted job {job_id}")
+    except Exception as e:
+        db.rollback()
+        print(f"Deleting job {job_id} failed (will resume on next maintenance pass): {e}")
+    finally:
+        db.close()
+
+
+def _run_serialized(func, job_ids):
+    with _work_lock:
+        for job_id in job_ids:
+            func(job_id)
+
+
+def start_in_background(func, job_ids):
+    threading.Thread(target=_run_serialized, args=(func, list(job_ids)),
+                     name=f"{func.__name__}", daemon=True).start()
+
+
+def run_maintenance():
+    """Finishes interrupted archive/delete runs and applies the retention policy."""
+    db = SessionLocal()
+    try:
+        to_archive = [row.id for row in db.query(Job.id).filter(Job.status == "archiving")]
+        to_delete = [row.id for row in db.query(Job.id).filter(Job.status == "deleting")]
+        now = datetime.utcnow()
+
+        if ARCHIVE_AFTER_DAYS > 0:
+            cutoff = now - timedelta(days=ARCHIVE_AFTER_DAYS)
+            active = select(Mailbox.job_id).where(Mailbox.status.in_(ACTIVE_MAILBOX_STATUSES + ("pending",)))
+            # Age counts from when the job finished (its last mailbox), not from when it was created
+            recent = select(Mailbox.job_id).group_by(Mailbox.job_id).having(func.max(Mailbox.finished_at) >= cutoff)
+            expired = [row.id for row in db.query(Job.id).filter(
+                Job.status == "completed",
+                Job.created_at < cutoff,
+                Job.id.notin_(active),
+                Job.id.notin_(recent),
+            )]
+            if expired:
+                db.query(Job).filter(Job.id.in_(expired), Job.status == "completed") \
+                    .update({Job.status: "archiving"}, synchronize_session=False)
+                to_archive.extend(expired)
+
+        if PURGE_AFTER_DAYS > 0:
+            expired = [row.id for row in db.query(Job.id).filter(
+                Job.status == "archived",
+                Job.archived_at < now - timedelta(days=PURGE_AFTER_DAYS),
+            )]
+            if expired:
+                db.query(Job).filter(Job.id.in_(expired)).update({Job.status: "deleting"}, synchronize_session=False)
+                to_delete.extend(expired)
+        # Samples and events a stopped sync flushed after its rows were archived or deleted
+        known = select(Mailbox.id).union(select(ArchivedMailbox.id))
+        for model in (ThroughputSample, LogEvent):
+            db.query(model).filter(model.mailbox_id.notin_(known)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+    _run_serialized(archive_job, to_archive)
+    _run_serialized(delete_job, to_delete)
+    return {"archived": len(to_archive), "deleted": len(to_delete)}
+
+
+def _maintenance_loop(stop_event):
+    while not stop_event.is_set():
+        try:
+            run_maintenance()
+        except Exception as e:
+            print(f"Maintenance pass failed: {e}")
+        if stop_event.wait(MAINTENANCE_INTERVAL):
+            break
+
+
+def start_maintenance(stop_event):
+    threading.Thread(target=_maintenance_loop, args=(stop_event,), name="maintenance", daemon=True).start()
+
+
+if __name__ == "__main__":
+    print(run_maintenance())
@@ -1,7 +1,5 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
-import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
@@ -16,6 +14,7 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 1 day
 
 # --- Password Hashing with raw bcrypt ---
 # pwd_context removed because passlib is incompatible with new bcrypt
+# bcrypt and jose are imported inside the helpers so they aren't loaded at API startup
 
 # --- OAuth2 Scheme ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login")
@@ -31,6 +30,7 @@ class TokenData(BaseModel):
 # --- Helper Functions ---
 
 def verify_password(plain_password, hashed_password):
+    import bcrypt
     # bcrypt.checkpw requires bytes
     if isinstance(plain_password, str):
         plain_password = plain_password.encode('utf-8')
@@ -39,11 +39,13 @@ def verify_password(plain_password, hashed_password):
     return bcrypt.checkpw(plain_password, hashed_password)
 
 def get_password_hash(password):
+    import bcrypt
     if isinstance(password, str):
         password = password.encode('utf-8')
     return bcrypt.hashpw(password, bcrypt.gensalt()).decode('utf-8')
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -62,6 +64,7 @@ def get_db():
         db.close()
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    from jose import JWTError, jwt
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -0,0 +1,200 @@
+"""
+API load test against seeded data (see seed_data.py).
+
+Usage: python bench_load.py [--duration S] [--pollers N] [--viewers N] [--log-viewers N]
+                            [--uploaders N] [--upload-rows N]
+
+Runs the app in-process (no lifespan, so no workers or background loops) and
+drives it from concurrent client threads that behave like:
+
+- dashboard pollers: GET /api/jobs and GET /api/stats every POLL_INTERVAL;
+- job viewers: GET /api/jobs/{id} of a random job;
+- log viewers: GET /api/mailboxes/{id}/logs of a random mailbox;
+- uploaders: a new job with a CSV of --upload-rows mailboxes, scheduled far in
+  the future so nothing gets synced (named "seed-...", removed by --purge).
+
+Reports per endpoint the request count, errors, latency percentiles and the
+SQL statements executed per request, counted with an engine event and
+attributed through a context variable that follows the request into the
+threadpool. A query count that grows with the data size is the O(n)
+regression this is meant to catch.
+"""
+import argparse
+import contextvars
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Made-up hosts: no capability logins
+os.environ.setdefault("CAPABILITY_PROBE", "0")
+
+from sqlalchemy import event
+from database import SessionLocal, engine, Job, Mailbox
+
+POLL_INTERVAL = 1.0
+LABEL_HEADER = "x-bench-label"
+
+_label = contextvars.ContextVar("bench_label", default=None)
+
+
+class QueryCounter:
+    """Counts statements per label of the request that executed them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def install(self, target=engine):
+        event.listen(target, "before_cursor_execute", self._on_execute)
+
+    def remove(self, target=engine):
+        event.remove(target, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        label = _label.get()
+        if label is not None:
+            with self._lock:
+                self.counts[label] = self.counts.get(label, 0) + 1
+
+
+def labelled(app):
+    """ASGI wrapper that puts the request's bench label into the context variable."""
+    async def wrapper(scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope.get("headers", ()):
+                if name == LABEL_HEADER.encode():
+                    token = _label.set(value.decode())
+                    try:
+                        return await app(scope, receive, send)
+                    finally:
+                        _label.reset(token)
+        return await app(scope, receive, send)
+    return wrapper
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, label, ms, ok):
+        with self._lock:
+            self.latencies.setdefault(label, []).append(ms)
+            if not ok:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+
+def _percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class Client:
+    def __init__(self, app, stats):
+        from fastapi.testclient import TestClient
+        self.http = TestClient(app)
+        self.stats = stats
+
+    def call(self, label, method, url, **kwargs):
+        started = time.perf_counter()
+        response = self.http.request(method, url, headers={LABEL_HEADER: label}, **kwargs)
+        self.stats.record(label, (time.perf_counter() - started) * 1000, response.status_code < 400)
+        return response
+
+
+def _sample_ids():
+    db = SessionLocal()
+    try:
+        job_ids = [row.id for row in db.query(Job.id).filter(Job.status != "archived").limit(1000)]
+        mailbox_ids = [row.id for row in db.query(Mailbox.id).order_by(Mailbox.id.desc()).limit(5000)]
+        return job_ids, mailbox_ids
+    finally:
+        db.close()
+
+
+def _poller(client, stop, rng, job_ids, mailbox_ids, upload_rows):
+    while not stop.is_set():
+        client.call("GET /api/jobs", "GET", "/api/jobs?limit=50")
+        client.call("GET /api/stats", "GET", "/api/stats")
+        stop.wait(POLL_INTERVAL)
+
+
+def _viewer(client, stop, rng, job_ids, mailbox_ids, upload_rows):
+    while not stop.is_set() and job_ids:
+        client.call("GET /api/jobs/{id}", "GET", f"/api/jobs/{rng.choice(job_ids)}")
+
+
+def _log_viewer(client, stop, rng, job_ids, mailbox_ids, upload_rows):
+    while not stop.is_set() and mailbox_ids:
+        client.call("GET /api/mailboxes/{id}/logs", "GET", f"/api/mailboxes/{rng.choice(mailbox_ids)}/logs")
+
+
+def _uploader(client, stop, rng, job_ids, mailbox_ids, upload_rows):
+    from seed_data import NAME_PREFIX
+    while not stop.is_set():
+        job = client.call("POST /api/jobs", "POST", "/api/jobs", json={
+            "name": f"{NAME_PREFIX}upload-{rng.randint(0, 10**9)}", "source_host": "imap.source.example",
+            "target_host": "imap.target.example", "scheduled_start": "2099-01-01T00:00:00Z"}).json()
+        csv_text = "".join(f"u{n}@up.example,pw,u{n}@up.example,pw\n" for n in range(upload_rows))
+        client.call("POST /api/upload/{id}", "POST", f"/api/upload/{job['id']}",
+                    files={"file": ("mailboxes.csv", csv_text.encode(), "text/csv")})
+
+
+def run(duration: float, pollers: int, viewers: int, log_viewers: int, uploaders: int, upload_rows: int):
+    from main import app
+    stats, counter = Stats(), QueryCounter()
+    counter.install()
+    wrapped = labelled(app)
+    job_ids, mailbox_ids = _sample_ids()
+    stop = threading.Event()
+    threads = []
+    for role, count in ((_poller, pollers), (_viewer, viewers), (_log_viewer, log_viewers), (_uploader, uploaders)):
+        for n in range(count):
+            client = Client(wrapped, stats)
+            rng = random.Random(f"{role.__name__}-{n}")
+            threads.append(threading.Thread(target=role, args=(client, stop, rng, job_ids, mailbox_ids, upload_rows),
+                                            name=f"{role.__name__}-{n}", daemon=True))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=30)
+    counter.remove()
+    return stats, counter
+
+
+def report(stats, counter, duration):
+    print(f"{'endpoint':<32}{'reqs':>7}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'q/req':>8}")
+    for label in sorted(stats.latencies):
+        samples = stats.latencies[label]
+        queries = counter.counts.get(label, 0) / len(samples)
+        print(f"{label:<32}{len(samples):>7}{stats.errors.get(label, 0):>5}"
+              f"{_percentile(samples, 50):>9.1f}{_percentile(samples, 95):>9.1f}{_percentile(samples, 99):>9.1f}"
+              f"{max(samples):>9.1f}{queries:>8.1f}")
+    total = sum(len(s) for s in stats.latencies.values())
+    print(f"\n{total} requests in {duration:.0f}s ({total / duration:.1f} req/s), "
+          f"median overall {statistics.median([ms for s in stats.latencies.values() for ms in s]):.1f} ms"
+          if total else "No requests completed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent API load test against seeded data")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--pollers", type=int, default=8)
+    parser.add_argument("--viewers", type=int, default=4)
+    parser.add_argument("--log-viewers", type=int, default=2)
+    parser.add_argument("--uploaders", type=int, default=1)
+    parser.add_argument("--upload-rows", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"--- API load test: {args.duration:.0f}s, {args.pollers} pollers, {args.viewers} job viewers, "
+          f"{args.log_viewers} log viewers, {args.uploaders} uploaders ({args.upload_rows} rows) ---")
+    stats, counter = run(args.duration, args.pollers, args.viewers, args.log_viewers, args.uploaders, args.upload_rows)
+    report(stats, counter, args.duration)
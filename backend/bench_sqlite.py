@@ -0,0 +1,219 @@
+"""
+SQLite benchmark: default settings vs. production mode (WAL, pragmas, single writer).
+
+Usage: python bench_sqlite.py [--syncs N] [--rounds N] [--messages N] [--api-threads N]
+
+Each mode runs in a fresh interpreter on its own database file in a temporary
+directory:
+
+- default: SQLITE_TUNED=0 (rollback journal, library defaults, every thread
+  commits for itself), which is what imapsync.db got before;
+- tuned: WAL, synchronous=NORMAL, busy timeout, page cache and db_writer.
+
+--syncs worker threads (default 20) each run run_imapsync for --rounds
+mailboxes against a stub imapsync that prints --messages progress lines plus
+sizes, a few error lines and the summary, with throughput sampling and log
+indexing active, as in production. Each chunk of output with newly copied
+messages also writes the mailbox's progress counters through db_writer, the
+way the worker committed every progress update before the write-behind status
+writer: in default mode db_writer runs inline, so that is one transaction per
+update from every sync thread; in tuned mode the writer thread batches them.
+Meanwhile --api-threads clients create jobs and upload small CSVs (writes) and
+poll job details (reads) through the API.
+
+Reported per mode: wall time, mailboxes that ended failed, "database is
+locked" errors seen by the engine, and API latency percentiles.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STUB_IMAPSYNC = """#!{python}
+import sys, time
+messages = {messages}
+print("Host1 Nb messages: %d messages" % messages, flush=True)
+print("Host1 Total size: %d bytes" % (messages * 20000), flush=True)
+for n in range(messages):
+    print("msg INBOX/%d {{20000}} copied to INBOX/%d   4.0 msgs/s  80.000 KiB/s" % (n + 1, n + 1), flush=True)
+    if n % 50 == 49:
+        print("Err 1/3: could not fetch message INBOX/%d, timed out" % (n + 1), flush=True)
+    time.sleep({delay})
+print("Messages transferred                     : %d" % messages)
+print("Total bytes transferred                  : %d (0.1 MiB)" % (messages * 20000))
+print("Exiting with return value 0")
+"""
+
+MODES = (("default", {"SQLITE_TUNED": "0", "DB_SINGLE_WRITER": "0"}),
+         ("tuned", {"SQLITE_TUNED": "1", "DB_SINGLE_WRITER": "1"}))
+
+
+def _percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def child(syncs: int, rounds: int, api_threads: int):
+    """Runs one mode in this interpreter; prints a JSON result line."""
+    sys.path.insert(0, BACKEND_DIR)
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import event, func, insert
+    from fastapi.testclient import TestClient
+    from database import engine, migrate, SessionLocal, Job, Mailbox, encrypt_password
+    from db_writer import db_writer
+    import worker
+    from main import app
+
+    progress_writes = []
+
+    class ProgressParser(worker.SummaryParser):
+        """Writes the copied-message counters after every chunk that advanced them."""
+        mailbox_id = None
+
+        def feed(self, chunk):
+            before = self.copied_messages
+            super().feed(chunk)
+            if self.mailbox_id is None or self.copied_messages == before:
+                return
+            values = {Mailbox.messages_transferred: self.copied_messages, Mailbox.data_transferred: self.copied_bytes,
+                      Mailbox.message: f"Copied {self.copied_messages} messages"}
+            db_writer.run(lambda db: db.query(Mailbox).filter(Mailbox.id == self.mailbox_id)
+                          .update(values, synchronize_session=False))
+            progress_writes.append(1)
+
+    def track(mailbox_id, job_id, parser, _track=worker.recorder.track):
+        parser.mailbox_id = mailbox_id
+        _track(mailbox_id, job_id, parser)
+
+    worker.SummaryParser = ProgressParser
+    worker.recorder.track = track
+
+    migrate()
+    locked = []
+    event.listen(engine, "handle_error",
+                 lambda context: locked.append(1) if "locked" in str(context.original_exception) else None)
+
+    db = SessionLocal()
+    db.execute(insert(Job), [{"id": "bench", "name": "bench", "status": "running",
+                              "source_host": "a.example", "target_host": "b.example",
+                              "total_mailboxes": syncs * rounds}])
+    password = encrypt_password("x")
+    db.execute(insert(Mailbox), [{"job_id": "bench", "source_user": f"u{n}@a.example", "source_pass": password,
+                                  "target_user": f"u{n}@b.example", "target_pass": password, "status": "pending"}
+                                 for n in range(syncs * rounds)])
+    db.commit()
+    mailbox_ids = [row.id for row in db.query(Mailbox.id).filter(Mailbox.job_id == "bench").order_by(Mailbox.id)]
+    db.close()
+
+    reads, writes, api_errors = [], [], []
+    stop = threading.Event()
+
+    def api_client(n):
+        http = TestClient(app)
+        k = 0
+        while not stop.is_set():
+            k += 1
+            started = time.perf_counter()
+            response = http.post("/api/jobs", json={"name": f"api-{n}-{k}", "source_host": "a.example",
+                                                    "target_host": "b.example",
+                                                    "scheduled_start": "2099-01-01T00:00:00Z"})
+            if response.status_code < 400:
+                csv_text = "".join(f"c{i}@a.example,p,c{i}@b.example,p\n" for i in range(20))
+                response = http.post(f"/api/upload/{response.json()['id']}",
+                                     files={"file": ("m.csv", csv_text.encode(), "text/csv")})
+            writes.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                api_errors.append(response.status_code)
+            started = time.perf_counter()
+            response = http.get("/api/jobs/bench")
+            reads.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                api_errors.append(response.status_code)
+
+    clients = [threading.Thread(target=api_client, args=(n,), daemon=True) for n in range(api_threads)]
+    for thread in clients:
+        thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=syncs) as pool:
+        list(pool.map(worker.run_imapsync, mailbox_ids))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in clients:
+        thread.join(timeout=60)
+    worker.recorder.flush()
+    worker.log_index.flush()
+
+    db = SessionLocal()
+    counts = dict(db.query(Mailbox.status, func.count(Mailbox.id)).filter(Mailbox.job_id == "bench")
+                  .group_by(Mailbox.status).all())
+    db.close()
+    print(json.dumps({
+        "seconds": elapsed, "mailboxes": len(mailbox_ids), "statuses": counts, "locked_errors": len(locked),
+        "api_errors": len(api_errors), "reads": reads, "writes": writes,
+        "status_failures": worker.status_writer.failures, "progress_writes": len(progress_writes),
+    }))
+
+
+def run_mode(name, overrides, args, workdir):
+    stub_dir = os.path.join(workdir, "bin")
+    os.makedirs(stub_dir, exist_ok=True)
+    stub = os.path.join(stub_dir, "imapsync")
+    with open(stub, "w") as f:
+        f.write(STUB_IMAPSYNC.format(python=sys.executable, messages=args.messages,
+                                     delay=args.run_seconds / args.messages))
+    os.chmod(stub, 0o755)
+
+    env = dict(os.environ, **overrides)
+    env.update({"DATABASE_URL": f"sqlite:///{workdir}/bench-{name}.db", "CAPABILITY_PROBE": "0",
+                "PATH": f"{stub_dir}{os.pathsep}{os.environ['PATH']}"})
+    for key in ("DB_USER", "DB_PASSWORD", "DB_HOST", "DB_NAME"):
+        env.pop(key, None)
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", str(args.syncs), str(args.rounds),
+                             str(args.api_threads)], cwd=workdir, env=env, capture_output=True, text=True)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode != 0 or not lines:
+        print(result.stdout[-2000:], result.stderr[-2000:])
+        raise SystemExit(f"{name} run failed")
+    return json.loads(lines[-1])
+
+
+def report(results):
+    print(f"{'mode':<9}{'wall s':>8}{'failed':>8}{'locked':>8}{'api err':>9}"
+          f"{'write p50':>11}{'p95':>9}{'p99':>9}{'read p50':>10}{'p95':>9}{'writes':>8}")
+    for name, r in results:
+        print(f"{name:<9}{r['seconds']:>8.1f}{r['statuses'].get('failed', 0):>8}{r['locked_errors']:>8}"
+              f"{r['api_errors']:>9}{_percentile(r['writes'], 50):>11.1f}{_percentile(r['writes'], 95):>9.1f}"
+              f"{_percentile(r['writes'], 99):>9.1f}{_percentile(r['reads'], 50):>10.1f}"
+              f"{_percentile(r['reads'], 95):>9.1f}{len(r['writes']):>8}")
+    for name, r in results:
+        print(f"{name}: mailbox statuses {r['statuses']}, progress writes {r['progress_writes']}, "
+              f"status flush failures {r['status_failures']}")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child(*(int(value) for value in sys.argv[2:5]))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="SQLite default vs. production mode under concurrent syncs")
+    parser.add_argument("--syncs", type=int, default=20, help="concurrent syncs")
+    parser.add_argument("--rounds", type=int, default=3, help="mailboxes per sync thread")
+    parser.add_argument("--messages", type=int, default=300, help="messages per stub sync")
+    parser.add_argument("--run-seconds", type=float, default=3, help="duration of one stub sync")
+    parser.add_argument("--api-threads", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"--- SQLite: {args.syncs} concurrent syncs x {args.rounds} rounds, {args.messages} messages each, "
+          f"{args.api_threads} API clients ---")
+    results = []
+    for name, overrides in MODES:
+        with tempfile.TemporaryDirectory(prefix=f"bench-sqlite-{name}-") as workdir:
+            results.append((name, run_mode(name, overrides, args, workdir)))
+    report(results)
@@ -0,0 +1,136 @@
+"""
+Per-job IMAP capability probe.
+
+The first mailbox of a job to start logs in to each distinct (host, port, security)
+once, records the capabilities advertised after authentication on Job.capabilities,
+and every later mailbox of the job reuses them to pick imapsync flags
+(see job_options.build_imapsync_args).
+"""
+import asyncio
+import os
+import ssl
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import Job
+from db_writer import db_writer
+from preflight import imap_login, LoginError
+
+CAPABILITY_PROBE = os.getenv("CAPABILITY_PROBE", "1") == "1"
+PROBE_TIMEOUT = float(os.getenv("CAPABILITY_PROBE_TIMEOUT", 15))
+
+# After a failed probe, later mailboxes of the job sync with the profile defaults
+# instead of each paying the timeout; try again after this long
+PROBE_RETRY_SECONDS = 600
+
+_locks = {}           # job_id -> [Lock, users], so concurrent workers of one job probe once;
+_locks_guard = threading.Lock()   # dropped when the last user is done
+_failures = {}        # (job_id, side) -> time of the last failed probe, while it still matters
+
+
+def summarize(capabilities) -> dict:
+    """Reduces a raw capability list to the entries that drive sync tuning."""
+    caps = {c.upper() for c in capabilities}
+    appendlimit = None
+    for cap in caps:
+        if cap.startswith("APPENDLIMIT="):
+            try:
+                appendlimit = int(cap.split("=", 1)[1])
+            except ValueError:
+                pass
+    return {
+        "compress": "COMPRESS=DEFLATE" in caps,
+        "condstore": "CONDSTORE" in caps,
+        "uidplus": "UIDPLUS" in caps,
+        "move": "MOVE" in caps,
+        "appendlimit": appendlimit,
+    }
+
+
+@contextmanager
+def _job_lock(job_id: str):
+    with _locks_guard:
+        entry = _locks.setdefault(job_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                _locks.pop(job_id, None)
+
+
+def _record_failure(job_id: str, side: str):
+    now = time.time()
+    with _locks_guard:
+        # Failures past the retry delay no longer hold anything back
+        for key in [key for key, at in _failures.items() if now - at >= PROBE_RETRY_SECONDS]:
+            del _failures[key]
+        _failures[(job_id, side)] = now
+
+
+def forget(job_id: str):
+    """Drops what is remembered about a job's probes, e.g. once it is archived or deleted."""
+    with _locks_guard:
+        for side in ("source", "target"):
+            _failures.pop((job_id, side), None)
+
+
+def _probe(host: str, port: int, security: str, user: str, password: str) -> list:
+    return asyncio.run(asyncio.wait_for(imap_login(host, port, security, user, password), PROBE_TIMEOUT))
+
+
+def job_capabilities(db, job, mailbox, source_pass: str, target_pass: str) -> dict:
+    """
+    Returns {"source": {...}, "target": {...}} for the job, probing with this mailbox's
+    credentials the sides not recorded yet. A side is missing if its probe failed.
+    Never raises: a failed probe just means syncing with the profile defaults.
+    """
+    if not CAPABILITY_PROBE:
+        return job.capabilities or {}
+
+    sides = [
+        ("source", job.source_host, job.source_port, job.source_security, mailbox.source_user, source_pass),
+        ("target", job.target_host, job.target_port, job.target_security, mailbox.target_user, target_pass),
+    ]
+    if all(side in (job.capabilities or {}) for side, *_ in sides):
+        return job.capabilities
+
+    with _job_lock(job.id):
+        # Another worker may have probed while we waited
+        db.refresh(job, ["capabilities"])
+        current = dict(job.capabilities or {})
+        probed = {}
+        for side, host, port, security, user, password in sides:
+            if side in current:
+                continue
+            if time.time() - _failures.get((job.id, side), 0) < PROBE_RETRY_SECONDS:
+                continue
+            key = (host.lower(), port, security)
+            if key not in probed:
+                try:
+                    raw = _probe(host, port, security, user, password)
+                except (LoginError, OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+                    print(f"Capability probe of {host}:{port} failed for job {job.id}: {e}")
+                    _record_failure(job.id, side)
+                    continue
+                except Exception as e:
+                    print(f"Capability probe of {host}:{port} error for job {job.id}: {e}")
+                    _record_failure(job.id, side)
+                    continue
+                probed[key] = summarize(raw)
+                probed[key]["raw"] = sorted(set(c.upper() for c in raw))
+            current[side] = dict(probed[key], host=host, port=port, probed_at=datetime.utcnow().isoformat())
+
+        if probed:
+            # Written through db_writer like the worker's other writes; this session only reads
+            db_writer.run(lambda write_db: write_db.query(Job).filter(Job.id == job.id).update(
+                {Job.capabilities: current}, synchronize_session=False))
+        return current
@@ -0,0 +1,170 @@
+"""
+Control channel for running syncs, across processes and nodes.
+
+kill_sync() only reaches imapsync children of the current process. Stop, cancel
+and checkpoint requests are therefore written to worker_commands, addressed to
+the mailbox's owner (worker_host + owner_pid, recorded when it was claimed).
+Every process polls for commands addressed to it every COMMAND_POLL_INTERVAL
+seconds, signals the child if it still runs it (or, for a sync it claimed but
+hasn't spawned yet, keeps the request for run_imapsync to apply before and
+right after spawning), and acknowledges the row with the outcome. Commands
+for syncs owned by the calling process are handled inline. The API doesn't
+wait for remote acks: it answers 202 with the command ids, and clients poll
+GET /api/commands/{id} (or just the mailbox rows) for the outcome.
+
+Commands addressed to a process that died are never acked; recover_orphans()
+takes care of their mailboxes, and old rows are pruned after COMMAND_RETENTION_SECONDS.
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import SessionLocal, Mailbox, WorkerCommand
+
+COMMAND_POLL_INTERVAL = float(os.getenv("COMMAND_POLL_INTERVAL", 1))
+COMMAND_RETENTION_SECONDS = int(os.getenv("COMMAND_RETENTION_SECONDS", 86400))
+
+COMMANDS = ("stop", "cancel", "checkpoint")
+
+
+def _identity():
+    import worker
+    return worker.WORKER_HOST, os.getpid()
+
+
+def _execute(command: WorkerCommand) -> str:
+    import worker
+    if command.command == "checkpoint":
+        signalled = worker.checkpoint_sync(command.mailbox_id, command.message)
+    else:
+        signalled = worker.stop_sync(command.mailbox_id, command.message)
+    return "signalled" if signalled else "not_running"
+
+
+def _handle(db, commands):
+    host, pid = _identity()
+    for command in commands:
+        result = _execute(command)
+        db.query(WorkerCommand).filter(WorkerCommand.id == command.id, WorkerCommand.acked_at.is_(None)) \
+            .update({WorkerCommand.acked_at: datetime.utcnow(), WorkerCommand.acked_by: f"{host}:{pid}",
+                     WorkerCommand.result: result}, synchronize_session=False)
+    db.commit()
+
+
+def send(db, mailbox_ids, command: str, message: str):
+    """
+    Queues `command` for each mailbox's owning process and returns the command ids.
+    Pass the ids of mailboxes that were running, before their status is overwritten.
+    """
+    if command not in COMMANDS:
+        raise ValueError(f"Unknown command {command!r}")
+    mailbox_ids = list(mailbox_ids)
+    if not mailbox_ids:
+        return []
+    # Rows without a live lease have no process left to signal (see worker.recover_orphans)
+    import worker
+    lease_cutoff = datetime.utcnow() - timedelta(seconds=worker.LEASE_SECONDS)
+    owners = db.query(Mailbox.id, Mailbox.job_id, Mailbox.worker_host, Mailbox.owner_pid).filter(
+        Mailbox.id.in_(mailbox_ids),
+        Mailbox.worker_host.isnot(None),
+        Mailbox.heartbeat_at >= lease_cutoff,
+    ).all()
+    if not owners:
+        return []
+    commands = [WorkerCommand(mailbox_id=row.id, job_id=row.job_id, command=command, message=message,
+                              target_host=row.worker_host, target_pid=row.owner_pid) for row in owners]
+    db.add_all(commands)
+    db.commit()
+
+    host, pid = _identity()
+    local = [c for c in commands if c.target_host == host and c.target_pid == pid]
+    if local:
+        _handle(db, local)
+    return [c.id for c in commands]
+
+
+def current(db, command_ids):
+    """State of the commands right now: inline (local) ones are acked already, remote ones may not be."""
+    if not command_ids:
+        return []
+    return [describe(c) for c in db.query(WorkerCommand).filter(WorkerCommand.id.in_(command_ids))]
+
+
+def describe(command: WorkerCommand) -> dict:
+    return {
+        "id": command.id,
+        "mailbox_id": command.mailbox_id,
+        "command": command.command,
+        "created_at": str(command.created_at),
+        "acked_at": str(command.acked_at) if command.acked_at else None,
+        "acked_by": command.acked_by,
+        "result": command.result,
+    }
+
+
+def summarize(acks) -> dict:
+    return {
+        "signalled": sum(1 for a in acks if a["result"] == "signalled"),
+        "not_running": sum(1 for a in acks if a["result"] == "not_running"),
+        "unacknowledged": sum(1 for a in acks if not a["acked_at"]),
+        "command_ids": [a["id"] for a in acks],
+    }
+
+
+def poll_once():
+    """Handles the unacknowledged commands addressed to this process."""
+    host, pid = _identity()
+    db = SessionLocal()
+    try:
+        commands = db.query(WorkerCommand).filter(
+            WorkerCommand.acked_at.is_(None),
+            WorkerCommand.target_host == host,
+            WorkerCommand.target_pid == pid,
+        ).order_by(WorkerCommand.id).all()
+        if commands:
+            _handle(db, commands)
+        return len(commands)
+    finally:
+        db.close()
+
+
+def prune(now: datetime = None):
+    db = SessionLocal()
+    try:
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=COMMAND_RETENTION_SECONDS)
+        removed = db.query(WorkerCommand).filter(WorkerCommand.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        return removed
+    finally:
+        db.close()
+
+
+_poller_thread = None
+_poller_lock = threading.Lock()
+
+
+def _poll_loop(stop_event):
+    last_prune = 0.0
+    while not stop_event.wait(COMMAND_POLL_INTERVAL):
+        try:
+            poll_once()
+            if time.monotonic() - last_prune >= 3600:
+                prune()
+                last_prune = time.monotonic()
+        except Exception as e:
+            print(f"Command poll failed: {e}")
+
+
+def ensure_poller():
+    """Starts the single command-polling thread for this process (idempotent)."""
+    import worker
+    global _poller_thread
+    with _poller_lock:
+        if _poller_thread is None or not _poller_thread.is_alive():
+            _poller_thread = threading.Thread(target=_poll_loop, args=(worker.shutting_down,),
+                                              name="command-poller", daemon=True)
+            _poller_thread.start()
@@ -1,7 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean, Text, BigInteger
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean, Text, BigInteger, JSON, Index
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
 from datetime import datetime
-from cryptography.fernet import Fernet
 import os
 
 from dotenv import load_dotenv
@@ -30,39 +29,78 @@ if not DATABASE_URL:
     # Check if we are testing or local
     DATABASE_URL = "sqlite:///./imapsync.db"
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# SQLite production mode (SQLITE_TUNED=1, the default): WAL journal so readers and the
+# writer don't block each other, synchronous=NORMAL (durable at WAL checkpoints, no fsync
+# per commit), a busy timeout instead of instant "database is locked", and a bigger page
+# cache. Background writes also go through one writer thread (see db_writer.py).
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "1") != "0"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 30000))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", 64))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", 20))
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size={-SQLITE_CACHE_MB * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+# File databases only; an in-memory database has no journal and a single connection
+SQLITE_FILE = DATABASE_URL.startswith("sqlite:///") and ":memory:" not in DATABASE_URL
+
+if SQLITE_FILE and SQLITE_TUNED:
+    from sqlalchemy import event
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_size=SQLITE_POOL_SIZE,
+                           max_overflow=SQLITE_POOL_SIZE, connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000})
+    event.listen(engine, "connect", _sqlite_pragmas)
+else:
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 # Encryption Key Management (Simple File-based for now)
+# The key (and the cryptography import) is loaded on first use, not at import time,
+# so starting the API doesn't touch the filesystem or pay for the import.
 KEY_FILE = "secret.key"
 def load_key():
     if os.path.exists(KEY_FILE):
         with open(KEY_FILE, "rb") as key_file:
             return key_file.read()
     else:
+        from cryptography.fernet import Fernet
         key = Fernet.generate_key()
         with open(KEY_FILE, "wb") as key_file:
             key_file.write(key)
         return key
 
-cipher_suite = Fernet(load_key())
+_cipher_suite = None
+def get_cipher():
+    global _cipher_suite
+    if _cipher_suite is None:
+        from cryptography.fernet import Fernet
+        _cipher_suite = Fernet(load_key())
+    return _cipher_suite
 
 def encrypt_password(password: str) -> str:
     if not password: return ""
-    return cipher_suite.encrypt(password.encode()).decode()
+    return get_cipher().encrypt(password.encode()).decode()
 
 def decrypt_password(token: str) -> str:
     if not token: return ""
-    return cipher_suite.decrypt(token.encode()).decode()
+    return get_cipher().decrypt(token.encode()).decode()
 
 class Job(Base):
     __tablename__ = "jobs"
 
     id = Column(String(36), primary_key=True, index=True)
     name = Column(String(255))
-    status = Column(String(50), default="pending") # pending, running, completed, failed
+    status = Column(String(50), default="pending") # pending, scheduled, running, completed, failed, paused, archiving, archived, deleting
     
     # Source Config
     source_host = Column(String(255))
@@ -75,9 +113,17 @@ class Job(Base):
     target_security = Column(String(50), default="SSL/TLS") # SSL/TLS, STARTTLS, None
     
     # Migration Options
-    options = Column(Text, nullable=True) # JSON String for flexibility
+    options = Column(JSON(none_as_null=True), nullable=True) # Validated JobOptions (see job_options.py)
     
     csv_path = Column(String(500), nullable=True)
+
+    # Fair-share scheduling (see scheduler.py)
+    priority = Column(Integer, default=5) # 1 (batch) .. 10 (urgent): share of worker slots
+    max_concurrency = Column(Integer, nullable=True) # Mailboxes of this job syncing at once; NULL = no cap
+
+    # Off-hours runs (see run_windows.py): parked as 'scheduled' until the start time / while the window is closed
+    scheduled_start = Column(DateTime, nullable=True)
+    run_windows = Column(JSON(none_as_null=True), nullable=True)
     
     # Stats
     total_mailboxes = Column(Integer, default=0)
@@ -85,7 +131,14 @@ class Job(Base):
     failed = Column(Integer, default=0)
     data_transferred = Column(BigInteger, default=0) # Bytes
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True) # Keyset pagination of /api/jobs
+    
+    current_pass = Column(Integer, default=1) # 1 = initial full pass, 2+ = delta passes
+
+    # {"source": {...}, "target": {...}} as recorded by capabilities.job_capabilities()
+    capabilities = Column(JSON(none_as_null=True), nullable=True)
+
+    archived_at = Column(DateTime, nullable=True) # Mailbox rows moved to mailboxes_archive
 
     mailboxes = relationship("Mailbox", back_populates="job")
 
@@ -93,24 +146,255 @@ class Mailbox(Base):
     __tablename__ = "mailboxes"
 
     id = Column(Integer, primary_key=True, index=True)
-    job_id = Column(String(36), ForeignKey("jobs.id"))
+    job_id = Column(String(36), ForeignKey("jobs.id"), index=True)
     
     source_user = Column(String(255))
     source_pass = Column(String(500)) # Encrypted
     target_user = Column(String(255))
     target_pass = Column(String(500)) # Encrypted
     
-    status = Column(String(50), default="pending") # pending, running, success, failed
+    status = Column(String(50), default="pending") # validating, pending, running, success, failed
     message = Column(Text, nullable=True)
-    data_transferred = Column(BigInteger, default=0) # Bytes
+    data_transferred = Column(BigInteger, default=0) # Bytes (cumulative over passes)
+    messages_transferred = Column(Integer, default=0) # Cumulative over passes
+    messages_skipped = Column(Integer, default=0) # Last run
+    size_bytes = Column(BigInteger, nullable=True) # Source mailbox size from imapsync's folder-size scan
+    size_messages = Column(Integer, nullable=True)
+    
+    # Delta passes
+    pass_number = Column(Integer, default=1)
+    last_synced_at = Column(DateTime, nullable=True) # Start of the last successful run
+    
+    # Current / last attempt (used to recover orphans after a restart)
+    attempts = Column(Integer, default=0)
+    worker_host = Column(String(255), nullable=True)
+    worker_pid = Column(Integer, nullable=True) # imapsync child process
+    owner_pid = Column(Integer, nullable=True) # API/worker process that spawned it
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True) # Lease: refreshed while the process runs
+    finished_at = Column(DateTime, nullable=True) # End of the last attempt
+    
+    # Pre-flight login check (optional, on upload)
+    preflight_status = Column(String(20), nullable=True) # ok, failed, skipped
+    preflight_message = Column(Text, nullable=True)
+    preflight_at = Column(DateTime, nullable=True)
+    
+    # Any change to the row; the job-detail page polls for rows changed since its last response
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
     
     job = relationship("Job", back_populates="mailboxes")
 
+    __table_args__ = (
+        Index("ix_mailboxes_job_updated", "job_id", "updated_at"),
+        # A mailbox of a job is its (source_user, target_user) pair, see ingest.py
+        Index("uq_mailboxes_job_pair", "job_id", "source_user", "target_user", unique=True),
+    )
+
+class ArchivedMailbox(Base):
+    """Final state of a mailbox of an archived job. Credentials are not kept."""
+    __tablename__ = "mailboxes_archive"
+
+    id = Column(Integer, primary_key=True) # Same id as the original mailboxes row
+    job_id = Column(String(36), index=True)
+    source_user = Column(String(255))
+    target_user = Column(String(255))
+    status = Column(String(50))
+    message = Column(Text, nullable=True)
+    data_transferred = Column(BigInteger, default=0)
+    messages_transferred = Column(Integer, default=0)
+    messages_skipped = Column(Integer, default=0)
+    attempts = Column(Integer, default=0)
+    pass_number = Column(Integer, default=1)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    last_synced_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class SyncPass(Base):
+    """One bulk or delta pass over a job's mailboxes, with its own stats."""
+    __tablename__ = "sync_passes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(36), ForeignKey("jobs.id"), index=True)
+    pass_number = Column(Integer)
+    mode = Column(String(20), default="full") # full, delta
+    max_age_days = Column(Integer, nullable=True) # imapsync --maxage for delta passes
+    
+    total = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    messages_transferred = Column(Integer, default=0)
+    data_transferred = Column(BigInteger, default=0)
+    
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class WorkerCommand(Base):
+    """
+    Stop / cancel / checkpoint request for a running sync, picked up by whichever
+    process owns it (see control.py) and acknowledged back to the API.
+    """
+    __tablename__ = "worker_commands"
+
+    id = Column(Integer, primary_key=True, index=True)
+    mailbox_id = Column(Integer, index=True)
+    job_id = Column(String(36), nullable=True)
+    command = Column(String(20)) # stop, cancel, checkpoint
+    message = Column(String(500), nullable=True) # Mailbox message recorded when the sync ends
+    target_host = Column(String(255), nullable=True) # Owner at the time of the request, for diagnostics
+    target_pid = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    acked_at = Column(DateTime, nullable=True, index=True)
+    acked_by = Column(String(255), nullable=True) # host:pid of the worker that handled it
+    result = Column(String(50), nullable=True) # signalled, not_running
+
+class ThroughputSample(Base):
+    """
+    Bytes and messages copied by one mailbox sync during `seconds` starting at `ts`:
+    5s samples while it runs, merged into 1min samples when the run ends (see throughput.py).
+    Intervals without progress are not stored.
+    """
+    __tablename__ = "throughput_samples"
+
+    id = Column(Integer, primary_key=True, index=True)
+    mailbox_id = Column(Integer, index=True)
+    ts = Column(DateTime)
+    seconds = Column(Integer)
+    bytes = Column(BigInteger, default=0)
+    messages = Column(Integer, default=0)
+
+class JobThroughput(Base):
+    """Per-minute job totals, kept alongside the samples so job charts never scan them."""
+    __tablename__ = "job_throughput"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(36), index=True)
+    minute = Column(DateTime) # Several rows per minute are possible (one per flush and process); sum them
+    bytes = Column(BigInteger, default=0)
+    messages = Column(Integer, default=0)
+
+class LogEvent(Base):
+    """
+    Error and key lines of a mailbox's current log, extracted while imapsync runs (see log_index.py).
+    `line` is full-text indexed: FTS5 on SQLite, FULLTEXT on MySQL (created by migrate()).
+    """
+    __tablename__ = "log_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    mailbox_id = Column(Integer, index=True)
+    job_id = Column(String(36), index=True)
+    ts = Column(DateTime)
+    kind = Column(String(10)) # error, event
+    line = Column(Text)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(100), unique=True, index=True)
     hashed_password = Column(String(255))
 
-def init_db():
+def migrate():
+    """
+    Creates missing tables and adds columns and indexes introduced after a table was first created.
+    Run explicitly (python migrate.py) rather than on every API start.
+    """
+    from sqlalchemy import inspect, text
     Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column)}"))
+                added.append(f"{table.name}.{column.name}")
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    if index.unique and _has_duplicates(conn, index):
+                        print(f"Not creating {index.name}: {table.name} has duplicate "
+                              f"({', '.join(c.name for c in index.columns)}) rows; remove them and run migrate again")
+                        continue
+                    index.create(conn)
+                    added.append(f"{table.name}.{index.name}")
+        # JSON columns once stored None as the JSON text 'null'; make those real NULLs
+        for table in Base.metadata.sorted_tables:
+            for column in table.columns:
+                if isinstance(column.type, JSON) and column.type.none_as_null:
+                    is_json_null = f"JSON_TYPE({column.name}) = 'NULL'" if engine.dialect.name in ("mysql", "mariadb") \
+                        else f"{column.name} = 'null'"
+                    conn.execute(text(f"UPDATE {table.name} SET {column.name} = NULL WHERE {is_json_null}"))
+        if _ensure_log_search_index(conn, inspector):
+            added.append("log_events.line (full-text)")
+    return added
+
+def _has_duplicates(conn, index) -> bool:
+    from sqlalchemy import select, func
+    columns = list(index.columns)
+    return conn.execute(select(*columns).group_by(*columns).having(func.count() > 1).limit(1)).first() is not None
+
+def _column_ddl(column) -> str:
+    """Name, type and DEFAULT for ADD COLUMN; the default also fills the rows already in the table."""
+    from sqlalchemy import literal
+    ddl = f"{column.name} {column.type.compile(dialect=engine.dialect)}"
+    default = None
+    if column.server_default is not None:
+        default = str(column.server_default.arg)
+    elif column.default is not None and column.default.is_scalar:
+        default = str(literal(column.default.arg, column.type).compile(
+            dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+    if default is not None:
+        ddl += f" DEFAULT {default}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    return ddl
+
+_log_search = None
+
+def log_search_engine() -> str:
+    """How log_events.line is searched: fts5, fulltext or like (SQLite built without FTS5, other databases)."""
+    global _log_search
+    if _log_search is None:
+        from sqlalchemy import inspect
+        if engine.dialect.name == "sqlite":
+            _log_search = "fts5" if inspect(engine).has_table("log_events_fts") else "like"
+        elif engine.dialect.name in ("mysql", "mariadb"):
+            _log_search = "fulltext"
+        else:
+            _log_search = "like"
+    return _log_search
+
+def _ensure_log_search_index(conn, inspector) -> bool:
+    """Creates the full-text index of log_events.line if missing; True if it was created."""
+    from sqlalchemy import text
+    global _log_search
+    _log_search = None
+    if engine.dialect.name == "sqlite":
+        if inspector.has_table("log_events_fts"):
+            return False
+        # External-content table kept in step by triggers; events are never updated in place
+        from sqlalchemy.exc import OperationalError
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE VIRTUAL TABLE log_events_fts USING fts5(line, content='log_events', content_rowid='id')"))
+        except OperationalError as e:
+            print(f"SQLite without FTS5 ({e}); log search falls back to LIKE")
+            return False
+        conn.execute(text("CREATE TRIGGER log_events_ai AFTER INSERT ON log_events BEGIN "
+                          "INSERT INTO log_events_fts(rowid, line) VALUES (new.id, new.line); END"))
+        conn.execute(text("CREATE TRIGGER log_events_ad AFTER DELETE ON log_events BEGIN "
+                          "INSERT INTO log_events_fts(log_events_fts, rowid, line) VALUES ('delete', old.id, old.line); END"))
+        conn.execute(text("INSERT INTO log_events_fts(log_events_fts) VALUES ('rebuild')"))
+        return True
+    if engine.dialect.name in ("mysql", "mariadb"):
+        if any(i["name"] == "ft_log_events_line" for i in inspector.get_indexes("log_events")):
+            return False
+        conn.execute(text("ALTER TABLE log_events ADD FULLTEXT INDEX ft_log_events_line (line)"))
+        return True
+    return False
+
+def init_db():
+    migrate()
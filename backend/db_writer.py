@@ -0,0 +1,138 @@
+"""
+Single writer thread for SQLite production mode.
+
+SQLite allows one writer at a time. With every worker thread, the status
+writer, the throughput recorder and the log indexer committing on their own,
+they queue on the database file lock (and fail with "database is locked" once
+the busy timeout runs out), each paying for its own commit.
+
+Background writes call db_writer.run(fn) instead: fn(session) is queued, and
+the writer thread runs everything queued so far in one transaction with one
+commit, then returns each fn's result to its caller. When that transaction
+fails, the batch is replayed one fn per transaction, so only the failing
+write sees its error. API requests keep writing directly; with WAL and the
+busy timeout they wait for at most one batch.
+
+On MySQL (or with DB_SINGLE_WRITER=0) run() executes fn in the calling thread
+in a transaction of its own, as before.
+"""
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import SessionLocal, SQLITE_FILE, SQLITE_TUNED
+
+DB_SINGLE_WRITER = os.getenv("DB_SINGLE_WRITER", "1" if SQLITE_FILE and SQLITE_TUNED else "0") == "1"
+# Writes per transaction
+MAX_BATCH_WRITES = int(os.getenv("DB_WRITER_MAX_BATCH", 200))
+
+
+class _Write:
+    __slots__ = ("fn", "result", "error", "done")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+def _run_alone(fn):
+    db = SessionLocal()
+    try:
+        result = fn(db)
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class DbWriter:
+    def __init__(self, enabled: bool = DB_SINGLE_WRITER, max_batch: int = MAX_BATCH_WRITES):
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._queue = []
+        self._thread = None
+        self.batches = 0
+        self.writes = 0
+        self.replays = 0
+        self.failures = 0
+
+    def run(self, fn):
+        """Runs fn(session) in a committed transaction and returns its result; raises what fn raised."""
+        if not self.enabled or threading.current_thread() is self._thread:
+            return _run_alone(fn)
+        write = _Write(fn)
+        with self._cond:
+            self._queue.append(write)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            "enabled": self.enabled,
+            "queued_writes": queued,
+            "batches": self.batches,
+            "writes": self.writes,
+            "replays": self.replays,
+            "failures": self.failures,
+        }
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            try:
+                self._commit(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    self.failures += 1
+                    batch[0].error = e
+                else:
+                    self._replay(batch)
+            self.batches += 1
+            self.writes += len(batch)
+            for write in batch:
+                write.done.set()
+
+    def _commit(self, batch):
+        db = SessionLocal()
+        try:
+            results = [write.fn(db) for write in batch]
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        for write, result in zip(batch, results):
+            write.result = result
+
+    def _replay(self, batch):
+        """One transaction per write, after the batch's transaction failed."""
+        self.replays += 1
+        for write in batch:
+            try:
+                write.result = _run_alone(write.fn)
+            except Exception as e:
+                self.failures += 1
+                write.error = e
+
+
+db_writer = DbWriter()
@@ -0,0 +1,199 @@
+"""
+Job duration and per-mailbox ETA estimates.
+
+Throughput is learned from finished first-pass runs (started_at..finished_at
+and data_transferred of successful mailboxes). A least-squares fit of
+
+    run seconds = overhead + bytes / bytes_per_sec
+
+separates the fixed cost of a session (login, folder listing, comparison)
+from the per-session transfer rate. The job's own runs are used once there
+are ESTIMATE_MIN_RUNS of them, so the estimate follows the job live; before
+that the history of the same source/target host pair, then of all hosts,
+then ESTIMATE_DEFAULT_BYTES_PER_SEC.
+
+Mailbox sizes come from imapsync's folder-size scan (Mailbox.size_bytes), which
+a mailbox's first full sync runs even where the profile skips it (see
+build_imapsync_args); delta passes keep that size. Mailboxes not scanned yet
+are assumed to have the job's average scanned size, or the history's average
+run size. Running mailboxes subtract what their current run's throughput
+samples say is copied.
+Unfinished work is then handed out in queue order to the job's concurrency
+slots, earliest free slot first, which gives each mailbox's finish time and
+the job's.
+
+Delta passes only copy new mail; their mailboxes count as overhead only.
+"""
+import heapq
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import func, and_, or_
+from database import Job, Mailbox, ThroughputSample
+
+ESTIMATE_MIN_RUNS = int(os.getenv("ESTIMATE_MIN_RUNS", 5))
+ESTIMATE_HISTORY_RUNS = int(os.getenv("ESTIMATE_HISTORY_RUNS", 1000))
+ESTIMATE_DEFAULT_BYTES_PER_SEC = float(os.getenv("ESTIMATE_DEFAULT_BYTES_PER_SEC", 1024 * 1024))
+ESTIMATE_DEFAULT_OVERHEAD_SECONDS = float(os.getenv("ESTIMATE_DEFAULT_OVERHEAD_SECONDS", 30))
+# History fits change slowly; the job's own fit is recomputed on every request
+HISTORY_CACHE_SECONDS = 300
+
+UNFINISHED_STATUSES = ("validating", "pending", "running")
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def fit(runs):
+    """runs: [(seconds, bytes, messages)] -> learned rates, or None without usable runs."""
+    runs = [(seconds, data, messages) for seconds, data, messages in runs if seconds > 0 and data > 0]
+    if not runs:
+        return None
+    n = len(runs)
+    sum_s = sum(r[0] for r in runs)
+    sum_b = sum(r[1] for r in runs)
+    sum_m = sum(r[2] for r in runs)
+    mean_s, mean_b = sum_s / n, sum_b / n
+    var_b = sum((r[1] - mean_b) ** 2 for r in runs)
+    slope = sum((r[1] - mean_b) * (r[0] - mean_s) for r in runs) / var_b if var_b else 0
+    overhead = mean_s - slope * mean_b
+    if slope <= 0 or overhead < 0:
+        # Not enough spread (or noise) for two parameters: a pure rate
+        slope, overhead = sum_s / sum_b, 0.0
+    return {
+        "bytes_per_sec": round(1 / slope, 1),
+        "msgs_per_sec": round(sum_m / sum_s, 3),
+        "overhead_seconds": round(overhead, 1),
+        "mean_run_bytes": int(mean_b),
+        "runs": n,
+    }
+
+
+def _finished_runs(db, *criteria, limit: int = ESTIMATE_HISTORY_RUNS):
+    rows = db.query(Mailbox.started_at, Mailbox.finished_at, Mailbox.data_transferred,
+                    Mailbox.messages_transferred).join(Job, Job.id == Mailbox.job_id).filter(
+        Mailbox.status == 'success',
+        func.coalesce(Mailbox.pass_number, 1) == 1,
+        Mailbox.started_at.isnot(None),
+        Mailbox.finished_at.isnot(None),
+        Mailbox.data_transferred > 0,
+        *criteria,
+    ).order_by(Mailbox.id.desc()).limit(limit)
+    return [((row.finished_at - row.started_at).total_seconds(), row.data_transferred,
+             row.messages_transferred or 0) for row in rows]
+
+
+def _cached_fit(db, key, *criteria):
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and now - hit[0] < HISTORY_CACHE_SECONDS:
+            return hit[1]
+    rates = fit(_finished_runs(db, *criteria))
+    with _cache_lock:
+        _cache[key] = (now, rates)
+    return rates
+
+
+def learned_rates(db, job) -> dict:
+    runs = _finished_runs(db, Mailbox.job_id == job.id)
+    rates, source = (fit(runs), "job") if len(runs) >= ESTIMATE_MIN_RUNS else (None, None)
+    if rates is None:
+        rates, source = _cached_fit(db, ("pair", job.source_host, job.target_host),
+                                    Job.source_host == job.source_host, Job.target_host == job.target_host), \
+            "host_pair"
+    if rates is None:
+        rates, source = _cached_fit(db, ("all",)), "all_hosts"
+    if rates is None:
+        rates, source = {"bytes_per_sec": ESTIMATE_DEFAULT_BYTES_PER_SEC, "msgs_per_sec": None,
+                         "overhead_seconds": ESTIMATE_DEFAULT_OVERHEAD_SECONDS, "mean_run_bytes": None,
+                         "runs": 0}, "default"
+    return {**rates, "source": source}
+
+
+def _copied_bytes(db, started):
+    """
+    Bytes each running mailbox has copied so far in its current run, from its throughput samples.
+    started: {mailbox_id: started_at}; samples of earlier runs (failed attempts, retries) don't count.
+    """
+    from throughput import recorder, _floor
+    # Samples are stamped with the start of their 5s bucket, which may be a little before started_at
+    since = {mailbox_id: _floor(started_at, recorder.sample_seconds) if started_at else datetime.min
+             for mailbox_id, started_at in started.items()}
+    copied = {}
+    mailbox_ids = list(since)
+    for start in range(0, len(mailbox_ids), 200):
+        chunk = mailbox_ids[start:start + 200]
+        current_run = or_(*(and_(ThroughputSample.mailbox_id == mailbox_id, ThroughputSample.ts >= since[mailbox_id])
+                            for mailbox_id in chunk))
+        for row in db.query(ThroughputSample.mailbox_id, func.sum(ThroughputSample.bytes).label("bytes")) \
+                .filter(current_run).group_by(ThroughputSample.mailbox_id):
+            copied[row.mailbox_id] = int(row.bytes or 0)
+    for mailbox_id in mailbox_ids:
+        copied[mailbox_id] = copied.get(mailbox_id, 0) + sum(
+            data for ts, _, data, _ in recorder.pending_for(mailbox_id) if ts >= since[mailbox_id])
+    return copied
+
+
+def estimate(db, job, concurrency: int, now: datetime = None) -> dict:
+    now = now or datetime.utcnow()
+    rates = learned_rates(db, job)
+    bytes_per_sec, overhead = rates["bytes_per_sec"], rates["overhead_seconds"]
+
+    rows = db.query(Mailbox.id, Mailbox.status, Mailbox.size_bytes, Mailbox.pass_number, Mailbox.started_at) \
+        .filter(Mailbox.job_id == job.id, Mailbox.status.in_(UNFINISHED_STATUSES)).order_by(Mailbox.id).all()
+    scanned = db.query(func.avg(Mailbox.size_bytes), func.count(Mailbox.size_bytes)) \
+        .filter(Mailbox.job_id == job.id, Mailbox.size_bytes.isnot(None)).first()
+    default_size = int(scanned[0]) if scanned and scanned[1] else rates["mean_run_bytes"] or 0
+
+    running = [row for row in rows if row.status == "running"]
+    copied = _copied_bytes(db, {row.id: row.started_at for row in running}) if running else {}
+
+    def seconds_for(row):
+        if (row.pass_number or 1) > 1:
+            return overhead
+        size = row.size_bytes if row.size_bytes is not None else default_size
+        if row.status != "running":
+            return overhead + size / bytes_per_sec
+        left = max(size - copied.get(row.id, 0), 0) / bytes_per_sec
+        if not copied.get(row.id) and row.started_at:
+            # Nothing copied yet: still in the fixed part of the session
+            left += max(overhead - (now - row.started_at).total_seconds(), 0)
+        return left
+
+    # Work waits for the scheduled start; otherwise the estimate assumes the job runs from now
+    offset = 0.0
+    if job.status == "scheduled" and job.scheduled_start and job.scheduled_start > now:
+        offset = (job.scheduled_start - now).total_seconds()
+
+    slots = max(1, concurrency)
+    mailboxes = [(row, seconds_for(row)) for row in running]
+    ends = sorted(finish for _, finish in mailboxes)
+    # A slot frees up whenever a running sync ends; with more running than slots
+    # (concurrency lowered meanwhile) only the last `slots` endings free one
+    heap = ends[-slots:] if len(ends) >= slots else ends + [offset] * (slots - len(ends))
+    heapq.heapify(heap)
+    for row in rows:
+        if row.status == "running":
+            continue
+        finish = heap[0] + seconds_for(row)
+        heapq.heapreplace(heap, finish)
+        mailboxes.append((row, finish))
+
+    remaining = max((finish for _, finish in mailboxes), default=0.0)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "rates": rates,
+        "concurrency": slots,
+        "remaining_mailboxes": len(rows),
+        "remaining_seconds": round(remaining),
+        "finish_at": (now + timedelta(seconds=remaining)).isoformat() if rows else None,
+        "mailboxes": [{"id": row.id, "status": row.status, "eta_seconds": round(finish)}
+                      for row, finish in mailboxes],
+    }
@@ -0,0 +1,133 @@
+"""
+Idempotent mailbox ingestion for CSV uploads.
+
+A mailbox of a job is identified by its (source_user, target_user) pair, so
+uploading a corrected CSV again doesn't duplicate rows:
+
+- new pairs are inserted;
+- existing pairs get their credentials updated if they changed;
+- pairs that already succeeded are skipped, unless force is set;
+- other finished pairs (failed, stopped) are queued again;
+- pairs still pending, validating or running are left where they are.
+
+Repeated pairs inside one CSV are collapsed with a dict, the last row wins.
+Existing rows are loaded once per upload, not looked up per CSV row. The
+unique index uq_mailboxes_job_pair backs this up against two uploads to the
+same job at once: the one that inserts second is retried and then finds the
+other's rows.
+"""
+import csv
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import insert, func
+from sqlalchemy.exc import IntegrityError
+from database import Job, Mailbox, encrypt_password, decrypt_password
+
+# Rows per set-based UPDATE
+BATCH_SIZE = 500
+
+IN_PROGRESS_STATUSES = ("pending", "validating", "running")
+
+
+def parse_csv(text: str):
+    """Returns ({(source_user, target_user): (source_pass, target_pass)}, duplicates, invalid rows)."""
+    rows, duplicates, invalid = {}, 0, 0
+    for row in csv.reader(io.StringIO(text)):
+        if len(row) < 4:
+            invalid += 1
+            continue
+        key = (row[0].strip(), row[2].strip())
+        if not key[0] or not key[1]:
+            invalid += 1
+            continue
+        if key in rows:
+            duplicates += 1
+        rows[key] = (row[1], row[3])
+    return rows, duplicates, invalid
+
+
+def _decrypt(token: str):
+    try:
+        return decrypt_password(token)
+    except Exception:
+        return None  # Unreadable (e.g. key rotated): treat as changed
+
+
+def ingest(db, job_id: str, rows: dict, preflight: bool = False, force: bool = False) -> dict:
+    """
+    Applies parsed CSV rows to a job's mailboxes and adds the new ones to Job.total_mailboxes,
+    in one transaction. Commits, and returns the counts plus the ids that are to be validated
+    or queued (`queue`).
+    """
+    try:
+        return _ingest(db, job_id, rows, preflight, force)
+    except IntegrityError:
+        # A concurrent upload inserted some of the same pairs first; they are existing rows now
+        db.rollback()
+        return _ingest(db, job_id, rows, preflight, force)
+
+
+def _ingest(db, job_id: str, rows: dict, preflight: bool, force: bool) -> dict:
+    waiting_status, waiting_message = ('validating', 'Waiting for pre-flight login check') if preflight \
+        else ('pending', 'Queued again by CSV upload')
+
+    existing = {(row.source_user, row.target_user): row for row in db.query(
+        Mailbox.id, Mailbox.source_user, Mailbox.target_user, Mailbox.source_pass, Mailbox.target_pass,
+        Mailbox.status,
+    ).filter(Mailbox.job_id == job_id)}
+
+    new, credential_updates, requeue = [], [], []
+    skipped = in_progress = 0
+    for key, (source_pass, target_pass) in rows.items():
+        current = existing.get(key)
+        if current is None:
+            row = {"job_id": job_id, "source_user": key[0], "source_pass": encrypt_password(source_pass),
+                   "target_user": key[1], "target_pass": encrypt_password(target_pass)}
+            if preflight:
+                row.update(status=waiting_status, message=waiting_message)
+            new.append(row)
+            continue
+
+        changed = _decrypt(current.source_pass) != source_pass or _decrypt(current.target_pass) != target_pass
+        if changed:
+            credential_updates.append({"id": current.id, "source_pass": encrypt_password(source_pass),
+                                       "target_pass": encrypt_password(target_pass)})
+        if current.status in IN_PROGRESS_STATUSES:
+            in_progress += 1
+        elif current.status == 'success' and not force:
+            skipped += 1
+        else:
+            requeue.append(current.id)
+
+    new_ids = []
+    if new:
+        # One executemany; ORM objects would be flushed with one INSERT each
+        for start in range(0, len(new), BATCH_SIZE):
+            db.execute(insert(Mailbox), new[start:start + BATCH_SIZE])
+        added = {(row["source_user"], row["target_user"]) for row in new}
+        new_ids = [row.id for row in db.query(Mailbox.id, Mailbox.source_user, Mailbox.target_user)
+                   .filter(Mailbox.job_id == job_id) if (row.source_user, row.target_user) in added]
+        # Incremented in SQL with the inserts: concurrent uploads don't lose counts, and the
+        # recount never sees more rows than total_mailboxes
+        db.query(Job).filter(Job.id == job_id).update(
+            {Job.total_mailboxes: func.coalesce(Job.total_mailboxes, 0) + len(new)}, synchronize_session=False)
+    if credential_updates:
+        db.bulk_update_mappings(Mailbox, credential_updates)
+    for start in range(0, len(requeue), BATCH_SIZE):
+        chunk = requeue[start:start + BATCH_SIZE]
+        db.query(Mailbox).filter(Mailbox.id.in_(chunk), Mailbox.status.notin_(IN_PROGRESS_STATUSES)).update(
+            {Mailbox.status: waiting_status, Mailbox.message: waiting_message}, synchronize_session=False)
+    db.commit()
+
+    return {
+        "added": len(new),
+        "updated_credentials": len(credential_updates),
+        "requeued": len(requeue),
+        "skipped_successful": skipped,
+        "in_progress": in_progress,
+        "queue": new_ids + requeue,
+    }
@@ -0,0 +1,186 @@
+"""
+Typed job options and provider tuning profiles.
+
+A job picks a profile (generic, gmail, office365, dovecot) that supplies
+imapsync performance defaults; any field set explicitly on the job overrides
+the profile. Options are validated when the job is created and stored as JSON
+on Job.options; build_imapsync_args() turns them into command-line flags.
+"""
+import re
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+Profile = Literal["generic", "gmail", "office365", "dovecot"]
+
+# Defaults per provider. Keys are JobOptions tuning fields.
+PROFILES = {
+    # Safe everywhere: bigger read buffer, skip the per-folder size scan (a mailbox's
+    # first full sync still runs it, see build_imapsync_args)
+    "generic": {
+        "buffersize": 8 * 1024 * 1024,
+        "nofoldersizes": True,
+    },
+    # Gmail throttles large FETCH/APPEND batches and its COMPRESS is unreliable
+    # with SSL even though it is advertised; Message-Id alone identifies
+    # messages across labels.
+    "gmail": {
+        "buffersize": 8 * 1024 * 1024,
+        "nofoldersizes": True,
+        "split1": 100,
+        "split2": 100,
+        "compress1": False,
+        "compress2": False,
+        "useheader": ["Message-Id"],
+        "maxsize": 35 * 1000 * 1000,
+    },
+    # Exchange Online: no COMPRESS, strict per-session throttling, message size limit
+    "office365": {
+        "buffersize": 8 * 1024 * 1024,
+        "nofoldersizes": True,
+        "split1": 100,
+        "split2": 100,
+        "compress1": False,
+        "compress2": False,
+        "maxsize": 45 * 1000 * 1000,
+    },
+    # Dovecot handles large batches and COMPRESS=DEFLATE well
+    # (compress is still only used where the probe saw it advertised)
+    "dovecot": {
+        "buffersize": 16 * 1024 * 1024,
+        "nofoldersizes": True,
+        "split1": 500,
+        "split2": 500,
+        "compress1": True,
+        "compress2": True,
+        "fastio1": True,
+        "fastio2": True,
+    },
+}
+
+TUNING_FIELDS = [
+    "buffersize", "split1", "split2", "nofoldersizes", "compress1", "compress2",
+    "useheader", "fastio1", "fastio2", "maxsize",
+]
+
+HEADER_NAME = re.compile(r"^[A-Za-z0-9-]{1,64}$")
+
+
+class JobOptions(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    profile: Profile = "generic"
+
+    # Feature flags
+    sync_internal_dates: bool = False
+    skip_trash: bool = False
+    dry_run: bool = False
+    concurrency: Optional[int] = Field(default=None, ge=1, le=50)
+
+    # Tuning overrides (None = use the profile's value)
+    buffersize: Optional[int] = Field(default=None, ge=4096, le=256 * 1024 * 1024)
+    split1: Optional[int] = Field(default=None, ge=1, le=10000)
+    split2: Optional[int] = Field(default=None, ge=1, le=10000)
+    nofoldersizes: Optional[bool] = None
+    compress1: Optional[bool] = None
+    compress2: Optional[bool] = None
+    useheader: Optional[List[str]] = None
+    fastio1: Optional[bool] = None
+    fastio2: Optional[bool] = None
+    maxsize: Optional[int] = Field(default=None, ge=1024)
+
+    @field_validator("useheader")
+    @classmethod
+    def check_headers(cls, value):
+        if value is not None:
+            for header in value:
+                if not HEADER_NAME.match(header):
+                    raise ValueError(f"Invalid header name: {header!r}")
+        return value
+
+    def resolved(self, capabilities: Optional[dict] = None) -> dict:
+        """
+        Tuning values: profile defaults, adjusted to the probed server capabilities
+        (see capabilities.py), then explicit job settings.
+        """
+        values = dict(PROFILES[self.profile])
+        capabilities = capabilities or {}
+        for flag, side in (("compress1", "source"), ("compress2", "target")):
+            if side in capabilities:
+                # On where advertised, unless the profile turns it off
+                values[flag] = values.get(flag, True) and capabilities[side].get("compress", False)
+        appendlimit = capabilities.get("target", {}).get("appendlimit")
+        if appendlimit:
+            # The target would reject bigger APPENDs anyway; skip them up front
+            values["maxsize"] = min(values.get("maxsize") or appendlimit, appendlimit)
+        for name in TUNING_FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                values[name] = value
+        return values
+
+
+def load_job_options(stored) -> JobOptions:
+    """
+    Parses options stored on a Job. Older jobs may hold a JSON string or unknown
+    keys; those are dropped rather than failing the sync.
+    """
+    if not stored:
+        return JobOptions()
+    if isinstance(stored, str):
+        import json
+        try:
+            stored = json.loads(stored)
+        except ValueError:
+            return JobOptions()
+    known = {k: v for k, v in stored.items() if k in JobOptions.model_fields}
+    try:
+        return JobOptions(**known)
+    except ValidationError as e:
+        print(f"Ignoring invalid stored job options: {e}")
+        return JobOptions()
+
+
+def build_imapsync_args(options: JobOptions, capabilities: Optional[dict] = None,
+                        scan_sizes: bool = False) -> List[str]:
+    """
+    scan_sizes: the mailbox's size isn't known yet. The profiles' --nofoldersizes is then
+    left out, so imapsync's folder-size scan records it for the estimator; a job that sets
+    nofoldersizes explicitly keeps it.
+    """
+    args = []
+    tuning = options.resolved(capabilities)
+    if scan_sizes and options.nofoldersizes is None:
+        tuning["nofoldersizes"] = False
+
+    if tuning.get("buffersize"):
+        args.extend(["--buffersize", str(tuning["buffersize"])])
+    if tuning.get("split1"):
+        args.extend(["--split1", str(tuning["split1"])])
+    if tuning.get("split2"):
+        args.extend(["--split2", str(tuning["split2"])])
+    if tuning.get("nofoldersizes"):
+        args.append("--nofoldersizes")
+    if tuning.get("compress1"):
+        args.append("--compress1")
+    if tuning.get("compress2"):
+        args.append("--compress2")
+    for header in tuning.get("useheader") or []:
+        args.extend(["--useheader", header])
+    if tuning.get("fastio1"):
+        args.append("--fastio1")
+    if tuning.get("fastio2"):
+        args.append("--fastio2")
+    if tuning.get("maxsize"):
+        args.extend(["--maxsize", str(tuning["maxsize"])])
+
+    # Feature flags
+    if options.sync_internal_dates:
+        args.append("--syncinternaldates")
+    if options.skip_trash:
+        # Common trash folder names, can be expanded
+        args.extend(["--exclude", "Trash", "--exclude", "Bin", "--exclude", "Deleted Items"])
+    if options.dry_run:
+        args.append("--dry")
+
+    return args
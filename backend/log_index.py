@@ -0,0 +1,207 @@
+"""
+Searchable index of error and key lines from imapsync logs.
+
+While a sync runs, its SummaryParser hands every error / key-event line (see
+output_pipe.classify) to the process-wide log_index. They are bulk-inserted
+into log_events every LOG_INDEX_FLUSH_SECONDS; a new run of a mailbox replaces
+the lines of its previous run, as it replaces its log file.
+
+search() answers GET /api/search/logs from the full-text index that migrate()
+puts on log_events.line (FTS5 on SQLite, FULLTEXT on MySQL, LIKE otherwise),
+so triage never reads the logs/ directory.
+
+Usage: python log_index.py --backfill   (index logs written before this existed)
+"""
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from database import SessionLocal, LogEvent, Mailbox, ArchivedMailbox, log_search_engine
+from db_writer import db_writer
+
+LOG_INDEX_FLUSH_SECONDS = float(os.getenv("LOG_INDEX_FLUSH_SECONDS", 2))
+MAX_SEARCH_LINES = 1000
+
+# Search terms: words only, so user input can't break the MATCH syntax
+TERM = re.compile(r"\w+", re.UNICODE)
+
+
+class LogIndexer:
+    def __init__(self, flush_seconds: float = LOG_INDEX_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._events = []       # (mailbox_id, job_id, ts, kind, line)
+        self._resets = set()    # mailboxes whose earlier lines are to be dropped
+        self._thread = None
+        self.lines_written = 0
+
+    def start_run(self, mailbox_id: int):
+        """A new run of the mailbox starts a new log: forget the previous run's lines."""
+        with self._lock:
+            self._events = [e for e in self._events if e[0] != mailbox_id]
+            self._resets.add(mailbox_id)
+
+    def add(self, mailbox_id: int, job_id: str, kind: str, line: str):
+        with self._lock:
+            self._events.append((mailbox_id, job_id, datetime.utcnow(), kind, line))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="log-index", daemon=True)
+                self._thread.start()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+                resets, self._resets = self._resets, set()
+            if not events and not resets:
+                return
+            def write(db):
+                reset_ids = sorted(resets)
+                for start in range(0, len(reset_ids), 500):
+                    db.query(LogEvent).filter(LogEvent.mailbox_id.in_(reset_ids[start:start + 500])) \
+                        .delete(synchronize_session=False)
+                if events:
+                    db.bulk_insert_mappings(LogEvent, [
+                        {"mailbox_id": mailbox_id, "job_id": job_id, "ts": ts, "kind": kind, "line": line}
+                        for mailbox_id, job_id, ts, kind, line in events])
+
+            try:
+                db_writer.run(write)
+            except Exception:
+                with self._lock:
+                    self._events = events + self._events
+                    self._resets |= resets
+                raise
+            self.lines_written += len(events)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"queued_lines": len(self._events), "lines_written": self.lines_written,
+                    "search": log_search_engine()}
+
+    def _loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Log index flush failed (will retry): {e}")
+
+
+def _terms(q: str):
+    return TERM.findall(q)[:10]
+
+
+def _matching(db, terms, job_id, kind, limit):
+    engine = log_search_engine()
+    params = {"limit": limit}
+    filters = ""
+    if job_id:
+        filters += " AND e.job_id = :job_id"
+        params["job_id"] = job_id
+    if kind:
+        filters += " AND e.kind = :kind"
+        params["kind"] = kind
+
+    if engine == "fts5":
+        # Every term, as a prefix: "auth" finds AUTHENTICATIONFAILED
+        params["q"] = " ".join(f'"{term}"*' for term in terms)
+        sql = ("SELECT e.id, e.mailbox_id, e.job_id, e.ts, e.kind, e.line FROM log_events_fts "
+               "JOIN log_events e ON e.id = log_events_fts.rowid "
+               f"WHERE log_events_fts MATCH :q{filters} ORDER BY e.id DESC LIMIT :limit")
+    elif engine == "fulltext":
+        params["q"] = " ".join(f"+{term}*" for term in terms)
+        sql = ("SELECT e.id, e.mailbox_id, e.job_id, e.ts, e.kind, e.line FROM log_events e "
+               f"WHERE MATCH(e.line) AGAINST (:q IN BOOLEAN MODE){filters} ORDER BY e.id DESC LIMIT :limit")
+    else:
+        likes = []
+        for n, term in enumerate(terms):
+            params[f"t{n}"] = f"%{term}%"
+            likes.append(f"e.line LIKE :t{n}")
+        sql = ("SELECT e.id, e.mailbox_id, e.job_id, e.ts, e.kind, e.line FROM log_events e "
+               f"WHERE {' AND '.join(likes)}{filters} ORDER BY e.id DESC LIMIT :limit")
+    return engine, db.execute(text(sql), params).all()
+
+
+def search(db, q: str, job_id: str = None, kind: str = None, limit: int = 200) -> dict:
+    """Matching lines, newest first, grouped by mailbox."""
+    terms = _terms(q)
+    if not terms:
+        return {"query": q, "engine": log_search_engine(), "total_lines": 0, "mailboxes": []}
+    engine, rows = _matching(db, terms, job_id, kind, min(limit, MAX_SEARCH_LINES))
+
+    mailbox_ids = sorted({row.mailbox_id for row in rows})
+    info = {}
+    for model in (Mailbox, ArchivedMailbox):
+        missing = [mailbox_id for mailbox_id in mailbox_ids if mailbox_id not in info]
+        for start in range(0, len(missing), 500):
+            for mb in db.query(model.id, model.source_user, model.target_user, model.status) \
+                    .filter(model.id.in_(missing[start:start + 500])):
+                info[mb.id] = mb
+
+    grouped = {}
+    for row in rows:
+        mb = info.get(row.mailbox_id)
+        entry = grouped.setdefault(row.mailbox_id, {
+            "id": row.mailbox_id,
+            "job_id": row.job_id,
+            "user": mb.source_user if mb else None,
+            "target_user": mb.target_user if mb else None,
+            "status": mb.status if mb else None,
+            "lines": [],
+        })
+        entry["lines"].append({"ts": str(row.ts), "kind": row.kind, "line": row.line})
+    return {"query": q, "engine": engine, "total_lines": len(rows), "mailboxes": list(grouped.values())}
+
+
+def delete_events(db, mailbox_ids):
+    if mailbox_ids:
+        db.query(LogEvent).filter(LogEvent.mailbox_id.in_(mailbox_ids)).delete(synchronize_session=False)
+
+
+def backfill(log_dir: str = "logs"):
+    """Indexes existing logs/<mailbox id>.log files of mailboxes that have no lines indexed yet."""
+    from output_pipe import SummaryParser
+    db = SessionLocal()
+    try:
+        indexed = {row.mailbox_id for row in db.query(LogEvent.mailbox_id).distinct()}
+        jobs = dict(db.query(Mailbox.id, Mailbox.job_id).all())
+    finally:
+        db.close()
+    indexer = LogIndexer()
+    files = 0
+    for name in os.listdir(log_dir):
+        stem, ext = os.path.splitext(name)
+        if ext != ".log" or not stem.isdigit():
+            continue
+        mailbox_id = int(stem)
+        if mailbox_id in indexed or mailbox_id not in jobs:
+            continue
+        parser = SummaryParser(on_event=lambda kind, line, m=mailbox_id: indexer.add(m, jobs[m], kind, line))
+        with open(os.path.join(log_dir, name), "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                parser.feed(chunk)
+        parser.finish()
+        files += 1
+        if files % 500 == 0:
+            indexer.flush()
+    indexer.flush()
+    return files, indexer.lines_written
+
+
+log_index = LogIndexer()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["--backfill"]:
+        print(__doc__)
+        sys.exit(1)
+    files, lines = backfill()
+    print(f"Indexed {lines} lines from {files} log files")
@@ -1,29 +1,34 @@
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, UploadFile, File
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, UploadFile, File, Query, Response
 from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.responses import StreamingResponse, FileResponse
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import or_, and_
+from contextlib import asynccontextmanager
+import base64
+from typing import List, Optional
+import threading
 import uuid
-import csv
-import io
 import os
 import sys
 
 # Add current directory to sys.path to ensure modules can be imported
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from database import SessionLocal, engine, init_db, Job, Mailbox, User
+from database import SessionLocal, engine, migrate, Job, Mailbox, User, SyncPass, ArchivedMailbox
 from auth import Token, get_current_user, create_access_token, verify_password, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES
-from datetime import timedelta
-from pydantic import BaseModel
+from datetime import datetime, timedelta
+from pydantic import BaseModel, Field
 from worker import run_imapsync
+from job_options import JobOptions, PROFILES, load_job_options
+import archive
+import run_windows
+from run_windows import RunWindows
+import control
+import throughput
+import estimator
+import log_index
 
-# Initialize DB safely
-try:
-    init_db()
-    print("Database initialized successfully.")
-except Exception as e:
-    error_msg = f"Failed to initialize database: {str(e)}"
+def _log_startup_error(error_msg):
     print(error_msg)
     # Log to file for cPanel visibility
     try:
@@ -33,11 +38,92 @@ except Exception as e:
     except:
         pass
 
-# Ensure logs directory exists
-if not os.path.exists("logs"):
-    os.makedirs("logs")
+def _auto_migrate():
+    try:
+        migrate()
+        print("Database initialized successfully.")
+    except Exception as e:
+        _log_startup_error(f"Failed to initialize database: {str(e)}")
+
+def _recover_and_resume():
+    """Re-queue mailboxes orphaned by a previous process and re-enqueue pending ones."""
+    from worker import recover_orphans
+    db = SessionLocal()
+    try:
+        mailbox_ids = recover_orphans(db)
+    except Exception as e:
+        _log_startup_error(f"Startup recovery sweep failed: {str(e)}")
+        return
+    finally:
+        db.close()
+    if mailbox_ids:
+        print(f"Recovery: re-enqueued {len(mailbox_ids)} mailboxes")
+        enqueue_mailboxes(mailbox_ids)
+
+def _background_init():
+    if os.getenv("AUTO_MIGRATE", "0") == "1":
+        _auto_migrate()
+    _recover_and_resume()
+    # Retention policy, and archive/delete runs interrupted by the last shutdown
+    import worker
+    archive.start_maintenance(worker.shutting_down)
+    # Starts and parks jobs at their scheduled start / run window boundaries
+    run_windows.start_window_loop(worker.shutting_down, enqueue_mailboxes)
+
+_started = False
+_startup_lock = threading.Lock()
+
+def startup():
+    """
+    Deferred initialization, run from the lifespan handler (or explicitly by
+    passenger_wsgi.py, since a2wsgi doesn't emit lifespan events).
+    Nothing here blocks on the database: schema changes belong to `python migrate.py`
+    (AUTO_MIGRATE=1 runs them in the background), as does the orphan recovery sweep.
+    """
+    global _started
+    with _startup_lock:
+        if _started:
+            return
+        _started = True
 
-app = FastAPI()
+    import worker
+    worker.shutting_down.clear()
+
+    # Ensure logs directory exists
+    os.makedirs("logs", exist_ok=True)
+
+    # Stop/cancel/checkpoint requests for syncs this process owns may come from any node
+    control.ensure_poller()
+
+    threading.Thread(target=_background_init, name="startup-init", daemon=True).start()
+
+    try:
+        assets.preload()
+    except Exception as e:
+        _log_startup_error(f"Failed to load frontend assets: {str(e)}")
+
+def shutdown():
+    """
+    Graceful drain on SIGTERM (uvicorn turns it into lifespan shutdown): stop claiming,
+    wait up to SHUTDOWN_DRAIN_SECONDS for running syncs, then checkpoint the rest to pending.
+    """
+    global _started
+    import worker
+    drain_seconds = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", 0))
+    interrupted = worker.shutdown(drain_seconds)
+    if interrupted:
+        print(f"Shutdown: checkpointed {len(interrupted)} running mailboxes for resume")
+    with _startup_lock:
+        _started = False
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup()
+    yield
+    import asyncio
+    await asyncio.to_thread(shutdown)
+
+app = FastAPI(lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 app.add_middleware(
@@ -69,12 +155,25 @@ def health_check():
     # Check imapsync
     imapsync_path = shutil.which("imapsync")
     
+    from uid_cache import uid_caches
+    from output_pipe import pipe_metrics
+    from status_writer import status_writer
+    from db_writer import db_writer
+    
     return {
         "status": "ok",
         "python": sys.version,
         "cwd": os.getcwd(),
         "database": db_status,
-        "imapsync": imapsync_path or "not found"
+        "imapsync": imapsync_path or "not found",
+        "uid_cache": uid_caches.usage(),
+        "pipes": pipe_metrics.snapshot(),
+        "scheduler": scheduler.snapshot(),
+        "admission": admission.snapshot(),
+        "status_writer": status_writer.snapshot(),
+        "db_writer": db_writer.snapshot(),
+        "throughput": throughput.recorder.snapshot(),
+        "log_index": log_index.log_index.snapshot()
     }
 
 # Dependency
@@ -121,7 +220,15 @@ class JobCreate(BaseModel):
     target_port: int = 993
     source_security: str = "SSL/TLS"
     target_security: str = "SSL/TLS"
-    options: dict = {} # JSON Options
+    options: JobOptions = JobOptions()
+    priority: int = Field(default=5, ge=1, le=10) # Share of worker slots relative to other jobs
+    max_concurrency: Optional[int] = Field(default=None, ge=1, le=50) # Defaults to options.concurrency
+    scheduled_start: Optional[datetime] = None # Don't start before this (naive = UTC)
+    run_windows: Optional[RunWindows] = None # Only sync inside these recurring windows
+
+class JobSchedule(BaseModel):
+    scheduled_start: Optional[datetime] = None
+    run_windows: Optional[RunWindows] = None
 
 class JobResponse(BaseModel):
     id: str
@@ -134,6 +241,7 @@ class JobResponse(BaseModel):
     source: str
     target: str
     data_transferred: str = "0 B" # Formatted string
+    data_transferred_bytes: int = 0
     created_at: str
 
     class Config:
@@ -150,10 +258,6 @@ class MailboxCreate(BaseModel):
 async def create_job(job_data: JobCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     job_id = str(uuid.uuid4())
     
-    # Process Options
-    import json
-    options_json = json.dumps(job_data.options)
-    
     db_job = Job(
         id=job_id,
         name=job_data.name,
@@ -163,18 +267,69 @@ async def create_job(job_data: JobCreate, background_tasks: BackgroundTasks, db:
         target_port=job_data.target_port,
         source_security=job_data.source_security,
         target_security=job_data.target_security,
-        options=options_json,
-        status="running" # Auto start for demo
+        options=job_data.options.model_dump(exclude_none=True),
+        priority=job_data.priority,
+        max_concurrency=job_data.max_concurrency or job_data.options.concurrency,
+        scheduled_start=run_windows.to_utc_naive(job_data.scheduled_start),
+        run_windows=job_data.run_windows.model_dump(mode="json") if job_data.run_windows else None,
     )
+    # Auto start, unless the job waits for its scheduled start or run window
+    db_job.status = run_windows.active_status(db_job)
     db.add(db_job)
     db.commit()
     return format_job_response(db_job)
 
-from concurrent.futures import ThreadPoolExecutor
+@app.put("/api/jobs/{job_id}/schedule")
+def update_job_schedule(job_id: str, schedule: JobSchedule, db: Session = Depends(get_db)):
+    """Sets or clears the scheduled start and run windows. Syncs already running are checkpointed by the window loop."""
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.scheduled_start = run_windows.to_utc_naive(schedule.scheduled_start)
+    job.run_windows = schedule.run_windows.model_dump(mode="json") if schedule.run_windows else None
+    if job.status in ('pending', 'running', 'scheduled'):
+        job.status = run_windows.active_status(job)
+    db.commit()
+    if job.status == 'running':
+        enqueue_mailboxes([row.id for row in db.query(Mailbox.id).filter(
+            Mailbox.job_id == job_id, Mailbox.status == 'pending')])
+    return {"message": "Schedule updated", "status": job.status}
 
-# Global Executor
+@app.get("/api/profiles")
+def list_profiles():
+    """Tuning defaults per server profile, for the create-job form."""
+    return PROFILES
+
+from scheduler import FairScheduler
+from admission import AdmissionController
+
+# Global worker pool, shared fairly between jobs; MAX_WORKERS is the upper bound,
+# the admission controller lowers it while memory or CPU are short
 max_workers = int(os.getenv("MAX_WORKERS", 2))
-executor = ThreadPoolExecutor(max_workers=max_workers) 
+admission = AdmissionController(max_workers)
+scheduler = FairScheduler(run_imapsync, workers=max_workers, admit=admission.admit)
+
+def enqueue_mailboxes(mailbox_ids):
+    """Queues mailboxes on their job's fair-share queue. Duplicates are harmless: the worker claims atomically."""
+    mailbox_ids = list(mailbox_ids)
+    if not mailbox_ids:
+        return
+    from ingest import BATCH_SIZE
+    db = SessionLocal()
+    try:
+        # Chunked: a large upload can exceed the database's limit on bound parameters
+        rows = []
+        for start in range(0, len(mailbox_ids), BATCH_SIZE):
+            rows.extend(db.query(Mailbox.id, Mailbox.job_id, Job.priority, Job.max_concurrency)
+                        .join(Job, Job.id == Mailbox.job_id)
+                        .filter(Mailbox.id.in_(mailbox_ids[start:start + BATCH_SIZE])).all())
+    finally:
+        db.close()
+    by_job = {}
+    for row in rows:
+        by_job.setdefault((row.job_id, row.priority, row.max_concurrency), []).append(row.id)
+    for (job_id, priority, max_concurrency), ids in by_job.items():
+        scheduler.submit(job_id, ids, priority=priority, max_concurrency=max_concurrency)
 
 @app.post("/api/jobs/{job_id}/mailboxes")
 async def add_single_mailbox(job_id: str, mailbox_data: MailboxCreate, db: Session = Depends(get_db)):
@@ -182,106 +337,203 @@ async def add_single_mailbox(job_id: str, mailbox_data: MailboxCreate, db: Sessi
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    from database import encrypt_password
-    
-    mb = Mailbox(
-        job_id=job_id,
-        source_user=mailbox_data.source_user,
-        source_pass=encrypt_password(mailbox_data.source_pass),
-        target_user=mailbox_data.target_user,
-        target_pass=encrypt_password(mailbox_data.target_pass)
-    )
-    db.add(mb)
-    
-    job.total_mailboxes += 1
-    
+    import ingest
+    key = (mailbox_data.source_user.strip(), mailbox_data.target_user.strip())
+    if not key[0] or not key[1]:
+        raise HTTPException(status_code=422, detail="source_user and target_user are required")
+    # Same path as a one-row CSV upload, so the pair is never added twice
+    result = ingest.ingest(db, job_id, {key: (mailbox_data.source_pass, mailbox_data.target_pass)})
+    queue = result.pop("queue")
+
+    if queue and job.status in ('completed', 'failed'):
+        job.status = run_windows.active_status(job)
     db.commit()
-    
+    mailbox_id = db.query(Mailbox.id).filter(Mailbox.job_id == job_id, Mailbox.source_user == key[0],
+                                             Mailbox.target_user == key[1]).scalar()
+
+    if not queue:
+        message = "Mailbox already synced" if result["skipped_successful"] else "Mailbox already queued or running"
+        return {"message": message, "mailbox_id": mailbox_id, **result}
+    if job.status == 'scheduled':
+        return {"message": "Mailbox queued for the job's scheduled start", "mailbox_id": mailbox_id,
+                "scheduled": True, **result}
+
     # Submit task
-    executor.submit(run_imapsync, mb.id)
-    
-    return {"message": "Mailbox added and started", "mailbox_id": mb.id}
+    enqueue_mailboxes(queue)
+
+    message = "Mailbox added and started" if result["added"] else "Mailbox queued again"
+    return {"message": message, "mailbox_id": mailbox_id, **result}
+
+def start_preflight(job_id: str, mailbox_ids):
+    """Runs the pre-flight login check in the background and enqueues the mailboxes that pass."""
+    def run():
+        from preflight import run_preflight
+        enqueue_mailboxes(run_preflight(job_id, mailbox_ids))
+    threading.Thread(target=run, name=f"preflight-{job_id}", daemon=True).start()
 
 @app.post("/api/upload/{job_id}")
-async def upload_csv(job_id: str, background_tasks: BackgroundTasks, file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_csv(job_id: str, background_tasks: BackgroundTasks, file: UploadFile = File(...), preflight: bool = False,
+                     force: bool = False, db: Session = Depends(get_db)):
+    """
+    Adds the CSV's mailboxes to a job. Uploading again is safe: pairs already in the job are
+    updated instead of duplicated, and successful ones are only synced again with force=true.
+    """
     job = db.query(Job).filter(Job.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
+    import ingest
     content = await file.read()
-    csv_text = content.decode('utf-8')
-    reader = csv.reader(io.StringIO(csv_text))
-    
-    from database import encrypt_password
-    
-    count = 0
-    mailboxes = []
-    for row in reader:
-        if len(row) < 4: continue
-        mb = Mailbox(
-            job_id=job_id,
-            source_user=row[0],
-            source_pass=encrypt_password(row[1]),
-            target_user=row[2],
-            target_pass=encrypt_password(row[3])
-        )
-        db.add(mb)
-        # Add to list to commit later or commit one by one? 
-        # Commit one by one is safer for getting IDs.
-        db.commit()
-        mailboxes.append(mb)
-        count += 1
+    rows, duplicates, invalid = ingest.parse_csv(content.decode('utf-8'))
+    result = ingest.ingest(db, job_id, rows, preflight=preflight, force=force)
+    queue = result.pop("queue")
+    result.update(duplicates=duplicates, invalid=invalid)
 
-    job.total_mailboxes += count # Increment instead of overwrite to support mixed usage
+    if queue and job.status in ('completed', 'failed'):
+        job.status = run_windows.active_status(job)
     db.commit()
 
+    summary = (f"{result['added']} new, {result['requeued']} queued again, "
+               f"{result['skipped_successful']} already synced, {duplicates} duplicate rows")
+    if preflight:
+        start_preflight(job_id, queue)
+        return {"message": f"Validating {len(queue)} mailboxes before start ({summary})", "preflight": True, **result}
+
+    if job.status == 'scheduled':
+        return {"message": f"Queued {len(queue)} mailboxes for the job's scheduled start ({summary})",
+                "scheduled": True, **result}
+
     # Submit tasks to executor for parallel execution
-    for mb in mailboxes:
-        executor.submit(run_imapsync, mb.id)
+    enqueue_mailboxes(queue)
 
-    return {"message": f"Started {count} mailboxes"}
+    return {"message": f"Started {len(queue)} mailboxes ({summary})", **result}
 
-@app.delete("/api/jobs")
+@app.delete("/api/jobs", status_code=202)
 def delete_all_jobs(db: Session = Depends(get_db)):
+    """Stops every sync and deletes all jobs in the background (see archive.py)."""
+    job_ids = [row.id for row in db.query(Job.id)]
+    db.query(Job).update({Job.status: "deleting"}, synchronize_session=False)
+    running = [row.id for row in db.query(Mailbox.id).filter(Mailbox.status == 'running')]
+    db.commit()
+    # Owners pick the stops up within a poll interval; don't hold the request for the acks.
+    # delete_job leaves those rows until the stopped syncs have made their final write.
+    control.send(db, running, "stop", "Job deleted")
+
+    archive.start_in_background(archive.delete_job, job_ids)
+    return {"message": f"Deleting {len(job_ids)} jobs in the background", "jobs": len(job_ids)}
+
+def _idle_job(db: Session, job_id: str) -> Job:
+    """Loads a job that no sync can touch any more, for archive/delete."""
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status in archive.BUSY_STATUSES and job.status != "archived":
+        raise HTTPException(status_code=409, detail=f"Job is already {job.status}")
+    active = db.query(Mailbox.id).filter(Mailbox.job_id == job_id,
+                                         Mailbox.status.in_(archive.ACTIVE_MAILBOX_STATUSES)).first()
+    if active:
+        raise HTTPException(status_code=409, detail="Job has running mailboxes; cancel or pause it first")
+    return job
+
+@app.delete("/api/jobs/{job_id}", status_code=202)
+def delete_job(job_id: str, db: Session = Depends(get_db)):
+    job = _idle_job(db, job_id)
+    job.status = "deleting"
+    db.commit()
+    archive.start_in_background(archive.delete_job, [job_id])
+    return {"message": "Job deletion started"}
+
+@app.post("/api/jobs/{job_id}/archive", status_code=202)
+def archive_job(job_id: str, db: Session = Depends(get_db)):
+    """Moves the job's mailbox rows and logs out of the hot tables (see archive.py)."""
+    job = _idle_job(db, job_id)
+    if job.status == "archived":
+        raise HTTPException(status_code=409, detail="Job is already archived")
+    pending = db.query(Mailbox.id).filter(Mailbox.job_id == job_id, Mailbox.status == 'pending').first()
+    if pending:
+        raise HTTPException(status_code=409, detail="Job still has queued mailboxes")
+    job.status = "archiving"
+    db.commit()
+    archive.start_in_background(archive.archive_job, [job_id])
+    return {"message": "Job archiving started"}
+
+# Only what the dashboard table needs; rows are plain tuples, not ORM objects
+JOB_SUMMARY_COLUMNS = (
+    Job.id, Job.name, Job.status, Job.total_mailboxes, Job.completed, Job.failed,
+    Job.source_host, Job.target_host, Job.data_transferred, Job.created_at,
+)
+
+# A write stamps updated_at before it commits; re-send rows from a little before the
+# cursor so that late commits aren't missed (the client ignores unchanged rows)
+DELTA_OVERLAP_SECONDS = 10
+
+def _decode_since(since: str) -> datetime:
     try:
-        # Delete Log Files
-        import shutil
-        log_dir = "logs"
-        if os.path.exists(log_dir):
-            for filename in os.listdir(log_dir):
-                file_path = os.path.join(log_dir, filename)
-                try:
-                    if os.path.isfile(file_path) or os.path.islink(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    print(f'Failed to delete {file_path}. Reason: {e}')
-
-        # Delete DB Records
-        db.query(Mailbox).delete()
-        db.query(Job).delete()
-        db.commit()
-        return {"message": "All jobs and history deleted"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
+        return datetime.fromisoformat(since) - timedelta(seconds=DELTA_OVERLAP_SECONDS)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid since cursor")
+
+def _encode_cursor(created_at: datetime, job_id: str) -> str:
+    raw = f"{created_at.isoformat()}|{job_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, job_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), job_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.get("/api/jobs", response_model=List[JobResponse])
-def list_jobs(db: Session = Depends(get_db)):
-    jobs = db.query(Job).order_by(Job.created_at.desc()).all()
-    return [format_job_response(j) for j in jobs]
+def list_jobs(response: Response, limit: Optional[int] = Query(None, ge=1, le=500), cursor: Optional[str] = None,
+              status: Optional[str] = None, created_from: Optional[datetime] = None,
+              created_to: Optional[datetime] = None, db: Session = Depends(get_db)):
+    """
+    Newest first, keyset-paginated on (created_at, id). Without `limit` every job is
+    returned, as before pagination existed; with it, the X-Next-Cursor header carries
+    the cursor for the next page when more jobs exist.
+    status accepts a comma-separated list.
+    """
+    query = db.query(*JOB_SUMMARY_COLUMNS)
+    if status:
+        query = query.filter(Job.status.in_(status.split(",")))
+    if created_from:
+        query = query.filter(Job.created_at >= created_from)
+    if created_to:
+        query = query.filter(Job.created_at < created_to)
+    if cursor:
+        after_created, after_id = _decode_cursor(cursor)
+        query = query.filter(or_(Job.created_at < after_created,
+                                 and_(Job.created_at == after_created, Job.id < after_id)))
+
+    query = query.order_by(Job.created_at.desc(), Job.id.desc())
+    rows = query.limit(limit + 1).all() if limit else query.all()
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1].created_at, rows[-1].id)
+    return [format_job_response(row) for row in rows]
 
 @app.get("/api/jobs/{job_id}")
-def get_job(job_id: str, db: Session = Depends(get_db)):
+def get_job(job_id: str, since: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    The job with its mailboxes. Pass the previous response's `cursor` as `since` to get only
+    the mailboxes changed after it (`delta: true`); the client patches those into what it has.
+    """
+    as_of = datetime.utcnow()
     job = db.query(Job).filter(Job.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    # Self-heal / Real-time Stats Calculation
-    # Trust the mailboxes table more than the job counters
-    completed_count = db.query(Mailbox).filter(Mailbox.job_id == job_id, Mailbox.status == 'success').count()
-    failed_count = db.query(Mailbox).filter(Mailbox.job_id == job_id, Mailbox.status == 'failed').count()
+    # Archived jobs keep their final counters; their rows live in mailboxes_archive
+    mailbox_model = ArchivedMailbox if job.status == "archived" else Mailbox
+    if job.status in archive.BUSY_STATUSES:
+        completed_count, failed_count = job.completed, job.failed
+    else:
+        # Self-heal / Real-time Stats Calculation
+        # Trust the mailboxes table more than the job counters
+        completed_count = db.query(Mailbox).filter(Mailbox.job_id == job_id, Mailbox.status == 'success').count()
+        failed_count = db.query(Mailbox).filter(Mailbox.job_id == job_id, Mailbox.status == 'failed').count()
     
     # Update Job record if out of sync
     if job.completed != completed_count or job.failed != failed_count:
@@ -296,8 +548,13 @@ def get_job(job_id: str, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(job)
 
-    # Get mailboxes for details
-    mailboxes = db.query(Mailbox).filter(Mailbox.job_id == job_id).all()
+    # Get mailboxes for details: all of them, or those changed since the client's cursor
+    changed_since = _decode_since(since) if since and mailbox_model is Mailbox else None
+    mailboxes = db.query(mailbox_model.id, mailbox_model.source_user, mailbox_model.target_user,
+                         mailbox_model.status, mailbox_model.message).filter(mailbox_model.job_id == job_id)
+    if changed_since:
+        mailboxes = mailboxes.filter(Mailbox.updated_at >= changed_since)
+    mailboxes = mailboxes.order_by(mailbox_model.id).all()
     
     # Calculate progress for response
     progress = 0
@@ -316,6 +573,16 @@ def get_job(job_id: str, db: Session = Depends(get_db)):
         "source": job.source_host,
         "target": job.target_host,
         "created_at": str(job.created_at),
+        "current_pass": job.current_pass or 1,
+        "options": load_job_options(job.options).model_dump(exclude_none=True),
+        "capabilities": job.capabilities or {},
+        "priority": job.priority or 5,
+        "max_concurrency": job.max_concurrency,
+        "scheduled_start": str(job.scheduled_start) if job.scheduled_start else None,
+        "run_windows": job.run_windows,
+        "archived_at": str(job.archived_at) if job.archived_at else None,
+        "delta": changed_since is not None,
+        "cursor": as_of.isoformat(),
         "mailboxes": [
             {
                 "id": mb.id,
@@ -331,7 +598,10 @@ def get_job(job_id: str, db: Session = Depends(get_db)):
 def get_mailbox_logs(mailbox_id: int, db: Session = Depends(get_db)):
     mb = db.query(Mailbox).filter(Mailbox.id == mailbox_id).first()
     if not mb:
-        raise HTTPException(status_code=404, detail="Mailbox not found")
+        archived = db.query(ArchivedMailbox).filter(ArchivedMailbox.id == mailbox_id).first()
+        if not archived:
+            raise HTTPException(status_code=404, detail="Mailbox not found")
+        return {"logs": archive.read_archived_log(archived.job_id, mailbox_id) or "Log not archived"}
     
     log_path = f"logs/{mailbox_id}.log"
     
@@ -341,25 +611,49 @@ def get_mailbox_logs(mailbox_id: int, db: Session = Depends(get_db)):
     
     return {"logs": f"Waiting for logs / Starting process...\nStatus: {mb.status}\nMessage: {mb.message}"}
 
-@app.post("/api/mailboxes/{mailbox_id}/stop")
+@app.get("/api/search/logs")
+def search_logs(q: str = Query(..., min_length=2), job_id: Optional[str] = None,
+                kind: Optional[str] = Query(None, pattern="^(error|event)$"),
+                limit: int = Query(200, ge=1, le=log_index.MAX_SEARCH_LINES), db: Session = Depends(get_db)):
+    """Error and key lines of all logs containing every word of `q` (prefixes), grouped by mailbox."""
+    return log_index.search(db, q, job_id=job_id, kind=kind, limit=limit)
+
+@app.get("/api/mailboxes/{mailbox_id}/throughput")
+def get_mailbox_throughput(mailbox_id: int, db: Session = Depends(get_db)):
+    if not db.query(Mailbox.id).filter(Mailbox.id == mailbox_id).first() and \
+            not db.query(ArchivedMailbox.id).filter(ArchivedMailbox.id == mailbox_id).first():
+        raise HTTPException(status_code=404, detail="Mailbox not found")
+    return {"mailbox_id": mailbox_id, **throughput.mailbox_series(db, mailbox_id)}
+
+@app.post("/api/mailboxes/{mailbox_id}/stop", status_code=202)
 def stop_mailbox_sync(mailbox_id: int, db: Session = Depends(get_db)):
-    from worker import kill_sync
-    # Kill the process
-    success = kill_sync(mailbox_id)
-    
-    # Update DB immediately (in case worker doesn't correct it fast enough)
     mb = db.query(Mailbox).filter(Mailbox.id == mailbox_id).first()
-    if mb and mb.status == 'running':
-        mb.status = 'failed'
-        mb.message = 'Stopped by user'
-        db.commit()
-        
-    if success:
-        return {"message": "Process terminated"}
-    else:
-        # Could be already stopped
+    if not mb or mb.status != 'running':
         return {"message": "Process not found or already stopped"}
 
+    # Update DB immediately (in case worker doesn't correct it fast enough)
+    mb.status = 'failed'
+    mb.message = 'Stopped by user'
+    db.commit()
+
+    # The sync may run in another process or on another node: ask its owner; don't hold the request for the ack
+    result = control.summarize(control.current(db, control.send(db, [mailbox_id], "stop", "Stopped by user")))
+    if result["signalled"]:
+        return {"message": "Process terminated", **result}
+    if result["unacknowledged"]:
+        return {"message": "Stop requested from the owning worker", **result}
+    # Could be already stopped
+    return {"message": "Process not found or already stopped", **result}
+
+@app.get("/api/commands/{command_id}")
+def get_command(command_id: int, db: Session = Depends(get_db)):
+    """Acknowledgement state of a stop/cancel/checkpoint request."""
+    from database import WorkerCommand
+    command = db.query(WorkerCommand).filter(WorkerCommand.id == command_id).first()
+    if not command:
+        raise HTTPException(status_code=404, detail="Command not found")
+    return control.describe(command)
+
 @app.post("/api/mailboxes/{mailbox_id}/retry")
 def retry_mailbox_sync(mailbox_id: int, db: Session = Depends(get_db)):
     mb = db.query(Mailbox).filter(Mailbox.id == mailbox_id).first()
@@ -382,88 +676,292 @@ def retry_mailbox_sync(mailbox_id: int, db: Session = Depends(get_db)):
         # But our real-time stats in get_job will handle it based on status count.
         # Just ensure status is set to running if job was completed?
         if job.status == 'completed' or job.status == 'failed':
-            job.status = 'running'
+            job.status = run_windows.active_status(job)
             
     db.commit()
     
     # Re-submit to executor
-    executor.submit(run_imapsync, mb.id)
+    enqueue_mailboxes([mb.id])
     
     return {"message": "Mailbox retry started", "mailbox_id": mb.id}
 
-@app.post("/api/jobs/{job_id}/cancel")
+@app.post("/api/jobs/{job_id}/cancel", status_code=202)
 def cancel_job(job_id: str, db: Session = Depends(get_db)):
-    """Cancel all running mailboxes in a job"""
-    from worker import kill_sync
-    
+    """Cancel all running and queued mailboxes in a job"""
     job = db.query(Job).filter(Job.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    # Get all running mailboxes
-    running_mailboxes = db.query(Mailbox).filter(
+    running_ids = [row.id for row in db.query(Mailbox.id).filter(
         Mailbox.job_id == job_id, 
         Mailbox.status == 'running'
-    ).all()
+    )]
     
-    cancelled_count = 0
-    for mb in running_mailboxes:
-        success = kill_sync(mb.id)
-        if success:
-            mb.status = 'failed'
-            mb.message = 'Cancelled by user'
-            cancelled_count += 1
+    # One UPDATE for the whole job; queued rows can no longer be claimed afterwards
+    cancelled_count = db.query(Mailbox).filter(
+        Mailbox.job_id == job_id,
+        Mailbox.status.in_(['running', 'pending'])
+    ).update({Mailbox.status: 'failed', Mailbox.message: 'Cancelled by user'}, synchronize_session=False)
     
-    # Update job status
     if cancelled_count > 0:
         job.status = 'failed'
     
     db.commit()
     
-    return {"message": f"Cancelled {cancelled_count} mailboxes", "cancelled": cancelled_count}
+    # Signal the owning workers after the commit so their final write sees the cancelled state
+    result = control.summarize(control.current(db, control.send(db, running_ids, "cancel", "Cancelled by user")))
+    
+    return {"message": f"Cancelled {cancelled_count} mailboxes", "cancelled": cancelled_count,
+            "killed": result["signalled"], "unacknowledged": result["unacknowledged"],
+            "command_ids": result["command_ids"]}
+
+@app.post("/api/jobs/{job_id}/retry-failed")
+def retry_failed_mailboxes(job_id: str, message: Optional[str] = None, db: Session = Depends(get_db)):
+    """Re-queue every failed mailbox of a job, optionally only those whose message contains `message`"""
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    failed = db.query(Mailbox.id).filter(Mailbox.job_id == job_id, Mailbox.status == 'failed')
+    if message:
+        failed = failed.filter(Mailbox.message.contains(message, autoescape=True))
+    mailbox_ids = [row.id for row in failed]
+    
+    if not mailbox_ids:
+        return {"message": "No failed mailboxes to retry", "retried": 0}
+    
+    retried = db.query(Mailbox).filter(
+        Mailbox.id.in_(mailbox_ids),
+        Mailbox.status == 'failed'
+    ).update({Mailbox.status: 'pending', Mailbox.message: 'Queued for retry'}, synchronize_session=False)
+    
+    if job.status in ('completed', 'failed'):
+        job.status = run_windows.active_status(job)
+    
+    db.commit()
+    
+    enqueue_mailboxes(mailbox_ids)
+    
+    return {"message": f"Retrying {retried} mailboxes", "retried": retried}
+
+@app.post("/api/jobs/{job_id}/pause", status_code=202)
+def pause_job(job_id: str, checkpoint: bool = False, db: Session = Depends(get_db)):
+    """
+    Stop claiming new mailboxes for a job. Running syncs are allowed to finish, or with
+    checkpoint=true are stopped and returned to pending so resume picks them up again.
+    """
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job.status not in ('running', 'pending', 'scheduled'):
+        raise HTTPException(status_code=400, detail=f"Cannot pause a job that is {job.status}")
+    
+    job.status = 'paused'
+    db.commit()
+    
+    running_ids = [row.id for row in db.query(Mailbox.id).filter(Mailbox.job_id == job_id, Mailbox.status == 'running')]
+    if not checkpoint:
+        return {"message": "Job paused", "running": len(running_ids)}
+    
+    result = control.summarize(control.current(db, control.send(db, running_ids, "checkpoint",
+                                                                "Paused by user, will resume")))
+    return {"message": "Job paused", "running": len(running_ids) - result["signalled"],
+            "checkpointed": result["signalled"], "unacknowledged": result["unacknowledged"],
+            "command_ids": result["command_ids"]}
+
+@app.post("/api/jobs/{job_id}/resume")
+def resume_job(job_id: str, db: Session = Depends(get_db)):
+    """Resume a paused job and enqueue all of its pending mailboxes"""
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job.status != 'paused':
+        raise HTTPException(status_code=400, detail="Job is not paused")
+    
+    job.status = run_windows.active_status(job)
+    db.commit()
+    
+    mailbox_ids = [row.id for row in db.query(Mailbox.id).filter(
+        Mailbox.job_id == job_id,
+        Mailbox.status == 'pending'
+    )]
+    if job.status == 'scheduled':
+        return {"message": "Job resumed, waiting for its run window", "queued": 0}
+    enqueue_mailboxes(mailbox_ids)
+    
+    return {"message": f"Job resumed, {len(mailbox_ids)} mailboxes queued", "queued": len(mailbox_ids)}
+
+class DeltaSyncRequest(BaseModel):
+    max_age_days: Optional[int] = None # Default: days since the oldest last successful sync, plus one
+    include_failed: bool = False
+
+@app.post("/api/jobs/{job_id}/delta-sync")
+def start_delta_sync(job_id: str, delta: DeltaSyncRequest = DeltaSyncRequest(), db: Session = Depends(get_db)):
+    """Start a cutover pass that only copies messages that arrived since the last pass"""
+    from datetime import datetime
+    from sqlalchemy import func
+    import math
+    
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    active = db.query(Mailbox).filter(
+        Mailbox.job_id == job_id,
+        Mailbox.status.in_(['validating', 'pending', 'running'])
+    ).count()
+    if active:
+        raise HTTPException(status_code=400, detail=f"Job still has {active} active mailboxes")
+    
+    statuses = ['success', 'failed'] if delta.include_failed else ['success']
+    selected = db.query(Mailbox).filter(Mailbox.job_id == job_id, Mailbox.status.in_(statuses))
+    
+    max_age_days = delta.max_age_days
+    if max_age_days is None:
+        oldest = selected.with_entities(func.min(Mailbox.last_synced_at)).scalar()
+        if oldest:
+            max_age_days = math.ceil((datetime.utcnow() - oldest).total_seconds() / 86400) + 1
+    
+    # Keep the stats of the initial bulk pass before its rows are reset
+    if not db.query(SyncPass).filter(SyncPass.job_id == job_id).count():
+        db.add(SyncPass(
+            job_id=job_id, pass_number=1, mode="full",
+            total=job.total_mailboxes, completed=job.completed, failed=job.failed,
+            data_transferred=job.data_transferred,
+            messages_transferred=db.query(func.sum(Mailbox.messages_transferred)).filter(Mailbox.job_id == job_id).scalar() or 0,
+            started_at=job.created_at, finished_at=datetime.utcnow()
+        ))
+    
+    pass_number = (job.current_pass or 1) + 1
+    queued = selected.update({
+        Mailbox.status: 'pending',
+        Mailbox.message: f'Queued for delta pass {pass_number}',
+        Mailbox.pass_number: pass_number,
+    }, synchronize_session=False)
+    if not queued:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="No mailboxes to re-sync")
+    
+    db.add(SyncPass(job_id=job_id, pass_number=pass_number, mode="delta", max_age_days=max_age_days, total=queued))
+    job.current_pass = pass_number
+    job.status = run_windows.active_status(job)
+    db.commit()
+    
+    mailbox_ids = [row.id for row in db.query(Mailbox.id).filter(
+        Mailbox.job_id == job_id, Mailbox.pass_number == pass_number, Mailbox.status == 'pending'
+    )]
+    enqueue_mailboxes(mailbox_ids)
+    
+    return {"message": f"Delta pass {pass_number} started for {queued} mailboxes",
+            "pass_number": pass_number, "queued": queued, "max_age_days": max_age_days}
+
+@app.get("/api/jobs/{job_id}/passes")
+def list_sync_passes(job_id: str, db: Session = Depends(get_db)):
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    passes = db.query(SyncPass).filter(SyncPass.job_id == job_id).order_by(SyncPass.pass_number).all()
+    return [
+        {
+            "pass_number": p.pass_number,
+            "mode": p.mode,
+            "max_age_days": p.max_age_days,
+            "total": p.total,
+            "completed": p.completed,
+            "failed": p.failed,
+            "messages_transferred": p.messages_transferred,
+            "data_transferred": p.data_transferred,
+            "started_at": str(p.started_at) if p.started_at else None,
+            "finished_at": str(p.finished_at) if p.finished_at else None,
+            "duration_seconds": (p.finished_at - p.started_at).total_seconds() if p.finished_at and p.started_at else None,
+        } for p in passes
+    ]
+
+@app.get("/api/jobs/{job_id}/estimate")
+def get_job_estimate(job_id: str, db: Session = Depends(get_db)):
+    """Predicted remaining duration of the job and finish time of each unfinished mailbox (see estimator.py)."""
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    concurrency = min(job.max_concurrency or max_workers, max_workers)
+    return estimator.estimate(db, job, concurrency)
+
+@app.get("/api/jobs/{job_id}/throughput")
+def get_job_throughput(job_id: str, db: Session = Depends(get_db)):
+    if not db.query(Job.id).filter(Job.id == job_id).first():
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, **throughput.job_series(db, job_id)}
+
+def _export_response(job_id: str, db: Session, chunks, media_type: str, filename: str):
+    if not db.query(Job.id).filter(Job.id == job_id).first():
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+def _is_archived(job_id: str, db: Session) -> bool:
+    return db.query(Job.id).filter(Job.id == job_id, Job.status == "archived").first() is not None
+
+@app.get("/api/jobs/{job_id}/report.csv")
+def export_report_csv(job_id: str, db: Session = Depends(get_db)):
+    from reports import iter_report_csv
+    chunks = iter_report_csv(job_id, archived=_is_archived(job_id, db))
+    return _export_response(job_id, db, chunks, "text/csv; charset=utf-8", f"job-{job_id}-report.csv")
+
+@app.get("/api/jobs/{job_id}/report.jsonl")
+def export_report_jsonl(job_id: str, db: Session = Depends(get_db)):
+    from reports import iter_report_jsonl
+    chunks = iter_report_jsonl(job_id, archived=_is_archived(job_id, db))
+    return _export_response(job_id, db, chunks, "application/x-ndjson", f"job-{job_id}-report.jsonl")
+
+@app.get("/api/jobs/{job_id}/logs.zip")
+def export_logs_zip(job_id: str, db: Session = Depends(get_db)):
+    if _is_archived(job_id, db):
+        # Already a zip on disk
+        path = archive.archive_path(job_id)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="No archived logs for this job")
+        return FileResponse(path, media_type="application/zip", filename=f"job-{job_id}-logs.zip")
+    from reports import iter_logs_zip
+    return _export_response(job_id, db, iter_logs_zip(job_id), "application/zip", f"job-{job_id}-logs.zip")
 
 @app.get("/api/stats")
 def get_dashboard_stats(db: Session = Depends(get_db)):
     from sqlalchemy import func
     total_jobs = db.query(Job).count()
     active_jobs = db.query(Job).filter(Job.status == "running").count()
-    completed_mailboxes = db.query(Mailbox).filter(Mailbox.status == "success").count()
+    completed_mailboxes = db.query(Mailbox).filter(Mailbox.status == "success").count() + \
+        db.query(ArchivedMailbox).filter(ArchivedMailbox.status == "success").count()
     
     # Calculate Data Transferred
     total_bytes = db.query(func.sum(Job.data_transferred)).scalar() or 0
-    
-    # Format
-    if total_bytes > 1024**3:
-        data_str = f"{total_bytes / (1024**3):.2f} GB"
-    elif total_bytes > 1024**2:
-        data_str = f"{total_bytes / (1024**2):.2f} MB"
-    elif total_bytes > 1024:
-        data_str = f"{total_bytes / 1024:.2f} KB"
-    else:
-        data_str = f"{total_bytes} B"
 
     return {
         "total_jobs": total_jobs,
         "active_jobs": active_jobs,
         "completed_mailboxes": completed_mailboxes,
-        "data_transferred": data_str
+        "data_transferred": format_bytes(total_bytes),
+        "data_transferred_bytes": total_bytes
     }
 
-def format_job_response(job: Job):
+def format_bytes(bytes_val: int) -> str:
+    if bytes_val > 1024**3:
+        return f"{bytes_val / (1024**3):.2f} GB"
+    elif bytes_val > 1024**2:
+        return f"{bytes_val / (1024**2):.2f} MB"
+    elif bytes_val > 1024:
+        return f"{bytes_val / 1024:.2f} KB"
+    return f"{bytes_val} B"
+
+def format_job_response(job):
+    """Works on Job objects and on JOB_SUMMARY_COLUMNS rows."""
     progress = 0
-    if job.total_mailboxes > 0:
+    if job.total_mailboxes:
         progress = int(((job.completed + job.failed) / job.total_mailboxes) * 100)
 
-    # Format Bytes
     bytes_val = job.data_transferred or 0
-    if bytes_val > 1024**3:
-        data_str = f"{bytes_val / (1024**3):.2f} GB"
-    elif bytes_val > 1024**2:
-        data_str = f"{bytes_val / (1024**2):.2f} MB"
-    elif bytes_val > 1024:
-         data_str = f"{bytes_val / 1024:.2f} KB"
-    else:
-         data_str = f"{bytes_val} B"
         
     return JobResponse(
         id=job.id,
@@ -475,50 +973,65 @@ def format_job_response(job: Job):
         failed=job.failed,
         source=job.source_host,
         target=job.target_host,
-        data_transferred=data_str,
+        data_transferred=format_bytes(bytes_val),
+        data_transferred_bytes=bytes_val,
         created_at=job.created_at.isoformat()
     )
 
-# Mount Static Files (Frontend)
-# Mount Static Files (Frontend)
+# Serve Static Files (Frontend)
 # Use absolute path relative to this file to ensure it works on cPanel
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+from fastapi import Request
 from fastapi.responses import HTMLResponse
+from static_assets import AssetStore, asset_response, IMMUTABLE_CACHE, REVALIDATE_CACHE
+
+# HTML/CSS/JS are held in memory (precompressed); re-read on change only in development
+assets = AssetStore(base_dir, reload=os.getenv("APP_ENV") == "development")
+
+def serve_html(request: Request, filename):
+    page = assets.page(filename)
+    if page is None:
+        path = os.path.join(base_dir, filename)
+        return HTMLResponse(content=f"File not found: {path} (Base: {base_dir})", status_code=404)
+    # HTML must revalidate so new asset hashes are picked up after a deploy
+    return asset_response(request, page, REVALIDATE_CACHE)
+
+def serve_asset(request: Request, rel_path):
+    asset, is_hashed = assets.asset(rel_path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return asset_response(request, asset, IMMUTABLE_CACHE if is_hashed else REVALIDATE_CACHE)
 
-# Mount Static Assets
-# Note: StaticFiles needs 'aiofiles' installed.
-app.mount("/css", StaticFiles(directory=os.path.join(base_dir, "css")), name="css")
-app.mount("/js", StaticFiles(directory=os.path.join(base_dir, "js")), name="js")
+@app.api_route("/css/{path:path}", methods=["GET", "HEAD"])
+async def read_css(path: str, request: Request):
+    return serve_asset(request, f"css/{path}")
 
-def serve_html(filename):
-    path = os.path.join(base_dir, filename)
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-             return HTMLResponse(content=f.read())
-    return HTMLResponse(content=f"File not found: {path} (Base: {base_dir})", status_code=404)
+@app.api_route("/js/{path:path}", methods=["GET", "HEAD"])
+async def read_js(path: str, request: Request):
+    return serve_asset(request, f"js/{path}")
 
-# Serve HTML Files explicitly (Sync read is safer without aiofiles)
-@app.get("/")
-async def read_root():
-    return serve_html('index.html')
+# Serve HTML Files explicitly
+@app.api_route("/", methods=["GET", "HEAD"])
+async def read_root(request: Request):
+    return serve_html(request, 'index.html')
 
-@app.get("/index.html")
-async def read_index():
-    return serve_html('index.html')
+@app.api_route("/index.html", methods=["GET", "HEAD"])
+async def read_index(request: Request):
+    return serve_html(request, 'index.html')
 
 
-@app.get("/create-job.html")
-async def read_create_job():
-    return serve_html('create-job.html')
+@app.api_route("/create-job.html", methods=["GET", "HEAD"])
+async def read_create_job(request: Request):
+    return serve_html(request, 'create-job.html')
 
-@app.get("/job-detail.html")
-async def read_job_detail():
-    return serve_html('job-detail.html')
+@app.api_route("/job-detail.html", methods=["GET", "HEAD"])
+async def read_job_detail(request: Request):
+    return serve_html(request, 'job-detail.html')
 
-@app.get("/guide.html")
-async def read_guide():
-    return serve_html('guide.html')
+@app.api_route("/guide.html", methods=["GET", "HEAD"])
+async def read_guide(request: Request):
+    return serve_html(request, 'guide.html')
 
 if __name__ == "__main__":
     import uvicorn
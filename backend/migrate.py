@@ -0,0 +1,19 @@
+"""
+Explicit schema migration command.
+
+Usage: python migrate.py
+
+Creates missing tables and adds new columns to existing ones. The API no
+longer does this on import; run it once per deploy (the Docker image does
+it before starting uvicorn).
+"""
+from database import migrate, DATABASE_URL
+
+if __name__ == "__main__":
+    safe_url = DATABASE_URL.split("@")[-1]
+    print(f"Migrating database: ...{safe_url}")
+    added = migrate()
+    if added:
+        for column in added:
+            print(f"  + {column}")
+    print("Database schema is up to date.")
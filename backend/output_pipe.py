@@ -0,0 +1,307 @@
+"""
+imapsync output pipeline.
+
+The worker thread only drains the child's stdout: raw byte chunks are read into
+a reusable buffer, scanned in place for the summary lines we parse, and handed
+to a single log-writer thread that batches writes and flushes periodically.
+A slow disk therefore delays log files, not the pipe - the child never blocks
+on a full pipe unless the writer queue itself is full (LOG_QUEUE_CHUNKS), which
+is counted as a stall in pipe_metrics.
+"""
+import os
+import queue
+import re
+import threading
+import time
+
+READ_CHUNK = 64 * 1024
+LOG_QUEUE_CHUNKS = int(os.getenv("LOG_QUEUE_CHUNKS", 1024))
+LOG_FLUSH_SECONDS = 1.0
+
+# Queue puts slower than this count as a stall (the reader stopped draining the pipe)
+STALL_THRESHOLD = 0.05
+
+
+class PipeMetrics:
+    """Process-wide counters, reported by /api/health."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_read = 0
+        self.reads = 0
+        self.full_reads = 0       # read filled the whole buffer: the child was ahead of us
+        self.stalls = 0           # reader blocked handing a chunk to the log writer
+        self.stall_seconds = 0.0
+        self.max_stall_seconds = 0.0
+
+    def record_read(self, size: int, full: bool):
+        with self._lock:
+            self.bytes_read += size
+            self.reads += 1
+            if full:
+                self.full_reads += 1
+
+    def record_stall(self, seconds: float):
+        with self._lock:
+            self.stalls += 1
+            self.stall_seconds += seconds
+            self.max_stall_seconds = max(self.max_stall_seconds, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "bytes_read": self.bytes_read,
+                "reads": self.reads,
+                "full_reads": self.full_reads,
+                "stalls": self.stalls,
+                "stall_seconds": round(self.stall_seconds, 3),
+                "max_stall_seconds": round(self.max_stall_seconds, 3),
+                "log_queue_depth": log_writer.queue.qsize(),
+            }
+
+
+class LogSink:
+    """One log file fed through the shared writer. close() waits until it is on disk."""
+
+    def __init__(self, writer, path: str, mode: str):
+        self.writer = writer
+        self.path = path
+        self.mode = mode
+        self.file = None
+        self.closed = threading.Event()
+
+    def write(self, data: bytes):
+        self.writer.put(self, data)
+
+    def close(self, timeout: float = 30):
+        self.writer.put(self, None)
+        self.closed.wait(timeout)
+
+
+class LogWriter:
+    def __init__(self, max_chunks: int = LOG_QUEUE_CHUNKS):
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def open(self, path: str, mode: str = "wb") -> LogSink:
+        self._ensure_thread()
+        return LogSink(self, path, mode)
+
+    def put(self, sink: LogSink, data):
+        try:
+            self.queue.put_nowait((sink, data))
+            return
+        except queue.Full:
+            pass
+        started = time.monotonic()
+        self.queue.put((sink, data))
+        waited = time.monotonic() - started
+        if waited >= STALL_THRESHOLD:
+            pipe_metrics.record_stall(waited)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        dirty = set()
+        last_flush = time.monotonic()
+        while True:
+            try:
+                items = [self.queue.get(timeout=LOG_FLUSH_SECONDS)]
+            except queue.Empty:
+                items = []
+            # Drain whatever else is queued so each file gets one write per batch
+            while len(items) < 256:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            pending = {}
+            for sink, data in items:
+                pending.setdefault(sink, []).append(data)
+            for sink, chunks in pending.items():
+                try:
+                    if sink.file is None and not sink.closed.is_set():
+                        sink.file = open(sink.path, sink.mode)
+                    data = b"".join(chunk for chunk in chunks if chunk)
+                    if data and sink.file:
+                        sink.file.write(data)
+                        dirty.add(sink)
+                    if None in chunks:
+                        if sink.file:
+                            sink.file.close()
+                        dirty.discard(sink)
+                        sink.closed.set()
+                except OSError as e:
+                    print(f"Log write to {sink.path} failed: {e}")
+                    if None in chunks:
+                        sink.closed.set()
+
+            if dirty and time.monotonic() - last_flush >= LOG_FLUSH_SECONDS:
+                for sink in list(dirty):
+                    try:
+                        sink.file.flush()
+                    except (OSError, ValueError):
+                        pass
+                dirty.clear()
+                last_flush = time.monotonic()
+
+
+TOTAL_BYTES = re.compile(rb"Total bytes transferred.*?:\s*(\d+)", re.IGNORECASE)
+TOTAL_SIZE = re.compile(rb"Total size.*?:\s*(\d+)", re.IGNORECASE)
+COUNT = re.compile(rb":\s*(\d+)")
+# Folder-size scan at the start of a run: "Host1 Total size: 1234567 bytes (1.177 MiB)"
+SOURCE_SIZE = re.compile(rb"^Host1 Total size\s*:\s*(\d+)")
+SOURCE_MESSAGES = re.compile(rb"^Host1 Nb messages\s*:\s*(\d+)")
+# Per-message progress line: "msg INBOX/42 {5120}   copied to INBOX/17   ..."
+COPIED = re.compile(rb"\{(\d+)\}\s+copied to ")
+
+
+# Lines worth indexing for search (log_index.py): imapsync's errors, then key events
+ERROR_MARKERS = (b"Err ", b"Error", b"ERROR", b"failure", b"Failure", b"Could not", b"Can not", b"Cannot",
+                 b"timed out", b"Timeout", b"Killed")
+EVENT_MARKERS = (b"Exiting with return value", b"Detected ", b"Host1 Total size", b"Host2 Total size",
+                 b"Messages transferred", b"Total bytes transferred")
+MAX_EVENTS_PER_RUN = int(os.getenv("LOG_INDEX_MAX_EVENTS", 500))
+MAX_EVENT_LINE = 1000
+
+
+def classify(line: bytes):
+    """'error', 'event' or None for one log line."""
+    if any(marker in line for marker in ERROR_MARKERS):
+        return "error"
+    if any(marker in line for marker in EVENT_MARKERS):
+        return "event"
+    return None
+
+
+class SummaryParser:
+    """
+    Extracts the transfer summary from raw output chunks. Only complete lines that
+    contain one of the markers are decoded; a partial last line is carried over.
+    Running copied_messages / copied_bytes come from the per-message lines and
+    feed the throughput samples while the sync runs. The source mailbox size from
+    imapsync's folder-size scan is passed to on_sizes(bytes, messages) once known,
+    error and key-event lines to on_event(kind, text), at most MAX_EVENTS_PER_RUN.
+    """
+
+    MARKERS = (b"Total bytes transferred", b"Total size", b"Messages transferred", b"Messages skipped",
+               b"Nb messages")
+
+    def __init__(self, on_sizes=None, on_event=None):
+        self.on_sizes = on_sizes
+        self.on_event = on_event
+        self.events = 0
+        self.events_dropped = 0
+        self.source_size_bytes = None
+        self.source_size_messages = None
+        self.total_bytes = 0
+        self.messages_transferred = 0
+        self.messages_skipped = 0
+        self.copied_messages = 0
+        self.copied_bytes = 0
+        self._carry = b""
+
+    def feed(self, chunk) -> None:
+        data = self._carry + bytes(chunk) if self._carry else bytes(chunk)
+        end = data.rfind(b"\n")
+        if end == -1:
+            self._carry = data
+            return
+        self._carry = data[end + 1:]
+        complete = data[:end]
+        if b" copied to " in complete:
+            for match in COPIED.finditer(complete):
+                self.copied_messages += 1
+                self.copied_bytes += int(match.group(1))
+        if self.on_event:
+            self._events(complete)
+        if not any(marker in complete for marker in self.MARKERS):
+            return
+        for line in complete.split(b"\n"):
+            self.line(line)
+
+    def finish(self) -> None:
+        if self._carry:
+            for match in COPIED.finditer(self._carry):
+                self.copied_messages += 1
+                self.copied_bytes += int(match.group(1))
+            if self.on_event:
+                self._events(self._carry)
+            self.line(self._carry)
+            self._carry = b""
+        if self.on_event and self.events_dropped:
+            self.on_event("event", f"{self.events_dropped} more error/event lines not indexed; see the full log")
+
+    def _events(self, data: bytes) -> None:
+        # Most chunks are per-message progress only; skip them without splitting
+        if not any(marker in data for marker in ERROR_MARKERS + EVENT_MARKERS):
+            return
+        for line in data.split(b"\n"):
+            kind = classify(line)
+            if kind is None:
+                continue
+            if self.events >= MAX_EVENTS_PER_RUN:
+                self.events_dropped += 1
+                continue
+            self.events += 1
+            self.on_event(kind, line[:MAX_EVENT_LINE].decode("utf-8", errors="replace").strip())
+
+    def line(self, line: bytes) -> None:
+        if line.startswith(b"Host1 ") and self.source_size_bytes is None:
+            self._source_size(line)
+        # Pattern 1: Final summary "Total bytes transferred : 123456"
+        if b"Total bytes transferred" in line:
+            match = TOTAL_BYTES.search(line)
+            if match:
+                self.total_bytes = int(match.group(1))
+        # Pattern 2: "Total size: 123456 bytes" estimate, until the final summary arrives
+        elif b"Total size" in line and b"bytes" in line and self.total_bytes == 0:
+            match = TOTAL_SIZE.search(line)
+            if match:
+                self.total_bytes = int(match.group(1))
+        elif line.startswith(b"Messages transferred"):
+            match = COUNT.search(line)
+            if match:
+                self.messages_transferred = int(match.group(1))
+        elif line.startswith(b"Messages skipped"):
+            match = COUNT.search(line)
+            if match:
+                self.messages_skipped = int(match.group(1))
+
+
+    def _source_size(self, line: bytes) -> None:
+        match = SOURCE_MESSAGES.match(line)
+        if match:
+            self.source_size_messages = int(match.group(1))
+            return
+        match = SOURCE_SIZE.match(line)
+        if match:
+            # The scan prints the message count first; the size completes it
+            self.source_size_bytes = int(match.group(1))
+            if self.on_sizes:
+                self.on_sizes(self.source_size_bytes, self.source_size_messages)
+
+
+def pump(stream, sink: LogSink, parser: SummaryParser, chunk_size: int = READ_CHUNK) -> None:
+    """Drains a raw (bufsize=0) pipe until EOF into the log sink and parser."""
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        size = stream.readinto(buffer)
+        if not size:
+            break
+        pipe_metrics.record_read(size, size == chunk_size)
+        chunk = bytes(view[:size])
+        sink.write(chunk)
+        parser.feed(chunk)
+    parser.finish()
+
+
+pipe_metrics = PipeMetrics()
+log_writer = LogWriter()
@@ -0,0 +1,252 @@
+"""
+Pre-flight credential check.
+
+Logs in to the source and target IMAP servers for every mailbox of an upload
+before anything is queued, so bad passwords and unreachable hosts are reported
+up front instead of each one occupying a worker slot for a full imapsync start.
+
+All logins run concurrently on one asyncio loop (in a background thread), bounded
+per (host, port) so a large batch doesn't trip provider connection limits.
+"""
+import asyncio
+import imaplib
+import os
+import ssl
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import SessionLocal, Mailbox, Job, decrypt_password
+
+PREFLIGHT_PER_HOST = int(os.getenv("PREFLIGHT_PER_HOST", 20))
+PREFLIGHT_CONCURRENCY = int(os.getenv("PREFLIGHT_CONCURRENCY", 200))
+PREFLIGHT_TIMEOUT = float(os.getenv("PREFLIGHT_TIMEOUT", 20))
+
+
+def _ssl_context():
+    # Same stance as imapsync's defaults: many IMAP servers use self-signed certificates
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+class LoginError(Exception):
+    pass
+
+
+async def _read_tagged(reader, tag: bytes) -> bytes:
+    """Reads response lines until the tagged completion for `tag`."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise LoginError("Connection closed by server")
+        if line.startswith(tag + b" "):
+            return line.rstrip()
+
+
+async def _send_astring(writer, reader, value: str) -> None:
+    """Sends an IMAP string argument: quoted when possible, otherwise as a literal."""
+    data = value.encode("utf-8")
+    if value.isascii() and "\r" not in value and "\n" not in value:
+        writer.write(b'"' + data.replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"')
+        return
+    writer.write(b"{%d}\r\n" % len(data))
+    await writer.drain()
+    continuation = await reader.readline()
+    if not continuation.startswith(b"+"):
+        raise LoginError(continuation.decode(errors="replace").strip() or "Literal rejected")
+    writer.write(data)
+
+
+def _imaplib_login(host: str, port: int, security: str, user: str, password: str) -> list:
+    """Blocking fallback for STARTTLS on Pythons whose StreamWriter lacks start_tls()."""
+    conn = imaplib.IMAP4(host, port, timeout=PREFLIGHT_TIMEOUT)
+    try:
+        conn.starttls(ssl_context=_ssl_context())
+        conn.login(user, password)
+        _typ, data = conn.capability()
+        return data[0].decode(errors="replace").upper().split() if data and data[0] else []
+    except imaplib.IMAP4.error as e:
+        raise LoginError(str(e))
+    finally:
+        try:
+            conn.logout()
+        except Exception:
+            pass
+
+
+def _parse_capabilities(line: bytes) -> list:
+    """Extracts the atoms of a '* CAPABILITY ...' line or a '[CAPABILITY ...]' response code."""
+    text = line.decode(errors="replace").upper()
+    if "[CAPABILITY " in text:
+        text = text.split("[CAPABILITY ", 1)[1].split("]", 1)[0]
+    elif text.startswith("* CAPABILITY "):
+        text = text[len("* CAPABILITY "):]
+    else:
+        return []
+    return text.split()
+
+
+async def imap_login(host: str, port: int, security: str, user: str, password: str) -> list:
+    """
+    Connects and runs LOGIN/LOGOUT. Raises LoginError or OSError on failure.
+    Returns the capabilities advertised once authenticated (servers such as Gmail
+    only announce COMPRESS, MOVE or APPENDLIMIT after login).
+    """
+    if security == "STARTTLS" and not hasattr(asyncio.StreamWriter, "start_tls"):
+        return await asyncio.to_thread(_imaplib_login, host, port, security, user, password)
+
+    ctx = _ssl_context() if security == "SSL/TLS" else None
+    reader, writer = await asyncio.open_connection(host, port, ssl=ctx)
+    try:
+        greeting = await reader.readline()
+        if not greeting.startswith(b"* OK") and not greeting.startswith(b"* PREAUTH"):
+            raise LoginError(greeting.decode(errors="replace").strip() or "No IMAP greeting")
+
+        if security == "STARTTLS":
+            writer.write(b"a0 STARTTLS\r\n")
+            await writer.drain()
+            response = await _read_tagged(reader, b"a0")
+            if not response.startswith(b"a0 OK"):
+                raise LoginError(response.decode(errors="replace"))
+            await writer.start_tls(_ssl_context(), server_hostname=host)
+
+        writer.write(b"a1 LOGIN ")
+        await _send_astring(writer, reader, user)
+        writer.write(b" ")
+        await _send_astring(writer, reader, password)
+        writer.write(b"\r\n")
+        await writer.drain()
+
+        response = await _read_tagged(reader, b"a1")
+        if not response.startswith(b"a1 OK"):
+            raise LoginError(response[3:].decode(errors="replace").strip())
+
+        # Most servers piggyback the post-login list on the LOGIN response; ask otherwise
+        capabilities = _parse_capabilities(response)
+        if not capabilities:
+            writer.write(b"a2 CAPABILITY\r\n")
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise LoginError("Connection closed by server")
+                capabilities = capabilities or _parse_capabilities(line)
+                if line.startswith(b"a2 "):
+                    break
+
+        writer.write(b"a3 LOGOUT\r\n")
+        await writer.drain()
+        return capabilities
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+class _Limiter:
+    """Global cap plus one semaphore per (host, port)."""
+
+    def __init__(self, per_host: int, total: int):
+        self.per_host = per_host
+        self.total = asyncio.Semaphore(total)
+        self.hosts = {}
+
+    def host(self, host: str, port: int) -> asyncio.Semaphore:
+        key = (host.lower(), port)
+        if key not in self.hosts:
+            self.hosts[key] = asyncio.Semaphore(self.per_host)
+        return self.hosts[key]
+
+
+async def _check_login(limiter, side, host, port, security, user, password):
+    async with limiter.host(host, port), limiter.total:
+        try:
+            await asyncio.wait_for(imap_login(host, port, security, user, password), PREFLIGHT_TIMEOUT)
+            return None
+        except LoginError as e:
+            return f"{side} login failed: {e}"
+        except asyncio.TimeoutError:
+            return f"{side} connection timed out ({host}:{port})"
+        except (OSError, ssl.SSLError) as e:
+            return f"{side} connection failed ({host}:{port}): {e}"
+
+
+async def validate_mailboxes(job, rows, per_host: int = None, total: int = None):
+    """
+    rows: iterable of (mailbox_id, source_user, source_pass, target_user, target_pass) in plain text.
+    Returns {mailbox_id: None if both logins work, else an error message}.
+    """
+    limiter = _Limiter(per_host or PREFLIGHT_PER_HOST, total or PREFLIGHT_CONCURRENCY)
+
+    async def check(row):
+        mailbox_id, source_user, source_pass, target_user, target_pass = row
+        errors = await asyncio.gather(
+            _check_login(limiter, "Source", job.source_host, job.source_port, job.source_security, source_user, source_pass),
+            _check_login(limiter, "Target", job.target_host, job.target_port, job.target_security, target_user, target_pass),
+        )
+        errors = [e for e in errors if e]
+        return mailbox_id, "; ".join(errors) if errors else None
+
+    results = await asyncio.gather(*(check(row) for row in rows))
+    return dict(results)
+
+
+def run_preflight(job_id: str, mailbox_ids):
+    """
+    Validates the given 'validating' mailboxes and records the outcome on each row.
+    Passing rows become pending; failing rows are marked failed with the reason.
+    Returns the ids that passed (for the caller to enqueue).
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job:
+            return []
+
+        # Owned by this process, so a restarting sibling leaves the rows to it (worker.recover_orphans)
+        from worker import WORKER_HOST
+        db.query(Mailbox).filter(Mailbox.id.in_(mailbox_ids), Mailbox.status == 'validating').update(
+            {Mailbox.worker_host: WORKER_HOST, Mailbox.owner_pid: os.getpid()}, synchronize_session=False)
+        db.commit()
+
+        mailboxes = db.query(Mailbox.id, Mailbox.source_user, Mailbox.source_pass, Mailbox.target_user, Mailbox.target_pass) \
+            .filter(Mailbox.id.in_(mailbox_ids), Mailbox.status == 'validating').all()
+        rows = [
+            (mb.id, mb.source_user, decrypt_password(mb.source_pass), mb.target_user, decrypt_password(mb.target_pass))
+            for mb in mailboxes
+        ]
+
+        results = asyncio.run(validate_mailboxes(job, rows))
+
+        now = datetime.utcnow()
+        passed = [mailbox_id for mailbox_id, error in results.items() if error is None]
+        updates = []
+        for mailbox_id, error in results.items():
+            if error is None:
+                updates.append({"id": mailbox_id, "status": "pending", "message": "Pre-flight OK, queued",
+                                "preflight_status": "ok", "preflight_message": None, "preflight_at": now})
+            else:
+                updates.append({"id": mailbox_id, "status": "failed", "message": f"Pre-flight: {error}",
+                                "preflight_status": "failed", "preflight_message": error, "preflight_at": now})
+        # One executemany instead of a round-trip per row
+        db.bulk_update_mappings(Mailbox, updates)
+        db.commit()
+
+        print(f"Pre-flight for job {job_id}: {len(passed)} passed, {len(updates) - len(passed)} failed")
+        return passed
+    except Exception as e:
+        # Don't leave rows stuck in 'validating': queue them without the check
+        print(f"Pre-flight for job {job_id} failed: {e}")
+        db.rollback()
+        db.query(Mailbox).filter(Mailbox.id.in_(mailbox_ids), Mailbox.status == 'validating').update(
+            {Mailbox.status: 'pending', Mailbox.message: 'Pre-flight unavailable, queued without check',
+             Mailbox.preflight_status: 'skipped'}, synchronize_session=False)
+        db.commit()
+        return list(mailbox_ids)
+    finally:
+        db.close()
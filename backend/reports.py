@@ -0,0 +1,148 @@
+"""
+Streamed job exports: per-mailbox report as CSV / JSON Lines and a zip of all logs.
+
+Rows come from a server-side cursor (yield_per) and are written out in batches,
+so memory stays flat regardless of the number of mailboxes in the job. Each
+generator opens its own session because it outlives the request handler.
+"""
+import csv
+import io
+import json
+import os
+import sys
+import zipfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import SessionLocal, Mailbox, ArchivedMailbox
+
+LOG_DIR = "logs"
+
+# Rows fetched per round-trip, and rows buffered before yielding a chunk
+FETCH_SIZE = 1000
+CHUNK_ROWS = 500
+
+# Read size when copying log files into the zip
+COPY_BUFFER = 64 * 1024
+
+REPORT_FIELDS = [
+    "mailbox_id", "source_user", "target_user", "status", "message",
+    "data_transferred", "messages_transferred", "messages_skipped",
+    "attempts", "pass_number", "started_at", "finished_at", "duration_seconds",
+]
+
+REPORT_COLUMNS = (
+    "id", "source_user", "target_user", "status", "message",
+    "data_transferred", "messages_transferred", "messages_skipped",
+    "attempts", "pass_number", "started_at", "finished_at",
+)
+
+
+def _iter_rows(job_id: str, archived: bool = False):
+    # Archived jobs have the same columns in mailboxes_archive
+    model = ArchivedMailbox if archived else Mailbox
+    db = SessionLocal()
+    try:
+        query = db.query(*(getattr(model, name) for name in REPORT_COLUMNS)).filter(model.job_id == job_id) \
+            .order_by(model.id).yield_per(FETCH_SIZE)
+        for row in query:
+            duration = None
+            if row.started_at and row.finished_at and row.finished_at >= row.started_at:
+                duration = int((row.finished_at - row.started_at).total_seconds())
+            yield {
+                "mailbox_id": row.id,
+                "source_user": row.source_user,
+                "target_user": row.target_user,
+                "status": row.status,
+                "message": row.message,
+                "data_transferred": row.data_transferred or 0,
+                "messages_transferred": row.messages_transferred or 0,
+                "messages_skipped": row.messages_skipped or 0,
+                "attempts": row.attempts or 0,
+                "pass_number": row.pass_number or 1,
+                "started_at": row.started_at.isoformat() if row.started_at else None,
+                "finished_at": row.finished_at.isoformat() if row.finished_at else None,
+                "duration_seconds": duration,
+            }
+    finally:
+        db.close()
+
+
+def iter_report_csv(job_id: str, archived: bool = False):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=REPORT_FIELDS)
+    writer.writeheader()
+    pending = 0
+    for row in _iter_rows(job_id, archived):
+        writer.writerow(row)
+        pending += 1
+        if pending >= CHUNK_ROWS:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode("utf-8")
+
+
+def iter_report_jsonl(job_id: str, archived: bool = False):
+    lines = []
+    for row in _iter_rows(job_id, archived):
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) >= CHUNK_ROWS:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable target for ZipFile; collects output until drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_logs_zip(job_id: str, log_dir: str = LOG_DIR):
+    """
+    Zips the job's mailbox logs while streaming. The sink is not seekable, so
+    zipfile writes sizes in data descriptors and nothing is staged on disk.
+    """
+    sink = _ChunkSink()
+    db = SessionLocal()
+    try:
+        query = db.query(Mailbox.id, Mailbox.source_user).filter(Mailbox.job_id == job_id) \
+            .order_by(Mailbox.id).yield_per(FETCH_SIZE)
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for mailbox_id, source_user in query:
+                path = os.path.join(log_dir, f"{mailbox_id}.log")
+                if not os.path.exists(path):
+                    continue
+                safe_user = "".join(c if c.isalnum() or c in "@._-" else "_" for c in source_user or "")
+                with open(path, "rb") as src, archive.open(f"{mailbox_id}_{safe_user}.log", "w") as dest:
+                    while True:
+                        block = src.read(COPY_BUFFER)
+                        if not block:
+                            break
+                        dest.write(block)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                data = sink.drain()
+                if data:
+                    yield data
+        # Central directory
+        yield sink.drain()
+    finally:
+        db.close()
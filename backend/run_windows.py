@@ -0,0 +1,162 @@
+"""
+Scheduled starts and recurring run windows.
+
+A job with a future scheduled_start, or with run_windows that are currently
+closed, is parked in status 'scheduled': its mailboxes stay pending and are not
+claimed. A loop checks every WINDOW_CHECK_INTERVAL seconds:
+
+  - window opens: the job goes back to 'running' and its pending mailboxes are queued
+  - window closes: the job goes to 'scheduled' and this process checkpoints its
+    running syncs for that job - the imapsync process is stopped and the mailbox
+    returns to pending with its progress (UID cache, transferred counters), so the
+    next window resumes it instead of failing it
+
+run_windows is stored on the job as
+    {"timezone": "Europe/Paris", "windows": [{"days": [0, 1, 2, 3, 4], "start": "22:00", "end": "06:00"}]}
+with days 0 = Monday; a window whose end is not after its start runs past midnight.
+"""
+import os
+import sys
+import threading
+from datetime import datetime, time, timezone
+from typing import List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+WINDOW_CHECK_INTERVAL = int(os.getenv("WINDOW_CHECK_INTERVAL", 60))
+
+WINDOW_CLOSED_MESSAGE = "Run window closed, will resume in the next window"
+
+
+class RunWindow(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    days: List[int] = Field(default_factory=lambda: list(range(7)))
+    start: time
+    end: time
+
+    @field_validator("days")
+    @classmethod
+    def _valid_days(cls, value):
+        if not value or any(day < 0 or day > 6 for day in value):
+            raise ValueError("days must be weekday numbers 0 (Monday) to 6 (Sunday)")
+        return sorted(set(value))
+
+    def contains(self, local: datetime) -> bool:
+        now = local.time()
+        if self.start < self.end:
+            return local.weekday() in self.days and self.start <= now < self.end
+        # Overnight window: the part before midnight belongs to the day it started on
+        if now >= self.start:
+            return local.weekday() in self.days
+        return now < self.end and (local.weekday() - 1) % 7 in self.days
+
+
+class RunWindows(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    timezone: str = "UTC"
+    windows: List[RunWindow] = Field(min_length=1)
+
+    @field_validator("timezone")
+    @classmethod
+    def _known_timezone(cls, value):
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"unknown timezone {value!r}")
+        return value
+
+    def is_open(self, now_utc: datetime) -> bool:
+        local = now_utc.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(self.timezone))
+        return any(window.contains(local) for window in self.windows)
+
+
+def to_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive UTC; aware input is converted, naive input taken as UTC."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def load_run_windows(stored) -> Optional[RunWindows]:
+    if not stored:
+        return None
+    try:
+        return RunWindows.model_validate(stored)
+    except ValueError as e:
+        print(f"Ignoring invalid run windows {stored!r}: {e}")
+        return None
+
+
+def may_run(job, now: Optional[datetime] = None) -> bool:
+    now = now or datetime.utcnow()
+    if job.scheduled_start and job.scheduled_start > now:
+        return False
+    windows = load_run_windows(job.run_windows)
+    return windows is None or windows.is_open(now)
+
+
+def active_status(job, now: Optional[datetime] = None) -> str:
+    """Status for a job that is (re)started: 'running' inside its window, else 'scheduled'."""
+    return "running" if may_run(job, now) else "scheduled"
+
+
+def check_windows(enqueue, now: Optional[datetime] = None):
+    """One pass of the window loop. Returns (started job ids, parked job ids, checkpointed mailbox ids)."""
+    from database import SessionLocal, Job, Mailbox
+    import worker
+
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        candidates = db.query(Job).filter(
+            (Job.status == "scheduled") |
+            ((Job.status.in_(("running", "pending"))) & (Job.run_windows.isnot(None)))
+        ).all()
+        started = [job.id for job in candidates if job.status == "scheduled" and may_run(job, now)]
+        parked = [job.id for job in candidates if job.status != "scheduled" and not may_run(job, now)]
+        if started:
+            db.query(Job).filter(Job.id.in_(started), Job.status == "scheduled") \
+                .update({Job.status: "running"}, synchronize_session=False)
+        if parked:
+            db.query(Job).filter(Job.id.in_(parked), Job.status.in_(("running", "pending"))) \
+                .update({Job.status: "scheduled"}, synchronize_session=False)
+        db.commit()
+
+        to_queue = [row.id for row in db.query(Mailbox.id).filter(
+            Mailbox.job_id.in_(started), Mailbox.status == "pending")] if started else []
+
+        # Every process checkpoints its own syncs of parked jobs, including ones parked by another process
+        local = list(worker.active_processes.keys())
+        to_checkpoint = [row.id for row in db.query(Mailbox.id).join(Job, Job.id == Mailbox.job_id).filter(
+            Mailbox.id.in_(local), Mailbox.status == "running", Job.status == "scheduled")] if local else []
+    finally:
+        db.close()
+
+    for job_id in started:
+        print(f"Run window opened for job {job_id}")
+    for job_id in parked:
+        print(f"Run window closed for job {job_id}")
+    if to_queue:
+        enqueue(to_queue)
+    checkpointed = [mailbox_id for mailbox_id in to_checkpoint
+                    if worker.checkpoint_sync(mailbox_id, WINDOW_CLOSED_MESSAGE)]
+    return started, parked, checkpointed
+
+
+def _window_loop(stop_event, enqueue):
+    while not stop_event.is_set():
+        try:
+            check_windows(enqueue)
+        except Exception as e:
+            print(f"Run window check failed: {e}")
+        if stop_event.wait(WINDOW_CHECK_INTERVAL):
+            break
+
+
+def start_window_loop(stop_event, enqueue):
+    threading.Thread(target=_window_loop, args=(stop_event, enqueue), name="run-windows", daemon=True).start()
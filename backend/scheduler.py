@@ -0,0 +1,110 @@
+"""
+Fair-share scheduling of mailbox syncs across jobs.
+
+Replaces the FIFO executor: each job has its own queue, and a free worker slot
+goes to the eligible job with the lowest virtual time (stride scheduling, a
+weighted round-robin). Every dispatch advances a job's virtual time by
+1 / priority, so a priority-10 job gets ten slots for each one of a priority-1
+job, and a job that just arrived starts at the current virtual time: it neither
+waits behind the backlog of older jobs nor gets a burst to "catch up".
+
+A job never has more than its max_concurrency mailboxes running in this process,
+and with an admission check (see admission.py) a slot is only used while the
+host has room for another imapsync.
+"""
+import threading
+from collections import deque
+
+DEFAULT_PRIORITY = 5
+MIN_PRIORITY, MAX_PRIORITY = 1, 10
+
+# How often a refused admission is retried
+ADMISSION_RETRY_SECONDS = 1.0
+
+
+class _JobQueue:
+    __slots__ = ("job_id", "weight", "max_concurrency", "queue", "running", "vtime")
+
+    def __init__(self, job_id, weight, max_concurrency, vtime):
+        self.job_id = job_id
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.queue = deque()
+        self.running = 0
+        self.vtime = vtime
+
+    def eligible(self) -> bool:
+        return bool(self.queue) and (not self.max_concurrency or self.running < self.max_concurrency)
+
+
+class FairScheduler:
+    def __init__(self, run, workers: int, admit=None):
+        self.run = run
+        self.workers = workers
+        self.admit = admit    # admit(running) -> bool, asked before every dispatch
+        self._running = 0
+        self._cond = threading.Condition()
+        self._jobs = {}       # job_id -> _JobQueue (only while it has queued or running work)
+        self._vtime = 0.0     # virtual time of the last dispatch
+        self._threads = []
+
+    def submit(self, job_id: str, mailbox_ids, priority=None, max_concurrency=None):
+        """Queues mailboxes of one job. Duplicates are harmless: the worker claims atomically."""
+        weight = min(max(priority or DEFAULT_PRIORITY, MIN_PRIORITY), MAX_PRIORITY)
+        with self._cond:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                entry = self._jobs[job_id] = _JobQueue(job_id, weight, max_concurrency, self._vtime)
+            else:
+                entry.weight, entry.max_concurrency = weight, max_concurrency
+            entry.queue.extend(mailbox_ids)
+            self._ensure_threads()
+            self._cond.notify_all()
+
+    def _ensure_threads(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"sync-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next(self):
+        """Blocks until some job may start a mailbox; returns (job queue, mailbox_id)."""
+        with self._cond:
+            while True:
+                candidates = [entry for entry in self._jobs.values() if entry.eligible()]
+                if candidates and (self.admit is None or self.admit(self._running)):
+                    entry = min(candidates, key=lambda e: (e.vtime, -e.weight))
+                    self._vtime = max(self._vtime, entry.vtime)
+                    entry.vtime += 1.0 / entry.weight
+                    entry.running += 1
+                    self._running += 1
+                    return entry, entry.queue.popleft()
+                self._cond.wait(ADMISSION_RETRY_SECONDS if candidates else None)
+
+    def _done(self, entry):
+        with self._cond:
+            entry.running -= 1
+            self._running -= 1
+            if not entry.queue and entry.running == 0 and self._jobs.get(entry.job_id) is entry:
+                del self._jobs[entry.job_id]
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            entry, mailbox_id = self._next()
+            try:
+                self.run(mailbox_id)
+            except Exception as e:
+                print(f"Sync of mailbox {mailbox_id} crashed: {e}")
+            finally:
+                self._done(entry)
+
+    def snapshot(self):
+        """Per-job queue state, for /api/health."""
+        with self._cond:
+            return {
+                entry.job_id: {"queued": len(entry.queue), "running": entry.running,
+                               "priority": entry.weight, "max_concurrency": entry.max_concurrency}
+                for entry in self._jobs.values()
+            }
@@ -0,0 +1,188 @@
+"""
+Synthetic data for load testing.
+
+Usage: python seed_data.py JOBS MAILBOXES_PER_JOB [--logs FRACTION] [--random-seed N]
+       python seed_data.py --purge
+
+Fills the database in DATABASE_URL (SQLite or MySQL; run migrate.py first) with
+JOBS jobs of MAILBOXES_PER_JOB mailboxes each. Job statuses follow a realistic
+mix (mostly completed, some running, paused, failed, pending), mailbox statuses
+follow their job's status, and the job counters match the mailbox rows, as the
+workers would have left them. A FRACTION of the mailboxes (default 0.1) gets a
+fake imapsync log in logs/.
+
+Rows are written with multi-row INSERTs of INSERT_BATCH rows. Every seeded job
+is named "seed-..." so --purge can remove exactly those again (through
+archive.delete_job, logs included). Use a database of its own: a server started
+on it would try to sync the seeded pending mailboxes.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import insert
+from database import SessionLocal, Job, Mailbox, encrypt_password
+
+INSERT_BATCH = 2000
+LOG_DIR = "logs"
+NAME_PREFIX = "seed-"
+
+# Job status -> share of jobs
+JOB_STATUSES = (("completed", 0.6), ("running", 0.15), ("paused", 0.05), ("failed", 0.05), ("pending", 0.15))
+
+# Job status -> mailbox status mix
+MAILBOX_STATUSES = {
+    "completed": (("success", 0.93), ("failed", 0.07)),
+    "failed": (("success", 0.5), ("failed", 0.5)),
+    "running": (("success", 0.45), ("failed", 0.03), ("running", 0.04), ("pending", 0.48)),
+    "paused": (("success", 0.3), ("failed", 0.02), ("pending", 0.68)),
+    "pending": (("pending", 1.0),),
+}
+
+FAILURE_MESSAGES = (
+    "Exited with code 16. Check logs.",
+    "Exited with code 161. Check logs.",
+    "Host1 failure: Error login on [imap.source.example] with user [x] auth [LOGIN]: 2 NO [AUTHENTICATIONFAILED]",
+    "Stopped by user",
+)
+
+FOLDERS = ("INBOX", "Sent", "Drafts", "Archive", "Trash", "Projects/2023", "Projects/2024")
+
+
+def _pick(rng, weighted):
+    point, total = rng.random(), 0.0
+    for value, share in weighted:
+        total += share
+        if point < total:
+            return value
+    return weighted[-1][0]
+
+
+def _fake_log(rng, source_user, target_user, status, messages, data):
+    lines = [f"Here is imapsync 2.229 on host seed, a linux system with 7.7/15.5 free GiB of RAM",
+             f"Host1: user [{source_user}] Host2: user [{target_user}]"]
+    for n in range(min(messages, 200)):
+        folder = rng.choice(FOLDERS)
+        lines.append(f"msg {folder}/{n + 1} {{{rng.randint(800, 400000)}}} copied to {folder}/{n + 1}   "
+                     f"{rng.uniform(0.5, 9):.2f} msgs/s  {rng.uniform(10, 900):.3f} KiB/s")
+    lines.append(f"Messages transferred                     : {messages}")
+    lines.append(f"Messages skipped                         : {rng.randint(0, 50)}")
+    lines.append(f"Total bytes transferred                  : {data} ({data / 1024 / 1024:.3f} MiB)")
+    if status == "failed":
+        lines.append("Detected 1 errors")
+    return "\n".join(lines) + "\n"
+
+
+def seed(jobs: int, mailboxes_per_job: int, log_fraction: float = 0.1, random_seed: int = None):
+    """Inserts the synthetic jobs and mailboxes; returns the new job ids."""
+    rng = random.Random(random_seed)
+    # One ciphertext for everyone: encrypting per row would dominate the run time
+    password = encrypt_password("seed-password")
+    now = datetime.utcnow()
+    job_ids = []
+    if log_fraction > 0:
+        os.makedirs(LOG_DIR, exist_ok=True)
+
+    db = SessionLocal()
+    try:
+        for j in range(jobs):
+            job_id = str(uuid.uuid4())
+            job_status = _pick(rng, JOB_STATUSES)
+            created_at = now - timedelta(days=rng.uniform(0, 60))
+            counters = {"success": 0, "failed": 0}
+            total_bytes = 0
+            db.execute(insert(Job), [{
+                "id": job_id, "name": f"{NAME_PREFIX}{j:05d}", "status": job_status,
+                "source_host": f"imap{j % 7}.source.example", "target_host": "imap.target.example",
+                "total_mailboxes": mailboxes_per_job, "created_at": created_at,
+            }])
+
+            logs = []
+            for start in range(0, mailboxes_per_job, INSERT_BATCH):
+                rows = []
+                for n in range(start, min(start + INSERT_BATCH, mailboxes_per_job)):
+                    status = _pick(rng, MAILBOX_STATUSES[job_status])
+                    finished = status in ("success", "failed")
+                    messages = int(rng.lognormvariate(7, 1.2)) if finished else 0
+                    data = messages * rng.randint(20_000, 120_000)
+                    if status in counters:
+                        counters[status] += 1
+                    total_bytes += data
+                    source_user = f"user{n:06d}@j{j}.source.example"
+                    rows.append({
+                        "job_id": job_id, "source_user": source_user, "source_pass": password,
+                        "target_user": source_user.replace("source", "target"), "target_pass": password,
+                        "status": status,
+                        "message": rng.choice(FAILURE_MESSAGES) if status == "failed"
+                        else "Sync Completed Successfully" if status == "success" else None,
+                        "data_transferred": data, "messages_transferred": messages,
+                        "attempts": 1 if finished or status == "running" else 0,
+                        "started_at": created_at if finished or status == "running" else None,
+                        "finished_at": created_at + timedelta(minutes=rng.uniform(1, 240)) if finished else None,
+                        "heartbeat_at": now if status == "running" else None,
+                    })
+                db.execute(insert(Mailbox), rows)
+                if log_fraction > 0:
+                    logs.extend(row for row in rows if row["status"] != "pending" and rng.random() < log_fraction)
+            db.query(Job).filter(Job.id == job_id).update({
+                Job.completed: counters["success"], Job.failed: counters["failed"],
+                Job.data_transferred: total_bytes}, synchronize_session=False)
+            db.commit()
+            job_ids.append(job_id)
+
+            if logs:
+                _write_logs(db, rng, job_id, logs)
+    finally:
+        db.close()
+    return job_ids
+
+
+def _write_logs(db, rng, job_id, rows):
+    wanted = {(row["source_user"], row["target_user"]): row for row in rows}
+    for mailbox in db.query(Mailbox.id, Mailbox.source_user, Mailbox.target_user).filter(Mailbox.job_id == job_id):
+        row = wanted.get((mailbox.source_user, mailbox.target_user))
+        if row:
+            with open(os.path.join(LOG_DIR, f"{mailbox.id}.log"), "w") as f:
+                f.write(_fake_log(rng, row["source_user"], row["target_user"], row["status"],
+                                  row["messages_transferred"], row["data_transferred"]))
+
+
+def purge():
+    """Deletes every seeded job with its mailboxes and logs."""
+    import archive
+    db = SessionLocal()
+    try:
+        job_ids = [row.id for row in db.query(Job.id).filter(Job.name.like(f"{NAME_PREFIX}%"))]
+    finally:
+        db.close()
+    for job_id in job_ids:
+        archive.delete_job(job_id)
+    return len(job_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed synthetic jobs and mailboxes for load testing")
+    parser.add_argument("jobs", type=int, nargs="?", default=0)
+    parser.add_argument("mailboxes", type=int, nargs="?", default=0, help="mailboxes per job")
+    parser.add_argument("--logs", type=float, default=0.1, help="fraction of mailboxes with a fake log")
+    parser.add_argument("--random-seed", type=int, default=None)
+    parser.add_argument("--purge", action="store_true", help="delete all seeded jobs instead")
+    args = parser.parse_args()
+
+    if args.purge:
+        print(f"Deleted {purge()} seeded jobs")
+        sys.exit(0)
+    if not args.jobs or not args.mailboxes:
+        parser.error("JOBS and MAILBOXES are required unless --purge is given")
+
+    started = time.perf_counter()
+    job_ids = seed(args.jobs, args.mailboxes, args.logs, args.random_seed)
+    elapsed = time.perf_counter() - started
+    rows = len(job_ids) * args.mailboxes
+    print(f"Seeded {len(job_ids)} jobs / {rows} mailboxes in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
@@ -0,0 +1,225 @@
+"""
+In-memory static asset store for the frontend.
+
+HTML pages and the css/js bundles are read once, precompressed (gzip and,
+if the optional 'brotli' package is installed, br) and served with
+ETag / Last-Modified validators. app.js and style.css are also exposed
+under content-hashed names so they can be cached forever by browsers.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip-only when brotli is not installed
+    brotli = None
+
+# Assets that get a content-hashed alias (e.g. js/app.3f2a9c1b.js)
+HASHED_ASSETS = ["css/style.css", "js/app.js"]
+HTML_PAGES = ["index.html", "create-job.html", "job-detail.html", "guide.html"]
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+MEDIA_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+}
+
+# Don't bother compressing tiny payloads
+MIN_COMPRESS_SIZE = 512
+
+
+class StaticAsset:
+    """A single file held in memory with its precompressed variants."""
+
+    def __init__(self, path: str, content: bytes, mtime: float, media_type: str):
+        self.path = path
+        self.mtime = mtime
+        self.media_type = media_type
+        self.content = content
+        self.digest = hashlib.sha256(content).hexdigest()
+        self.etag = f'"{self.digest[:16]}"'
+        self.last_modified = formatdate(mtime, usegmt=True)
+
+        self.gzip = None
+        self.br = None
+        if len(content) >= MIN_COMPRESS_SIZE:
+            self.gzip = gzip.compress(content, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.br = brotli.compress(content, quality=11)
+
+    def hashed_name(self, rel_path: str) -> str:
+        stem, ext = os.path.splitext(rel_path)
+        return f"{stem}.{self.digest[:8]}{ext}"
+
+
+def _media_type(path: str) -> str:
+    ext = os.path.splitext(path)[1]
+    return MEDIA_TYPES.get(ext) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def _load_asset(path: str, transform=None) -> StaticAsset:
+    with open(path, "rb") as f:
+        content = f.read()
+    if transform:
+        content = transform(content)
+    return StaticAsset(path, content, os.path.getmtime(path), _media_type(path))
+
+
+def _accepted_encodings(header: str) -> dict:
+    """Accept-Encoding -> {coding: q}; codings with q=0 are refused."""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def _acceptable(accepted: dict, coding: str) -> bool:
+    return accepted.get(coding, accepted.get("*", 0.0)) > 0
+
+
+class AssetStore:
+    """
+    Loads the frontend into memory on first use (or via preload()).
+    With reload=True (development) files are re-read when their mtime changes.
+    """
+
+    def __init__(self, base_dir: str, reload: bool = False):
+        self.base_dir = base_dir
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._assets = {}   # "js/app.js" -> StaticAsset
+        self._hashed = {}   # "js/app.3f2a9c1b.js" -> "js/app.js"
+        self._pages = {}    # "index.html" -> StaticAsset (with rewritten asset URLs)
+        self._mtimes = {}
+        self._loaded = False
+
+    def _scan_mtimes(self):
+        mtimes = {}
+        for rel in HASHED_ASSETS + HTML_PAGES:
+            path = os.path.join(self.base_dir, rel)
+            if os.path.exists(path):
+                mtimes[rel] = os.path.getmtime(path)
+        for folder in ("css", "js"):
+            # Subdirectories too (e.g. js/vendor/...), as the StaticFiles mounts served them
+            for root, _, names in os.walk(os.path.join(self.base_dir, folder)):
+                for name in names:
+                    path = os.path.join(root, name)
+                    rel = os.path.relpath(path, self.base_dir).replace(os.sep, "/")
+                    if rel not in mtimes:
+                        mtimes[rel] = os.path.getmtime(path)
+        return mtimes
+
+    def _load(self):
+        mtimes = self._scan_mtimes()
+        assets = {}
+        hashed = {}
+        for rel in mtimes:
+            if rel in HTML_PAGES:
+                continue
+            asset = _load_asset(os.path.join(self.base_dir, rel))
+            assets[rel] = asset
+            if rel in HASHED_ASSETS:
+                hashed[asset.hashed_name(rel)] = rel
+
+        # Point <link>/<script> tags at the hashed names, dropping any manual ?v= suffix
+        urls = {rel: assets[rel].hashed_name(rel) for rel in HASHED_ASSETS if rel in assets}
+
+        def rewrite(content: bytes) -> bytes:
+            text = content.decode("utf-8")
+            for rel, hashed_rel in urls.items():
+                text = re.sub(r'(["\'])(/?)' + re.escape(rel) + r'(\?[^"\']*)?\1', rf"\1\2{hashed_rel}\1", text)
+            return text.encode("utf-8")
+
+        pages = {}
+        for rel in HTML_PAGES:
+            if rel in mtimes:
+                pages[rel] = _load_asset(os.path.join(self.base_dir, rel), transform=rewrite)
+
+        self._assets, self._hashed, self._pages, self._mtimes = assets, hashed, pages, mtimes
+        self._loaded = True
+
+    def _ensure_loaded(self):
+        if self._loaded and not self.reload:
+            return
+        with self._lock:
+            if not self._loaded or (self.reload and self._scan_mtimes() != self._mtimes):
+                self._load()
+
+    def preload(self):
+        self._ensure_loaded()
+
+    def page(self, filename: str):
+        self._ensure_loaded()
+        return self._pages.get(filename)
+
+    def asset(self, rel_path: str):
+        """Returns (asset, is_hashed) for a css/js path, or (None, False)."""
+        self._ensure_loaded()
+        if rel_path in self._hashed:
+            return self._assets.get(self._hashed[rel_path]), True
+        return self._assets.get(rel_path), False
+
+
+def _not_modified(request: Request, asset: StaticAsset) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or asset.etag in tags or f"W/{asset.etag}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(asset.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def asset_response(request: Request, asset: StaticAsset, cache_control: str) -> Response:
+    """Builds a 200/304 response, picking the best precompressed variant."""
+    headers = {
+        "ETag": asset.etag,
+        "Last-Modified": asset.last_modified,
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+
+    if _not_modified(request, asset):
+        return Response(status_code=304, headers=headers)
+
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    body = asset.content
+    if asset.br is not None and _acceptable(accepted, "br"):
+        body = asset.br
+        headers["Content-Encoding"] = "br"
+    elif asset.gzip is not None and _acceptable(accepted, "gzip"):
+        body = asset.gzip
+        headers["Content-Encoding"] = "gzip"
+
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(len(body))
+        return Response(status_code=200, headers=headers, media_type=asset.media_type)
+    return Response(content=body, headers=headers, media_type=asset.media_type)
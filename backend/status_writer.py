@@ -0,0 +1,197 @@
+"""
+Write-behind mailbox status updates.
+
+Worker threads don't commit their own row changes. They hand column values to
+the process-wide status_writer, which merges repeated updates of the same row
+and writes everything pending as one multi-row UPDATE (a CASE on the id per
+column) in a single transaction every STATUS_FLUSH_SECONDS.
+
+The final result of a run (success, failed, or back to pending) is flushed
+right away instead, and finish() only returns once it is committed. Runs that
+finish around the same time share that flush, including one recount of each
+affected job's counters and delta-pass stats, instead of several count queries
+per mailbox.
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import case, func, literal
+from database import Mailbox, Job, SyncPass
+from db_writer import db_writer
+
+STATUS_FLUSH_SECONDS = float(os.getenv("STATUS_FLUSH_SECONDS", 1))
+STATUS_FINAL_TIMEOUT = float(os.getenv("STATUS_FINAL_TIMEOUT", 30))
+
+# Rows per UPDATE statement
+MAX_BATCH_ROWS = 500
+
+
+class _FinishedRun:
+    __slots__ = ("mailbox_id", "job_id", "status", "pass_number", "pass_bytes", "pass_messages", "done")
+
+    def __init__(self, mailbox_id, job_id, status, pass_number, pass_bytes, pass_messages):
+        self.mailbox_id = mailbox_id
+        self.job_id = job_id
+        self.status = status
+        self.pass_number = pass_number or 1
+        self.pass_bytes = pass_bytes or 0
+        self.pass_messages = pass_messages or 0
+        self.done = threading.Event()
+
+
+class StatusWriter:
+    def __init__(self, flush_seconds: float = STATUS_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = {}      # mailbox_id -> {column name: value}
+        self._finished = []     # runs whose final state is waiting to be committed
+        self._thread = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.updates_merged = 0
+        self.failures = 0
+
+    def update(self, mailbox_id: int, **values):
+        """Queues column values for a mailbox; written with the next periodic flush."""
+        with self._cond:
+            row = self._pending.setdefault(mailbox_id, {})
+            self.updates_merged += len(values.keys() & row.keys())
+            row.update(values)
+            self._ensure_thread()
+
+    def finish(self, mailbox_id: int, job_id: str, values: dict, pass_number: int = 1,
+               pass_bytes: int = 0, pass_messages: int = 0, timeout: float = STATUS_FINAL_TIMEOUT) -> bool:
+        """Queues the final state of a run and waits until it is committed, with the job's counters."""
+        run = _FinishedRun(mailbox_id, job_id, values.get("status"), pass_number, pass_bytes, pass_messages)
+        with self._cond:
+            self._pending.setdefault(mailbox_id, {}).update(values)
+            self._finished.append(run)
+            self._ensure_thread()
+            self._cond.notify_all()
+        if run.done.wait(timeout):
+            return True
+        print(f"Final status of mailbox {mailbox_id} not yet written after {timeout}s; still queued")
+        return False
+
+    def flush(self):
+        """Writes everything queued now (used on shutdown)."""
+        with self._flush_lock:
+            self._flush_once()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="status-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._finished:
+                    self._cond.wait(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                self.failures += 1
+                print(f"Status flush failed (will retry): {e}")
+                time.sleep(self.flush_seconds)
+
+    def _flush_once(self):
+        with self._cond:
+            pending, finished = self._pending, self._finished
+            self._pending, self._finished = {}, []
+        if not pending and not finished:
+            return
+
+        def write(db):
+            _apply(db, pending)
+            if finished:
+                _recount(db, finished)
+
+        try:
+            db_writer.run(write)
+        except Exception:
+            with self._cond:
+                # Put the batch back; values queued since then are newer and win
+                for mailbox_id, values in pending.items():
+                    self._pending[mailbox_id] = {**values, **self._pending.get(mailbox_id, {})}
+                self._finished = finished + self._finished
+            raise
+
+        self.flushes += 1
+        self.rows_written += len(pending)
+        for run in finished:
+            run.done.set()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            queued = len(self._pending)
+        return {
+            "queued_rows": queued,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "updates_merged": self.updates_merged,
+            "failures": self.failures,
+        }
+
+
+def _apply(db, pending: dict):
+    """One UPDATE ... SET col = CASE id WHEN .. THEN .. END per MAX_BATCH_ROWS rows."""
+    ids = sorted(pending)
+    for start in range(0, len(ids), MAX_BATCH_ROWS):
+        chunk = ids[start:start + MAX_BATCH_ROWS]
+        names = {name for mailbox_id in chunk for name in pending[mailbox_id]}
+        values = {}
+        for name in sorted(names):
+            column = getattr(Mailbox, name)
+            whens = {mailbox_id: literal(pending[mailbox_id][name], column.type)
+                     for mailbox_id in chunk if name in pending[mailbox_id]}
+            # Rows in this statement that don't set the column keep their value
+            else_ = column if len(whens) < len(chunk) else None
+            values[column] = case(whens, value=Mailbox.id, else_=else_)
+        db.query(Mailbox).filter(Mailbox.id.in_(chunk)).update(values, synchronize_session=False)
+
+
+def _recount(db, finished):
+    """Refreshes the counters of every job (and delta pass) that had runs finish in this batch."""
+    for job_id in {run.job_id for run in finished if run.job_id}:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job:
+            continue
+        counts = {status: (count, data or 0) for status, count, data in db.query(
+            Mailbox.status, func.count(Mailbox.id), func.sum(Mailbox.data_transferred)
+        ).filter(Mailbox.job_id == job_id).group_by(Mailbox.status)}
+        job.completed = counts.get("success", (0, 0))[0]
+        job.failed = counts.get("failed", (0, 0))[0]
+        job.data_transferred = sum(data for _, data in counts.values())
+        # Only an active job completes; deleting/archiving, paused, scheduled and cancelled keep their status
+        if job.status in ('running', 'pending') and (job.completed + job.failed) >= job.total_mailboxes:
+            job.status = 'completed'
+
+    passes = {}
+    for run in finished:
+        if run.pass_number > 1 and run.status in ('success', 'failed'):
+            totals = passes.setdefault((run.job_id, run.pass_number), [0, 0])
+            totals[0] += run.pass_bytes
+            totals[1] += run.pass_messages
+    for (job_id, pass_number), (data, messages) in passes.items():
+        counts = dict(db.query(Mailbox.status, func.count(Mailbox.id)).filter(
+            Mailbox.job_id == job_id, Mailbox.pass_number == pass_number).group_by(Mailbox.status).all())
+        values = {
+            SyncPass.completed: counts.get('success', 0),
+            SyncPass.failed: counts.get('failed', 0),
+            SyncPass.data_transferred: func.coalesce(SyncPass.data_transferred, 0) + data,
+            SyncPass.messages_transferred: func.coalesce(SyncPass.messages_transferred, 0) + messages,
+        }
+        if counts.get('pending', 0) + counts.get('running', 0) == 0:
+            values[SyncPass.finished_at] = datetime.utcnow()
+        db.query(SyncPass).filter(SyncPass.job_id == job_id, SyncPass.pass_number == pass_number) \
+            .update(values, synchronize_session=False)
+
+
+status_writer = StatusWriter()
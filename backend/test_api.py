@@ -10,7 +10,16 @@ import os
 # Add backend to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# Test jobs point at made-up hosts; don't attempt capability logins to them
+os.environ.setdefault("CAPABILITY_PROBE", "0")
+# Fixture jobs are back-dated; keep the retention loop from archiving them mid-test
+os.environ.setdefault("ARCHIVE_AFTER_DAYS", "0")
+
 from main import app
+from database import migrate
+
+# The API no longer creates tables on import; migrate explicitly like a deploy would
+migrate()
 
 client = TestClient(app)
 
@@ -28,6 +37,43 @@ class TestHealthCheck:
         assert "database" in data
 
 
+class TestStartup:
+    """Test deferred initialization"""
+
+    def test_lifespan_startup(self):
+        """Test that the lifespan handler runs startup without touching the schema"""
+        with TestClient(app) as lifespan_client:
+            response = lifespan_client.get("/api/health")
+            assert response.status_code == 200
+        assert os.path.isdir("logs")
+
+    def test_migrate_is_idempotent(self):
+        """Test that re-running migrate on an up-to-date schema adds nothing"""
+        assert migrate() == []
+
+    def test_added_columns_keep_defaults(self):
+        """Test that ADD COLUMN carries the model default, which fills the existing rows"""
+        import sqlite3
+        from database import _column_ddl, Mailbox
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE mailboxes (id INTEGER PRIMARY KEY)")
+        conn.execute("INSERT INTO mailboxes (id) VALUES (1)")
+        for name in ("attempts", "pass_number", "status"):
+            conn.execute(f"ALTER TABLE mailboxes ADD COLUMN {_column_ddl(Mailbox.__table__.c[name])}")
+        assert conn.execute("SELECT attempts, pass_number, status FROM mailboxes").fetchone() == (0, 1, "pending")
+
+    def test_import_does_not_load_sync_modules(self):
+        """Test that importing the API leaves reports, uploads and IMAP probing unloaded"""
+        import subprocess
+        import sys
+        code = ("import sys, main; print(','.join(m for m in ('reports', 'ingest', 'capabilities', 'preflight', "
+                "'imaplib') if m in sys.modules))")
+        result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, env={**os.environ, "AUTO_MIGRATE": "0"})
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1:] in ([], [""])
+
+
 class TestStatsEndpoint:
     """Test dashboard stats endpoint (no auth required)"""
     
@@ -95,6 +141,47 @@ class TestJobsEndpoint:
         assert "mailboxes" in data
         assert "progress" in data
     
+    def test_list_jobs_pagination_and_filters(self):
+        """Test keyset pagination and status/date filters on the job list"""
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Job
+        import uuid
+        import random
+        marker = f"page-{uuid.uuid4().hex[:8]}"
+        # A time window of its own, so jobs left by earlier runs on the same database don't show up
+        base = datetime(2001, 1, 1) + timedelta(hours=random.randint(0, 10 ** 6))
+        db = SessionLocal()
+        db.add_all([Job(id=str(uuid.uuid4()), name=marker, status="completed" if i % 2 else "failed",
+                        source_host="a", target_host="b", total_mailboxes=4, completed=2, failed=0,
+                        data_transferred=i * 2048, created_at=base + timedelta(minutes=i // 2))
+                    for i in range(7)])
+        db.commit()
+        db.close()
+
+        window = {"created_from": base.isoformat(), "created_to": (base + timedelta(hours=1)).isoformat()}
+        seen = []
+        cursor = None
+        while True:
+            params = dict(window, limit=3, **({"cursor": cursor} if cursor else {}))
+            response = client.get("/api/jobs", params=params)
+            assert response.status_code == 200
+            seen.extend(response.json())
+            cursor = response.headers.get("x-next-cursor")
+            if not cursor:
+                break
+        assert len(seen) == 7 and len({j["id"] for j in seen}) == 7
+        assert [j["created_at"] for j in seen] == sorted((j["created_at"] for j in seen), reverse=True)
+        assert seen[0]["progress"] == 50
+        assert seen[0]["data_transferred_bytes"] == 12288 and seen[0]["data_transferred"] == "12.00 KB"
+
+        # Without a limit the whole list comes back in one response, as before pagination
+        unpaged = client.get("/api/jobs", params=window)
+        assert len(unpaged.json()) == 7 and "x-next-cursor" not in unpaged.headers
+
+        failed = client.get("/api/jobs", params=dict(window, status="failed")).json()
+        assert len(failed) == 4 and all(j["status"] == "failed" for j in failed)
+        assert client.get("/api/jobs", params={"cursor": "!!"}).status_code == 400
+
     def test_get_nonexistent_job(self):
         """Test getting a job that doesn't exist"""
         response = client.get("/api/jobs/nonexistent-job-id")
@@ -139,6 +226,1575 @@ class TestMailboxEndpoint:
         assert response.status_code == 404
 
 
+class TestJobControl:
+    """Test bulk job control endpoints"""
+
+    def _create_job(self):
+        job_data = {
+            "name": "Bulk Control Job",
+            "source_host": "imap.source.com",
+            "target_host": "imap.target.com"
+        }
+        return client.post("/api/jobs", json=job_data).json()["id"]
+
+    def _add_mailboxes(self, job_id, rows):
+        from database import SessionLocal, Mailbox
+        db = SessionLocal()
+        ids = []
+        for n, (status, message) in enumerate(rows):
+            mb = Mailbox(job_id=job_id, source_user=f"u{n}@s.com", target_user=f"u{n}@t.com", status=status,
+                         message=message)
+            db.add(mb)
+            db.commit()
+            ids.append(mb.id)
+        db.close()
+        return ids
+
+    def test_retry_failed_with_message_filter(self):
+        """Test that only failed mailboxes matching the filter are re-queued"""
+        job_id = self._create_job()
+        self._add_mailboxes(job_id, [
+            ("failed", "Exited with code 16. Check logs."),
+            ("failed", "Exited with code 16. Check logs."),
+            ("failed", "Stopped by user"),
+            ("success", "Sync Completed Successfully"),
+        ])
+        response = client.post(f"/api/jobs/{job_id}/retry-failed", params={"message": "code 16"})
+        assert response.status_code == 200
+        assert response.json()["retried"] == 2
+
+    def test_retry_failed_nothing_to_do(self):
+        """Test retry-failed on a job without failures"""
+        job_id = self._create_job()
+        response = client.post(f"/api/jobs/{job_id}/retry-failed")
+        assert response.status_code == 200
+        assert response.json()["retried"] == 0
+
+    def test_pause_blocks_claims_and_resume_requeues(self):
+        """Test that a paused job's pending mailboxes are not claimed until resumed"""
+        from database import SessionLocal
+        from worker import claim_mailbox
+        job_id = self._create_job()
+
+        response = client.post(f"/api/jobs/{job_id}/pause")
+        assert response.status_code == 202
+        assert client.get(f"/api/jobs/{job_id}").json()["status"] == "paused"
+
+        [mailbox_id] = self._add_mailboxes(job_id, [("pending", None)])
+        db = SessionLocal()
+        assert claim_mailbox(db, mailbox_id) is False
+        db.close()
+
+        # Pausing twice is rejected
+        assert client.post(f"/api/jobs/{job_id}/pause").status_code == 400
+
+        response = client.post(f"/api/jobs/{job_id}/resume")
+        assert response.status_code == 200
+        assert response.json()["queued"] == 1
+
+    def test_cancel_marks_pending_and_running(self):
+        """Test that cancel fails every unfinished mailbox in one pass"""
+        job_id = self._create_job()
+        self._add_mailboxes(job_id, [("pending", None), ("running", "Starting imapsync..."), ("success", None)])
+        response = client.post(f"/api/jobs/{job_id}/cancel")
+        assert response.status_code == 202
+        assert response.json()["cancelled"] == 2
+
+
+class TestWorkerRecovery:
+    """Test orphan recovery and graceful shutdown in the worker"""
+
+    def test_recover_orphans(self):
+        """Test that orphaned rows are re-queued while live leases elsewhere are kept"""
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Mailbox
+        import worker
+
+        job_id = client.post("/api/jobs", json={
+            "name": "Recovery Job", "source_host": "a.com", "target_host": "b.com"
+        }).json()["id"]
+
+        db = SessionLocal()
+        now = datetime.utcnow()
+        # Owner process no longer exists on this host
+        orphan = Mailbox(job_id=job_id, status="running", worker_host=worker.WORKER_HOST,
+                         owner_pid=2 ** 22 + 1, worker_pid=2 ** 22 + 2, heartbeat_at=now)
+        # Another node, lease still valid
+        remote_live = Mailbox(job_id=job_id, status="running", worker_host="other-node", heartbeat_at=now)
+        # Another node, lease expired
+        remote_stale = Mailbox(job_id=job_id, status="running", worker_host="other-node",
+                               heartbeat_at=now - timedelta(seconds=worker.LEASE_SECONDS + 60))
+        db.add_all([orphan, remote_live, remote_stale])
+        db.commit()
+
+        requeue_ids = worker.recover_orphans(db)
+        db.expire_all()
+        assert orphan.id in requeue_ids and orphan.status == "pending"
+        assert remote_stale.id in requeue_ids and remote_stale.status == "pending"
+        assert remote_live.id not in requeue_ids and remote_live.status == "running"
+        db.close()
+
+    def test_recover_only_abandoned_preflights(self):
+        """Test that validating rows of live pre-flights are kept and abandoned ones queued"""
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Mailbox
+        import worker
+
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com",
+                                                "scheduled_start": "2099-01-01T00:00:00Z"}).json()["id"]
+        db = SessionLocal()
+        old = datetime.utcnow() - timedelta(seconds=worker.PREFLIGHT_STALE_SECONDS + 60)
+        dead_owner = Mailbox(job_id=job_id, status="validating", worker_host=worker.WORKER_HOST, owner_pid=2 ** 22 + 1)
+        live_sibling = Mailbox(job_id=job_id, status="validating", worker_host=worker.WORKER_HOST,
+                               owner_pid=os.getppid(), updated_at=old)
+        remote_recent = Mailbox(job_id=job_id, status="validating", worker_host="other-node")
+        remote_stale = Mailbox(job_id=job_id, status="validating", worker_host="other-node", updated_at=old)
+        db.add_all([dead_owner, live_sibling, remote_recent, remote_stale])
+        db.commit()
+
+        worker.recover_orphans(db)
+        db.expire_all()
+        assert [mb.status for mb in (dead_owner, live_sibling, remote_recent, remote_stale)] == \
+            ["pending", "validating", "validating", "pending"]
+        assert dead_owner.preflight_status == "skipped"
+        db.close()
+
+    def test_shutdown_stops_claims(self):
+        """Test that no mailbox is claimed once shutdown has started"""
+        from database import SessionLocal, Mailbox
+        import worker
+
+        job_id = client.post("/api/jobs", json={
+            "name": "Shutdown Job", "source_host": "a.com", "target_host": "b.com"
+        }).json()["id"]
+        db = SessionLocal()
+        mb = Mailbox(job_id=job_id, status="pending")
+        db.add(mb)
+        db.commit()
+
+        try:
+            assert worker.shutdown(drain_seconds=0) == []
+            assert worker.claim_mailbox(db, mb.id) is False
+        finally:
+            worker.shutting_down.clear()
+            db.close()
+
+
+class TestPreflight:
+    """Test the pre-flight IMAP login check against a local fake server"""
+
+    async def _fake_imap(self, reader, writer):
+        writer.write(b"* OK Fake IMAP ready\r\n")
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            tag, command, *args = line.decode().strip().split(" ")
+            if command == "LOGIN":
+                ok = args == ['"good@example.com"', '"secret"']
+                writer.write(f"{tag} OK LOGIN done\r\n".encode() if ok else f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials\r\n".encode())
+            elif command == "CAPABILITY":
+                writer.write(f"* CAPABILITY IMAP4rev1 UIDPLUS MOVE COMPRESS=DEFLATE APPENDLIMIT=1000000\r\n{tag} OK\r\n".encode())
+            elif command == "LOGOUT":
+                writer.write(f"* BYE\r\n{tag} OK\r\n".encode())
+                await writer.drain()
+                break
+            await writer.drain()
+        writer.close()
+
+    def test_validate_mailboxes(self):
+        """Test that good and bad credentials are told apart concurrently"""
+        import asyncio
+        from types import SimpleNamespace
+        from preflight import validate_mailboxes
+
+        async def scenario():
+            server = await asyncio.start_server(self._fake_imap, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            job = SimpleNamespace(source_host="127.0.0.1", source_port=port, source_security="None",
+                                  target_host="127.0.0.1", target_port=port, target_security="None")
+            rows = [
+                (1, "good@example.com", "secret", "good@example.com", "secret"),
+                (2, "good@example.com", "wrong", "good@example.com", "secret"),
+            ] + [(i, "good@example.com", "secret", "good@example.com", "secret") for i in range(3, 40)]
+            async with server:
+                return await validate_mailboxes(job, rows, per_host=5)
+
+        results = asyncio.run(scenario())
+        assert results[1] is None
+        assert "Source login failed" in results[2] and "AUTHENTICATIONFAILED" in results[2]
+        assert all(results[i] is None for i in range(3, 40))
+
+    def test_validate_unreachable_host(self):
+        """Test that connection errors are reported instead of raised"""
+        import asyncio
+        from types import SimpleNamespace
+        from preflight import validate_mailboxes
+
+        job = SimpleNamespace(source_host="127.0.0.1", source_port=1, source_security="None",
+                              target_host="127.0.0.1", target_port=1, target_security="SSL/TLS")
+        results = asyncio.run(validate_mailboxes(job, [(1, "a", "b", "c", "d")]))
+        assert "connection failed" in results[1]
+
+    def test_upload_with_preflight(self):
+        """Test that a pre-flight upload holds rows in 'validating' instead of queueing them"""
+        job_id = client.post("/api/jobs", json={
+            "name": "Preflight Job", "source_host": "127.0.0.1", "target_host": "127.0.0.1",
+            "source_port": 1, "target_port": 1, "source_security": "None", "target_security": "None"
+        }).json()["id"]
+        csv_data = "a@s.com,p1,a@t.com,p2\nb@s.com,p1,b@t.com,p2\n"
+        response = client.post(f"/api/upload/{job_id}", params={"preflight": "true"},
+                               files={"file": ("m.csv", csv_data, "text/csv")})
+        assert response.status_code == 200
+        assert response.json()["preflight"] is True
+
+    def test_capability_probe(self, monkeypatch):
+        """Test that capabilities are probed once per job and turned into imapsync flags"""
+        import asyncio
+        import threading
+        import capabilities
+        from database import SessionLocal, Job, Mailbox
+        from job_options import JobOptions, build_imapsync_args
+
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(self._fake_imap, "127.0.0.1", 0))
+        port = server.sockets[0].getsockname()[1]
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        monkeypatch.setattr(capabilities, "CAPABILITY_PROBE", True)
+
+        logins = []
+        real_probe = capabilities._probe
+        monkeypatch.setattr(capabilities, "_probe", lambda *args: logins.append(args) or real_probe(*args))
+
+        job_id = client.post("/api/jobs", json={
+            "name": "Probe Job", "source_host": "127.0.0.1", "target_host": "127.0.0.1",
+            "source_port": port, "target_port": port, "source_security": "None", "target_security": "None"
+        }).json()["id"]
+        db = SessionLocal()
+        try:
+            job = db.query(Job).filter(Job.id == job_id).first()
+            mailbox = Mailbox(job_id=job_id, source_user="good@example.com", target_user="good@example.com")
+            caps = capabilities.job_capabilities(db, job, mailbox, "secret", "secret")
+            # Same host:port on both sides: a single login
+            assert len(logins) == 1
+            assert caps["source"]["compress"] is True and caps["target"]["uidplus"] is True
+            assert caps["target"]["appendlimit"] == 1000000
+
+            capabilities.job_capabilities(db, job, mailbox, "secret", "secret")
+            assert len(logins) == 1
+            assert client.get(f"/api/jobs/{job_id}").json()["capabilities"]["source"]["move"] is True
+        finally:
+            db.close()
+            loop.call_soon_threadsafe(loop.stop)
+
+        assert job_id not in capabilities._locks
+
+        generic = build_imapsync_args(JobOptions(), caps)
+        assert "--compress1" in generic and "--compress2" in generic
+        assert generic[generic.index("--maxsize") + 1] == "1000000"
+        # Gmail's profile keeps compression off even where advertised
+        assert "--compress1" not in build_imapsync_args(JobOptions(profile="gmail"), caps)
+        no_compress = {"source": dict(caps["source"], compress=False), "target": caps["target"]}
+        assert "--compress1" not in build_imapsync_args(JobOptions(profile="dovecot"), no_compress)
+
+    def test_capability_probe_state_is_bounded(self, monkeypatch):
+        """Test that per-job probe locks and failure times don't pile up for the life of the process"""
+        import capabilities
+        from database import Mailbox
+        monkeypatch.setattr(capabilities, "CAPABILITY_PROBE", True)
+        monkeypatch.setattr(capabilities, "_probe", lambda *args: (_ for _ in ()).throw(OSError("refused")))
+        monkeypatch.setattr(capabilities, "_failures", {("old-job", "source"): 0.0})
+        job = type("ProbeJob", (), {"id": "bounded-job", "capabilities": None, "source_host": "s.example",
+                                    "source_port": 993, "source_security": "SSL/TLS", "target_host": "t.example",
+                                    "target_port": 993, "target_security": "SSL/TLS"})()
+        db = type("NoDb", (), {"refresh": lambda self, obj, attrs: None})()
+        assert capabilities.job_capabilities(db, job, Mailbox(source_user="u", target_user="u"), "p", "p") == {}
+        assert capabilities._locks == {}
+        # The expired failure of another job was pruned; this job's are kept until it goes away
+        assert set(capabilities._failures) == {("bounded-job", "source"), ("bounded-job", "target")}
+        capabilities.forget("bounded-job")
+        assert capabilities._failures == {}
+
+
+FAKE_IMAPSYNC = """#!/bin/sh
+echo "Command line: $*"
+case " $* " in
+  *" --nofoldersizes "*) ;;
+  *) echo "Host1 Nb messages: 10 messages"
+     echo "Host1 Total size: 8192 bytes (8.000 KiB)" ;;
+esac
+echo "Messages transferred                    : 7 "
+echo "Messages skipped                        : 3"
+echo "Total bytes transferred                 : 4096 (4.000 KiB)"
+exit 0
+"""
+
+
+def install_fake_imapsync(tmp_path, monkeypatch):
+    """Puts a stub imapsync that prints a final summary first on PATH"""
+    script = tmp_path / "imapsync"
+    script.write_text(FAKE_IMAPSYNC)
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+
+def wait_for_mailboxes(mailbox_ids, statuses=("success", "failed"), timeout=10):
+    """Polls until all mailboxes reach a final status; returns them"""
+    import time
+    from database import SessionLocal, Mailbox
+    deadline = time.time() + timeout
+    while True:
+        db = SessionLocal()
+        rows = db.query(Mailbox).filter(Mailbox.id.in_(mailbox_ids)).all()
+        db.close()
+        if all(r.status in statuses for r in rows) or time.time() > deadline:
+            return {r.id: r for r in rows}
+        time.sleep(0.1)
+
+
+class TestDeltaSync:
+    """Test delta (cutover) passes"""
+
+    def test_delta_pass(self, tmp_path, monkeypatch):
+        """Test that a delta pass re-syncs successful mailboxes with --maxage and tracks pass stats"""
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Mailbox, encrypt_password
+        install_fake_imapsync(tmp_path, monkeypatch)
+
+        job_id = client.post("/api/jobs", json={
+            "name": "Delta Job", "source_host": "a.com", "target_host": "b.com"
+        }).json()["id"]
+        db = SessionLocal()
+        synced = datetime.utcnow() - timedelta(days=3) + timedelta(hours=1)
+        mailboxes = [Mailbox(job_id=job_id, source_user=f"u{i}@a.com", source_pass=encrypt_password("x"),
+                             target_user=f"u{i}@b.com", target_pass=encrypt_password("y"), status="success",
+                             data_transferred=1000, messages_transferred=10, last_synced_at=synced)
+                     for i in range(2)]
+        mailboxes.append(Mailbox(job_id=job_id, source_user="bad@a.com", status="failed"))
+        db.add_all(mailboxes)
+        db.commit()
+        ids = [mb.id for mb in mailboxes[:2]]
+        db.close()
+
+        response = client.post(f"/api/jobs/{job_id}/delta-sync", json={})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["pass_number"] == 2
+        assert data["queued"] == 2
+        assert data["max_age_days"] == 4
+
+        rows = wait_for_mailboxes(ids)
+        for mailbox_id in ids:
+            assert rows[mailbox_id].status == "success"
+            # Delta passes add to the totals of earlier passes
+            assert rows[mailbox_id].data_transferred == 1000 + 4096
+            assert rows[mailbox_id].messages_transferred == 10 + 7
+            with open(f"logs/{mailbox_id}.log") as f:
+                assert "--maxage 4" in f.read()
+
+        passes = client.get(f"/api/jobs/{job_id}/passes").json()
+        assert [p["mode"] for p in passes] == ["full", "delta"]
+        assert passes[1]["completed"] == 2
+        assert passes[1]["data_transferred"] == 2 * 4096
+        assert passes[1]["finished_at"] is not None
+
+    def test_delta_runs_full_sync_without_completed_pass(self, tmp_path, monkeypatch):
+        """Test that a failed mailbox that never finished a full sync is not limited to --maxage"""
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Mailbox, encrypt_password
+        install_fake_imapsync(tmp_path, monkeypatch)
+
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com"}).json()["id"]
+        db = SessionLocal()
+        synced = Mailbox(job_id=job_id, source_user="ok@a.com", source_pass=encrypt_password("x"),
+                         target_user="ok@b.com", target_pass=encrypt_password("y"), status="success",
+                         last_synced_at=datetime.utcnow() - timedelta(days=2), size_bytes=10**6, size_messages=500)
+        never = Mailbox(job_id=job_id, source_user="new@a.com", source_pass=encrypt_password("x"),
+                        target_user="new@b.com", target_pass=encrypt_password("y"), status="failed")
+        db.add_all([synced, never])
+        db.commit()
+        ids = [synced.id, never.id]
+        db.close()
+
+        response = client.post(f"/api/jobs/{job_id}/delta-sync", json={"include_failed": True})
+        assert response.json()["queued"] == 2
+        rows = wait_for_mailboxes(ids)
+        assert rows[never.id].status == "success" and rows[never.id].last_synced_at is not None
+        # The delta run's scan leaves the full sync's size alone; the full sync records its own
+        assert (rows[synced.id].size_bytes, rows[synced.id].size_messages) == (10**6, 500)
+        assert (rows[never.id].size_bytes, rows[never.id].size_messages) == (8192, 10)
+        with open(f"logs/{synced.id}.log") as f:
+            log = f.read()
+            assert "--maxage" in log and "--nofoldersizes" in log
+        with open(f"logs/{never.id}.log") as f:
+            log = f.read()
+            # The first full sync runs imapsync's folder-size scan to record the mailbox size
+            assert "--maxage" not in log and "--nofoldersizes" not in log
+
+    def test_stop_before_spawn_is_not_lost(self, tmp_path, monkeypatch):
+        """Test that a stop arriving during the capability probe keeps imapsync from starting"""
+        from database import SessionLocal, Mailbox, encrypt_password
+        import capabilities
+        import control
+        import worker
+        install_fake_imapsync(tmp_path, monkeypatch)
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com"}).json()["id"]
+        db = SessionLocal()
+        mailbox = Mailbox(job_id=job_id, source_user="early@a.com", source_pass=encrypt_password("x"),
+                          target_user="early@b.com", target_pass=encrypt_password("y"), status="pending")
+        db.add(mailbox)
+        db.commit()
+        mailbox_id = mailbox.id
+        db.close()
+
+        acks = []
+
+        def probe(db, job, mailbox, source_pass, target_pass):
+            command = type("Command", (), {"command": "stop", "mailbox_id": mailbox_id, "message": "Stopped by user"})
+            acks.append(control._execute(command))
+            return {}
+        monkeypatch.setattr(capabilities, "job_capabilities", probe)
+        worker.run_imapsync(mailbox_id)
+
+        assert acks == ["signalled"]
+        rows = wait_for_mailboxes([mailbox_id])
+        assert (rows[mailbox_id].status, rows[mailbox_id].message) == ("failed", "Stopped by user")
+        if os.path.exists(f"logs/{mailbox_id}.log"):
+            with open(f"logs/{mailbox_id}.log") as f:
+                assert "Command line" not in f.read()
+        assert mailbox_id not in worker.starting and mailbox_id not in worker.stop_requests
+
+    def test_delta_requires_idle_job(self):
+        """Test that a delta pass is refused while mailboxes are still active"""
+        from database import SessionLocal, Mailbox
+        job_id = client.post("/api/jobs", json={
+            "name": "Busy Job", "source_host": "a.com", "target_host": "b.com"
+        }).json()["id"]
+        db = SessionLocal()
+        db.add(Mailbox(job_id=job_id, status="running"))
+        db.commit()
+        db.close()
+        assert client.post(f"/api/jobs/{job_id}/delta-sync", json={}).status_code == 400
+
+
+class TestReportExport:
+    """Test streamed per-job exports"""
+
+    def _job_with_mailboxes(self, count):
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Mailbox
+        job_id = client.post("/api/jobs", json={
+            "name": "Export Job", "source_host": "a.com", "target_host": "b.com"
+        }).json()["id"]
+        db = SessionLocal()
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        mailboxes = [Mailbox(job_id=job_id, source_user=f"u{i}@a.com", target_user=f"u{i}@b.com",
+                             status="success" if i % 2 else "failed", message=f"msg, {i}",
+                             data_transferred=i * 100, messages_transferred=i, attempts=1,
+                             started_at=start, finished_at=start + timedelta(seconds=90))
+                     for i in range(count)]
+        db.add_all(mailboxes)
+        db.commit()
+        ids = [mb.id for mb in mailboxes]
+        db.close()
+        return job_id, ids
+
+    def test_report_csv_and_jsonl(self, monkeypatch):
+        """Test that both report formats contain every mailbox across chunk boundaries"""
+        import csv
+        import io
+        import json
+        import reports
+        monkeypatch.setattr(reports, "CHUNK_ROWS", 3)
+        monkeypatch.setattr(reports, "FETCH_SIZE", 4)
+        job_id, ids = self._job_with_mailboxes(10)
+
+        response = client.get(f"/api/jobs/{job_id}/report.csv")
+        assert response.status_code == 200
+        assert "attachment" in response.headers["content-disposition"]
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [int(r["mailbox_id"]) for r in rows] == ids
+        assert rows[3]["message"] == "msg, 3"
+        assert rows[3]["duration_seconds"] == "90"
+
+        response = client.get(f"/api/jobs/{job_id}/report.jsonl")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert len(lines) == 10
+        assert lines[5]["data_transferred"] == 500 and lines[5]["status"] == "success"
+
+    def test_logs_zip(self):
+        """Test that the zip streams every existing mailbox log"""
+        import io
+        import zipfile
+        job_id, ids = self._job_with_mailboxes(3)
+        os.makedirs("logs", exist_ok=True)
+        for mailbox_id in ids[:2]:
+            with open(f"logs/{mailbox_id}.log", "w") as f:
+                f.write(f"log of {mailbox_id}\n" * 1000)
+
+        response = client.get(f"/api/jobs/{job_id}/logs.zip")
+        assert response.status_code == 200
+        archive = zipfile.ZipFile(io.BytesIO(response.content))
+        assert archive.testzip() is None
+        names = archive.namelist()
+        assert names == [f"{ids[0]}_u0@a.com.log", f"{ids[1]}_u1@a.com.log"]
+        assert archive.read(names[1]).decode().startswith(f"log of {ids[1]}")
+
+    def test_export_unknown_job(self):
+        """Test that exports of a missing job return 404"""
+        assert client.get("/api/jobs/nope/report.csv").status_code == 404
+        assert client.get("/api/jobs/nope/logs.zip").status_code == 404
+
+
+class TestArchive:
+    """Test per-job archive and background deletion"""
+
+    def _completed_job(self, statuses=("success", "success", "failed"), source_host="a.com"):
+        from database import SessionLocal, Mailbox, Job, encrypt_password
+        job_id = client.post("/api/jobs", json={
+            "name": "Archive Job", "source_host": source_host, "target_host": "b.com"
+        }).json()["id"]
+        db = SessionLocal()
+        mailboxes = [Mailbox(job_id=job_id, source_user=f"u{i}@a.com", source_pass=encrypt_password("x"),
+                             target_user=f"u{i}@b.com", status=status, data_transferred=100)
+                     for i, status in enumerate(statuses)]
+        db.add_all(mailboxes)
+        db.query(Job).filter(Job.id == job_id).update({Job.status: "completed", Job.total_mailboxes: len(statuses),
+                                                       Job.completed: 2, Job.failed: 1})
+        db.commit()
+        ids = [mb.id for mb in mailboxes]
+        db.close()
+        os.makedirs("logs", exist_ok=True)
+        for mailbox_id in ids:
+            with open(f"logs/{mailbox_id}.log", "w") as f:
+                f.write(f"log {mailbox_id}\n")
+        return job_id, ids
+
+    def _wait_for(self, predicate, timeout=10):
+        import time
+        deadline = time.time() + timeout
+        while not predicate() and time.time() < deadline:
+            time.sleep(0.05)
+        return predicate()
+
+    def test_archive_then_delete(self, monkeypatch):
+        """Test that archiving moves rows and logs out of the hot tables and delete removes the rest"""
+        import archive
+        from database import SessionLocal, Mailbox, ArchivedMailbox
+        from datetime import datetime
+        from database import LogEvent, ThroughputSample, JobThroughput
+        monkeypatch.setattr(archive, "BATCH_SIZE", 2)
+        job_id, ids = self._completed_job()
+        db = SessionLocal()
+        now = datetime.utcnow()
+        db.add_all([LogEvent(mailbox_id=i, job_id=job_id, kind="error", line="Err 1/3: timed out") for i in ids])
+        db.add_all([ThroughputSample(mailbox_id=i, ts=now, seconds=60, bytes=100, messages=1) for i in ids])
+        db.add(JobThroughput(job_id=job_id, minute=now, bytes=300, messages=3))
+        db.commit()
+        db.close()
+
+        assert client.post(f"/api/jobs/{job_id}/archive").status_code == 202
+        assert self._wait_for(lambda: client.get(f"/api/jobs/{job_id}").json()["status"] == "archived")
+
+        db = SessionLocal()
+        assert db.query(Mailbox).filter(Mailbox.job_id == job_id).count() == 0
+        assert db.query(ArchivedMailbox).filter(ArchivedMailbox.job_id == job_id).count() == 3
+        # The big hot tables are emptied along with the mailboxes
+        assert db.query(LogEvent).filter(LogEvent.mailbox_id.in_(ids)).count() == 0
+        assert db.query(ThroughputSample).filter(ThroughputSample.mailbox_id.in_(ids)).count() == 0
+        assert db.query(JobThroughput).filter(JobThroughput.job_id == job_id).count() == 0
+        db.close()
+        assert not any(os.path.exists(f"logs/{i}.log") for i in ids)
+
+        job = client.get(f"/api/jobs/{job_id}").json()
+        assert job["completed"] == 2 and job["failed"] == 1 and len(job["mailboxes"]) == 3
+        assert client.get(f"/api/mailboxes/{ids[1]}/logs").json()["logs"] == f"log {ids[1]}\n"
+        assert client.get(f"/api/jobs/{job_id}/report.csv").text.count("\n") == 4
+        assert client.post(f"/api/jobs/{job_id}/archive").status_code == 409
+
+        assert client.delete(f"/api/jobs/{job_id}").status_code == 202
+        assert self._wait_for(lambda: client.get(f"/api/jobs/{job_id}").status_code == 404)
+        assert not os.path.exists(archive.archive_path(job_id))
+        db = SessionLocal()
+        assert db.query(ArchivedMailbox).filter(ArchivedMailbox.job_id == job_id).count() == 0
+        db.close()
+
+    def test_delete_keeps_uid_cache_shared_with_another_job(self, tmp_path, monkeypatch):
+        """Test that deleting a job keeps the UID caches a newer job for the same pairs still uses"""
+        import archive
+        from database import SessionLocal, Job
+        import uid_cache
+        from uid_cache import UidCacheManager
+        caches = UidCacheManager(root=str(tmp_path / "cache"))
+        monkeypatch.setattr(uid_cache, "uid_caches", caches)
+        old_job, _ = self._completed_job(source_host="shared-cache.example")
+        # Same hosts, same u0 pair
+        self._completed_job(statuses=("success",), source_host="shared-cache.example")
+        db = SessionLocal()
+        job = db.query(Job).filter(Job.id == old_job).first()
+        paths = {}
+        for i in range(3):
+            pair = type("Pair", (), {"source_user": f"u{i}@a.com", "target_user": f"u{i}@b.com"})
+            path, _ = caches.acquire(job, pair)
+            caches.release(path)
+            paths[i] = path
+        db.close()
+
+        archive.delete_job(old_job)
+        assert os.path.isdir(paths[0])
+        assert not os.path.exists(paths[1]) and not os.path.exists(paths[2])
+
+    def test_delete_waits_for_running_syncs(self, monkeypatch):
+        """Test that deleting a job leaves a still-running sync's row until its final write, then sweeps late samples"""
+        import threading
+        import time
+        from datetime import datetime
+        import archive
+        from database import SessionLocal, Mailbox, Job, ThroughputSample
+        monkeypatch.setattr(archive, "DELETE_POLL_SECONDS", 0.05)
+        job_id, ids = self._completed_job(statuses=("running", "success"))
+        db = SessionLocal()
+        db.query(Mailbox).filter(Mailbox.id == ids[0]).update({Mailbox.heartbeat_at: datetime.utcnow()})
+        db.query(Job).filter(Job.id == job_id).update({Job.status: "deleting"})
+        db.commit()
+
+        deleter = threading.Thread(target=archive.delete_job, args=(job_id,))
+        deleter.start()
+        assert self._wait_for(lambda: client.get(f"/api/mailboxes/{ids[1]}/logs").status_code == 404)
+        time.sleep(0.2)
+        assert deleter.is_alive()
+        assert db.query(Mailbox.id).filter(Mailbox.job_id == job_id).all() == [(ids[0],)]
+
+        # The stopped sync's final write, and a sample its recorder flushes afterwards
+        db.query(Mailbox).filter(Mailbox.id == ids[0]).update({Mailbox.status: "failed", Mailbox.message: "Job deleted"})
+        db.commit()
+        deleter.join(timeout=10)
+        assert not deleter.is_alive()
+        assert db.query(Mailbox).filter(Mailbox.job_id == job_id).count() == 0
+        db.add(ThroughputSample(mailbox_id=ids[0], ts=datetime.utcnow(), seconds=5, bytes=1, messages=1))
+        db.commit()
+        archive.run_maintenance()
+        assert db.query(ThroughputSample).filter(ThroughputSample.mailbox_id == ids[0]).count() == 0
+        db.close()
+
+    def test_busy_job_refused(self):
+        """Test that a job with running mailboxes can't be archived or deleted"""
+        job_id, _ = self._completed_job(statuses=("running", "success"))
+        assert client.post(f"/api/jobs/{job_id}/archive").status_code == 409
+        assert client.delete(f"/api/jobs/{job_id}").status_code == 409
+
+    def test_retention_archives_old_jobs(self, monkeypatch):
+        """Test that the maintenance pass archives completed jobs past the retention age"""
+        from datetime import datetime, timedelta
+        import archive
+        from database import SessionLocal, Job
+        from database import Mailbox
+        job_id, ids = self._completed_job()
+        # Created 90 days ago, but the migration only finished yesterday: kept
+        long_job_id, long_ids = self._completed_job()
+        db = SessionLocal()
+        now = datetime.utcnow()
+        db.query(Job).filter(Job.id.in_([job_id, long_job_id])).update(
+            {Job.created_at: now - timedelta(days=90)}, synchronize_session=False)
+        db.query(Mailbox).filter(Mailbox.id.in_(ids)).update(
+            {Mailbox.finished_at: now - timedelta(days=60)}, synchronize_session=False)
+        db.query(Mailbox).filter(Mailbox.id.in_(long_ids)).update(
+            {Mailbox.finished_at: now - timedelta(days=60)}, synchronize_session=False)
+        db.query(Mailbox).filter(Mailbox.id == long_ids[0]).update(
+            {Mailbox.finished_at: now - timedelta(days=1)}, synchronize_session=False)
+        db.commit()
+        db.close()
+
+        monkeypatch.setattr(archive, "ARCHIVE_AFTER_DAYS", 30)
+        result = archive.run_maintenance()
+        assert result["archived"] >= 1
+        assert client.get(f"/api/jobs/{job_id}").json()["status"] == "archived"
+        assert client.get(f"/api/jobs/{long_job_id}").json()["status"] == "completed"
+
+
+class TestOutputPipe:
+    """Test the imapsync output pipeline"""
+
+    def test_parser_across_chunk_boundaries(self):
+        """Test that summary lines split over several reads are still parsed"""
+        from output_pipe import SummaryParser
+        output = (b"Host1: some noise\n" * 50 + b"Messages transferred                    : 7 \n"
+                  b"Messages skipped                        : 3\n"
+                  b"Total bytes transferred                 : 4096 (4.000 KiB)")
+        parser = SummaryParser()
+        for i in range(0, len(output), 7):
+            parser.feed(output[i:i + 7])
+        parser.finish()
+        assert (parser.total_bytes, parser.messages_transferred, parser.messages_skipped) == (4096, 7, 3)
+
+    def test_pump_writes_log_and_counts(self, tmp_path):
+        """Test that pumped output lands in the log file by the time the sink is closed"""
+        import io
+        from output_pipe import LogWriter, SummaryParser, pump, pipe_metrics
+        writer = LogWriter(max_chunks=2)
+        sink = writer.open(str(tmp_path / "out.log"))
+        data = b"x" * 100 + b"\nTotal bytes transferred : 55\n" + b"y" * 1000
+        before = pipe_metrics.snapshot()["reads"]
+        parser = SummaryParser()
+        pump(io.BytesIO(data), sink, parser, chunk_size=16)
+        sink.close()
+        assert (tmp_path / "out.log").read_bytes() == data
+        assert parser.total_bytes == 55
+        assert pipe_metrics.snapshot()["reads"] - before >= -(-len(data) // 16)
+        assert "pipes" in client.get("/api/health").json()
+
+
+class TestFairScheduler:
+    """Test fair-share scheduling of mailboxes across jobs"""
+
+    def _run(self, submissions, workers=1):
+        import threading
+        from scheduler import FairScheduler
+        order, gate = [], threading.Event()
+        scheduler = FairScheduler(lambda mailbox_id: (gate.wait(5), order.append(mailbox_id)), workers=workers)
+        # Hold the workers until everything is queued so the dispatch order is deterministic
+        scheduler.submit("blocker", ["blocker"] * workers)
+        for job_id, ids, priority, max_concurrency in submissions:
+            scheduler.submit(job_id, ids, priority=priority, max_concurrency=max_concurrency)
+        return scheduler, order, gate
+
+    def _wait_idle(self, scheduler):
+        import time
+        deadline = time.time() + 5
+        while scheduler.snapshot() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_urgent_job_is_not_queued_behind_batch(self):
+        """Test that a small high-priority job gets slots before a large backlog drains"""
+        scheduler, order, gate = self._run([
+            ("batch", [f"b{i}" for i in range(50)], 1, None),
+            ("urgent", ["u0", "u1", "u2"], 10, None),
+        ])
+        gate.set()
+        self._wait_idle(scheduler)
+        assert len(order) == 54
+        assert order.index("u2") < 5
+        # The batch job still progresses while the urgent one is queued
+        assert order.index("b0") < 5
+
+    def test_max_concurrency_is_respected(self):
+        """Test that a job never runs more mailboxes at once than its cap"""
+        import threading
+        import time
+        from scheduler import FairScheduler
+        lock, running, peak = threading.Lock(), [0], [0]
+
+        def run(mailbox_id):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        scheduler = FairScheduler(run, workers=4)
+        scheduler.submit("capped", list(range(12)), priority=5, max_concurrency=2)
+        self._wait_idle(scheduler)
+        assert peak[0] == 2
+
+    def test_job_priority_validation(self):
+        """Test that priority and max_concurrency are stored and validated"""
+        payload = {"source_host": "a.example.com", "target_host": "b.example.com"}
+        assert client.post("/api/jobs", json={**payload, "priority": 11}).status_code == 422
+        assert client.post("/api/jobs", json={**payload, "max_concurrency": 0}).status_code == 422
+        job_id = client.post("/api/jobs", json={**payload, "priority": 10, "options": {"concurrency": 3}}).json()["id"]
+        data = client.get(f"/api/jobs/{job_id}").json()
+        assert (data["priority"], data["max_concurrency"]) == (10, 3)
+
+
+class TestRunWindows:
+    """Test scheduled starts and recurring run windows"""
+
+    def test_jobs_without_windows_store_sql_null(self):
+        """Test that a job without windows has SQL NULL (not JSON 'null'), and migrate converts old rows"""
+        from sqlalchemy import text
+        from database import engine
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com"}).json()["id"]
+        with engine.begin() as conn:
+            assert conn.execute(text("SELECT run_windows IS NULL FROM jobs WHERE id = :id"), {"id": job_id}).scalar()
+            conn.execute(text("UPDATE jobs SET run_windows = 'null' WHERE id = :id"), {"id": job_id})
+        migrate()
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT run_windows IS NULL FROM jobs WHERE id = :id"), {"id": job_id}).scalar()
+
+    def test_window_contains(self):
+        """Test overnight windows, weekdays and timezones"""
+        from datetime import datetime
+        from run_windows import RunWindows
+        nightly = RunWindows(timezone="Asia/Ho_Chi_Minh",
+                             windows=[{"days": [0, 1, 2, 3, 4], "start": "22:00", "end": "06:00"}])
+        # 2024-01-05 is a Friday; UTC+7
+        assert nightly.is_open(datetime(2024, 1, 5, 16, 0))        # Fri 23:00 local
+        assert nightly.is_open(datetime(2024, 1, 5, 22, 0))        # Sat 05:00 local, Friday's window
+        assert not nightly.is_open(datetime(2024, 1, 6, 16, 0))    # Sat 23:00 local
+        assert not nightly.is_open(datetime(2024, 1, 5, 3, 0))     # Fri 10:00 local
+
+    def test_scheduled_job_waits_then_starts(self):
+        """Test that a job with a future start is parked and started by the window loop"""
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Mailbox
+        import run_windows
+        start = datetime.utcnow() + timedelta(hours=2)
+        job_id = client.post("/api/jobs", json={
+            "source_host": "a.com", "target_host": "b.com", "scheduled_start": start.isoformat() + "Z"
+        }).json()["id"]
+        assert client.get(f"/api/jobs/{job_id}").json()["status"] == "scheduled"
+        # Inserted directly so no worker has it queued already
+        db = SessionLocal()
+        mb = Mailbox(job_id=job_id, status="pending")
+        db.add(mb)
+        db.commit()
+        mailbox_id = mb.id
+        db.close()
+
+        queued = []
+        started, _, _ = run_windows.check_windows(queued.extend, now=start + timedelta(minutes=1))
+        assert job_id in started and mailbox_id in queued
+        assert client.get(f"/api/jobs/{job_id}").json()["status"] == "running"
+
+    def test_window_close_checkpoints_running_syncs(self):
+        """Test that closing a window parks the job and checkpoints its local syncs"""
+        from datetime import datetime
+        from database import SessionLocal, Job, Mailbox
+        import run_windows
+        import worker
+        windows = {"timezone": "UTC", "windows": [{"start": "00:00", "end": "00:01"}]}
+        job_id = client.post("/api/jobs", json={
+            "source_host": "a.com", "target_host": "b.com", "run_windows": windows
+        }).json()["id"]
+        db = SessionLocal()
+        mb = Mailbox(job_id=job_id, status="running")
+        db.add(mb)
+        db.commit()
+
+        class FakeProcess:
+            terminated = False
+
+            def terminate(self):
+                self.terminated = True
+
+        process = FakeProcess()
+        worker.active_processes[mb.id] = process
+        try:
+            # Force the job into its window, then let the loop close it
+            db.query(Job).filter(Job.id == job_id).update({Job.status: "running"})
+            db.commit()
+            _, parked, checkpointed = run_windows.check_windows(lambda ids: None, now=datetime(2024, 1, 1, 12, 0))
+            assert job_id in parked and mb.id in checkpointed
+            assert process.terminated and worker.checkpoint_requests[mb.id] == run_windows.WINDOW_CLOSED_MESSAGE
+            assert worker.claim_mailbox(db, mb.id) is False
+        finally:
+            worker.active_processes.pop(mb.id, None)
+            worker.checkpoint_requests.pop(mb.id, None)
+            db.close()
+
+    def test_invalid_schedule_rejected(self):
+        """Test that unknown timezones and weekdays are rejected"""
+        payload = {"source_host": "a.com", "target_host": "b.com"}
+        bad_tz = {"timezone": "Mars/Olympus", "windows": [{"start": "22:00", "end": "06:00"}]}
+        bad_day = {"windows": [{"days": [7], "start": "22:00", "end": "06:00"}]}
+        assert client.post("/api/jobs", json={**payload, "run_windows": bad_tz}).status_code == 422
+        assert client.post("/api/jobs", json={**payload, "run_windows": bad_day}).status_code == 422
+
+
+class TestControlChannel:
+    """Test stop/cancel/checkpoint commands delivered to the owning worker"""
+
+    class FakeProcess:
+        terminated = False
+
+        def terminate(self):
+            self.terminated = True
+
+    def _running_mailbox(self, host, pid):
+        from datetime import datetime
+        from database import SessionLocal, Mailbox
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com"}).json()["id"]
+        db = SessionLocal()
+        mb = Mailbox(job_id=job_id, status="running", worker_host=host, owner_pid=pid, heartbeat_at=datetime.utcnow())
+        db.add(mb)
+        db.commit()
+        mailbox_id = mb.id
+        db.close()
+        return job_id, mailbox_id
+
+    def test_stop_reaches_remote_owner(self, monkeypatch):
+        """Test that a stop for a sync owned elsewhere is queued, then handled and acked by its owner"""
+        import control
+        import worker
+        _, mailbox_id = self._running_mailbox("other-node", 4242)
+
+        # Answered at once, without waiting for the remote ack
+        response = client.post(f"/api/mailboxes/{mailbox_id}/stop")
+        assert response.status_code == 202
+        data = response.json()
+        assert data["unacknowledged"] == 1 and data["signalled"] == 0
+        [command_id] = data["command_ids"]
+
+        # The owning process picks it up on its next poll
+        process = self.FakeProcess()
+        monkeypatch.setattr(control, "_identity", lambda: ("other-node", 4242))
+        monkeypatch.setitem(worker.active_processes, mailbox_id, process)
+        try:
+            assert control.poll_once() == 1
+            assert process.terminated and worker.stop_requests[mailbox_id] == "Stopped by user"
+        finally:
+            worker.stop_requests.pop(mailbox_id, None)
+        command = client.get(f"/api/commands/{command_id}").json()
+        assert command["result"] == "signalled" and command["acked_by"] == "other-node:4242"
+
+    def test_local_commands_are_handled_inline(self, monkeypatch):
+        """Test that pause with checkpoint signals this process's own syncs without waiting for a poll"""
+        import worker
+        job_id, mailbox_id = self._running_mailbox(worker.WORKER_HOST, os.getpid())
+        process = self.FakeProcess()
+        monkeypatch.setitem(worker.active_processes, mailbox_id, process)
+        try:
+            data = client.post(f"/api/jobs/{job_id}/pause", params={"checkpoint": True}).json()
+            assert data["checkpointed"] == 1 and data["unacknowledged"] == 0
+            assert process.terminated and mailbox_id in worker.checkpoint_requests
+        finally:
+            worker.checkpoint_requests.pop(mailbox_id, None)
+
+
+class TestStatusWriter:
+    """Test write-behind coalescing of worker status updates"""
+
+    def _job_with_mailboxes(self, count):
+        from database import SessionLocal, Job, Mailbox
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com"}).json()["id"]
+        db = SessionLocal()
+        mailboxes = [Mailbox(job_id=job_id, status="running", message="Starting imapsync...") for _ in range(count)]
+        db.add_all(mailboxes)
+        db.query(Job).filter(Job.id == job_id).update({Job.total_mailboxes: count})
+        db.commit()
+        ids = [mb.id for mb in mailboxes]
+        db.close()
+        return job_id, ids
+
+    def test_updates_are_merged_into_one_batch(self):
+        """Test that repeated updates of a row are merged and written in one flush"""
+        from database import SessionLocal, Mailbox
+        from status_writer import StatusWriter
+        _, (first, second, untouched) = self._job_with_mailboxes(3)
+        writer = StatusWriter(flush_seconds=3600)
+        writer.update(first, message="copying INBOX")
+        writer.update(first, message="copying Sent", worker_pid=11)
+        writer.update(second, worker_pid=22)
+        writer.flush()
+        assert (writer.flushes, writer.rows_written, writer.updates_merged) == (1, 2, 1)
+
+        db = SessionLocal()
+        rows = {mb.id: mb for mb in db.query(Mailbox).filter(Mailbox.id.in_([first, second, untouched]))}
+        assert (rows[first].message, rows[first].worker_pid) == ("copying Sent", 11)
+        assert (rows[second].message, rows[second].worker_pid) == ("Starting imapsync...", 22)
+        assert rows[untouched].worker_pid is None
+        db.close()
+
+    def test_finish_is_durable_and_recounts_job(self):
+        """Test that final states are committed before finish() returns, with the job counters"""
+        from datetime import datetime
+        from database import SessionLocal, Job
+        from status_writer import StatusWriter
+        job_id, (ok, bad) = self._job_with_mailboxes(2)
+        writer = StatusWriter(flush_seconds=3600)
+        assert writer.finish(ok, job_id, {"status": "success", "data_transferred": 4096,
+                                          "finished_at": datetime.utcnow()}, timeout=5)
+        assert writer.finish(bad, job_id, {"status": "failed", "message": "Exited with code 1. Check logs."}, timeout=5)
+
+        db = SessionLocal()
+        job = db.query(Job).filter(Job.id == job_id).first()
+        assert (job.completed, job.failed, job.data_transferred, job.status) == (1, 1, 4096, "completed")
+        db.close()
+
+    def test_finish_keeps_deleting_and_cancelled_status(self):
+        """Test that the recount only completes running/pending jobs"""
+        from database import SessionLocal, Job
+        from status_writer import StatusWriter
+        writer = StatusWriter(flush_seconds=3600)
+        for status in ("deleting", "failed", "paused"):
+            job_id, (mailbox_id,) = self._job_with_mailboxes(1)
+            db = SessionLocal()
+            db.query(Job).filter(Job.id == job_id).update({Job.status: status})
+            db.commit()
+            assert writer.finish(mailbox_id, job_id, {"status": "failed", "message": "Cancelled by user"}, timeout=5)
+            db.expire_all()
+            job = db.query(Job).filter(Job.id == job_id).first()
+            assert (job.failed, job.status) == (1, status)
+            db.close()
+
+
+class TestAdmission:
+    """Test memory- and load-aware admission of new imapsync processes"""
+
+    def _proc(self, tmp_path, available_mb, load, children_mb):
+        (tmp_path / "meminfo").write_text(
+            f"MemTotal:       {8192 * 1024} kB\nMemFree:        1024 kB\nMemAvailable:   {available_mb * 1024} kB\n")
+        (tmp_path / "loadavg").write_text(f"{load} 0.50 0.40 2/300 12345\n")
+        for pid, rss in enumerate(children_mb, start=100):
+            (tmp_path / str(pid)).mkdir()
+            (tmp_path / str(pid) / "status").write_text(f"Name:\tperl\nVmRSS:\t  {rss * 1024} kB\n")
+        return str(tmp_path), lambda: list(range(100, 100 + len(children_mb)))
+
+    def test_headroom_sets_effective_limit(self, tmp_path):
+        """Test that free memory, measured per-child RSS and bounds decide how many may start"""
+        from admission import AdmissionController
+        proc, pids = self._proc(tmp_path, available_mb=1800, load=0.1, children_mb=[400, 400])
+        controller = AdmissionController(max_workers=8, min_workers=1, proc=proc, child_pids=pids,
+                                         cgroup=str(tmp_path / "no-cgroup"))
+        # (1800 - 512 reserve) // 400 per child = 3 more
+        assert [controller.admit(2 + i) for i in range(4)] == [True, True, True, False]
+        assert controller.snapshot()["effective_limit"] == 5
+        assert controller.snapshot()["expected_child_mb"] == 400
+
+    def test_no_headroom_or_overload_blocks_above_minimum(self, tmp_path):
+        """Test that low memory or high load stop new starts, but never below MIN_WORKERS"""
+        from admission import AdmissionController
+        proc, pids = self._proc(tmp_path, available_mb=600, load=64.0, children_mb=[300])
+        controller = AdmissionController(max_workers=8, min_workers=2, proc=proc, child_pids=pids,
+                                         cgroup=str(tmp_path / "no-cgroup"))
+        assert controller.admit(1) is True
+        assert controller.admit(2) is False
+        assert controller.snapshot()["overloaded"] is True
+
+    def test_cgroup_limit_caps_headroom(self, tmp_path):
+        """Test that a container's cgroup memory limit wins over the host's MemAvailable"""
+        from admission import AdmissionController, read_cgroup_available_mb
+        proc, pids = self._proc(tmp_path, available_mb=6000, load=0.1, children_mb=[400])
+        mb = 1024 * 1024
+        v2 = tmp_path / "cgroup-v2"
+        v2.mkdir()
+        (v2 / "memory.max").write_text(f"{2000 * mb}\n")
+        (v2 / "memory.current").write_text(f"{800 * mb}\n")
+        controller = AdmissionController(max_workers=16, min_workers=1, proc=proc, child_pids=pids, cgroup=str(v2))
+        assert controller.admit(1) is True
+        # (2000 - 800 - 512 reserve) // 400 per child = 1 more, not (6000 - 512) // 400
+        assert controller.snapshot()["effective_limit"] == 2
+        assert controller.snapshot()["mem_available_mb"] == 1200
+        (v2 / "memory.max").write_text("max\n")
+        assert read_cgroup_available_mb(str(v2)) is None
+        v1 = tmp_path / "cgroup-v1" / "memory"
+        v1.mkdir(parents=True)
+        (v1 / "memory.limit_in_bytes").write_text(f"{1024 * mb}\n")
+        (v1 / "memory.usage_in_bytes").write_text(f"{24 * mb}\n")
+        assert read_cgroup_available_mb(str(tmp_path / "cgroup-v1")) == 1000
+
+    def test_cgroup_page_cache_is_reclaimable(self, tmp_path):
+        """Test that inactive page cache counted in cgroup usage doesn't eat the headroom"""
+        from admission import read_cgroup_available_mb
+        mb = 1024 * 1024
+        v2 = tmp_path / "v2"
+        v2.mkdir()
+        (v2 / "memory.max").write_text(f"{2000 * mb}\n")
+        (v2 / "memory.current").write_text(f"{1950 * mb}\n")
+        (v2 / "memory.stat").write_text(f"anon {450 * mb}\nfile {1500 * mb}\nactive_file {300 * mb}\n"
+                                        f"inactive_file {1200 * mb}\n")
+        assert read_cgroup_available_mb(str(v2)) == 1250
+        v1 = tmp_path / "v1" / "memory"
+        v1.mkdir(parents=True)
+        (v1 / "memory.limit_in_bytes").write_text(f"{1024 * mb}\n")
+        (v1 / "memory.usage_in_bytes").write_text(f"{1000 * mb}\n")
+        (v1 / "memory.stat").write_text(f"cache {700 * mb}\ninactive_file {1 * mb}\n"
+                                        f"total_inactive_file {600 * mb}\n")
+        assert read_cgroup_available_mb(str(tmp_path / "v1")) == 624
+
+    def test_scheduler_waits_for_admission(self):
+        """Test that the scheduler holds work back while admission refuses it"""
+        import threading
+        import time
+        from scheduler import FairScheduler
+        allowed, ran = threading.Event(), []
+        scheduler = FairScheduler(ran.append, workers=2, admit=lambda running: allowed.is_set())
+        scheduler.submit("job", [1, 2])
+        time.sleep(0.2)
+        assert ran == []
+        allowed.set()
+        deadline = time.time() + 5
+        while len(ran) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert sorted(ran) == [1, 2]
+
+
+class TestThroughput:
+    """Test per-mailbox throughput samples, downsampling and the job rollup"""
+
+    def test_parser_counts_copied_messages(self):
+        """Test that per-message "copied to" lines feed the running counters, across chunk borders"""
+        from output_pipe import SummaryParser
+        parser = SummaryParser()
+        parser.feed(b"msg INBOX/1 {1000}   copied to INBOX/7   1.2 msgs/s\nmsg INBOX/2 {25")
+        assert (parser.copied_messages, parser.copied_bytes) == (1, 1000)
+        parser.feed(b"00} copied to INBOX/8\nFolder Sent\n")
+        parser.feed(b"msg Sent/3 {500} copied to Sent/1")
+        parser.finish()
+        assert (parser.copied_messages, parser.copied_bytes) == (3, 4000)
+
+    def test_samples_downsample_and_roll_up(self):
+        """Test 5s samples while running, 1min samples after the run, and per-minute job totals"""
+        from datetime import datetime
+        from database import SessionLocal, Mailbox
+        from output_pipe import SummaryParser
+        from throughput import ThroughputRecorder, recorder
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com"}).json()["id"]
+        db = SessionLocal()
+        mailbox = Mailbox(job_id=job_id, status="running")
+        db.add(mailbox)
+        db.commit()
+        mailbox_id = mailbox.id
+        db.close()
+
+        rec = ThroughputRecorder(sample_seconds=5, flush_seconds=3600)
+        parser = SummaryParser()
+        rec.track(mailbox_id, job_id, parser)
+        for second, copied in ((2, 5000), (7, 5000), (12, 0), (17, 2500)):
+            parser.copied_bytes += copied
+            parser.copied_messages += copied // 2500
+            rec.sample(datetime(2026, 1, 1, 10, 0, second))
+        rec.flush()
+
+        data = client.get(f"/api/mailboxes/{mailbox_id}/throughput").json()
+        # The idle interval is not stored
+        assert [(p["t"], p["seconds"], p["bytes_per_sec"]) for p in data["samples"]] == [
+            ("2026-01-01T10:00:00", 5, 1000.0), ("2026-01-01T10:00:05", 5, 1000.0),
+            ("2026-01-01T10:00:15", 5, 500.0)]
+        assert data["peak_bytes_per_sec"] == 1000.0
+
+        rec.untrack(mailbox_id)
+        rec.flush()
+        data = client.get(f"/api/mailboxes/{mailbox_id}/throughput").json()
+        assert [(p["t"], p["seconds"], p["bytes"], p["messages"]) for p in data["samples"]] == [
+            ("2026-01-01T10:00:00", 60, 12500, 5)]
+
+        job = client.get(f"/api/jobs/{job_id}/throughput").json()
+        assert [(p["t"], p["bytes"], p["messages"]) for p in job["samples"]] == [("2026-01-01T10:00:00", 12500, 5)]
+        assert recorder.snapshot()["tracked"] == 0
+
+    def test_unknown_mailbox_is_404(self):
+        """Test that throughput of a missing mailbox is a 404"""
+        assert client.get("/api/mailboxes/999999999/throughput").status_code == 404
+
+
+class TestIdempotentUpload:
+    """Test that re-uploading a CSV updates mailboxes instead of duplicating them"""
+
+    def _upload(self, job_id, text, **params):
+        return client.post(f"/api/upload/{job_id}", params=params,
+                           files={"file": ("m.csv", text.encode(), "text/csv")}).json()
+
+    def test_csv_duplicates_collapse(self):
+        """Test that repeated pairs in one CSV are collapsed, the last row winning"""
+        import ingest
+        rows, duplicates, invalid = ingest.parse_csv("a@x,p1,a@y,q1\nb@x,p2,b@y,q2\na@x,p3,a@y,q3\nshort,row\n")
+        assert rows == {("a@x", "a@y"): ("p3", "q3"), ("b@x", "b@y"): ("p2", "q2")}
+        assert (duplicates, invalid) == (1, 1)
+
+    def test_reupload_is_idempotent(self):
+        """Test that a corrected CSV only adds new pairs, updates credentials and skips successful ones"""
+        from database import SessionLocal, Mailbox, Job, decrypt_password
+        # Scheduled far ahead, so nothing is handed to the workers during the test
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com",
+                                                "scheduled_start": "2099-01-01T00:00:00Z"}).json()["id"]
+        first = self._upload(job_id, "ok@x,p,ok@y,p\nbad@x,wrong,bad@y,p\nbad@x,wrong,bad@y,p\n")
+        assert (first["added"], first["duplicates"]) == (2, 1)
+
+        db = SessionLocal()
+        db.query(Mailbox).filter(Mailbox.job_id == job_id, Mailbox.source_user == "ok@x").update({Mailbox.status: "success"})
+        db.query(Mailbox).filter(Mailbox.job_id == job_id, Mailbox.source_user == "bad@x").update({Mailbox.status: "failed"})
+        db.commit()
+
+        second = self._upload(job_id, "ok@x,p,ok@y,p\nbad@x,right,bad@y,p\nnew@x,p,new@y,p\n")
+        assert (second["added"], second["updated_credentials"], second["requeued"], second["skipped_successful"]) == \
+            (1, 1, 1, 1)
+        rows = {mb.source_user: mb for mb in db.query(Mailbox).filter(Mailbox.job_id == job_id)}
+        assert len(rows) == 3
+        assert decrypt_password(rows["bad@x"].source_pass) == "right"
+        assert (rows["ok@x"].status, rows["bad@x"].status) == ("success", "pending")
+        assert db.query(Job).filter(Job.id == job_id).first().total_mailboxes == 3
+
+        forced = self._upload(job_id, "ok@x,p,ok@y,p\n", force="true")
+        assert (forced["added"], forced["requeued"]) == (0, 1)
+        db.expire_all()
+        assert db.query(Mailbox.status).filter(Mailbox.job_id == job_id, Mailbox.source_user == "ok@x").scalar() == "pending"
+        db.close()
+
+    def test_single_mailbox_uses_ingest(self):
+        """Test that adding one mailbox twice keeps one row, and the database refuses a duplicate pair"""
+        import pytest
+        from sqlalchemy import insert
+        from sqlalchemy.exc import IntegrityError
+        from database import SessionLocal, Mailbox, Job
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com",
+                                                "scheduled_start": "2099-01-01T00:00:00Z"}).json()["id"]
+        mailbox = {"source_user": "one@x", "source_pass": "p", "target_user": "one@y", "target_pass": "p"}
+        first = client.post(f"/api/jobs/{job_id}/mailboxes", json=mailbox).json()
+        second = client.post(f"/api/jobs/{job_id}/mailboxes", json=dict(mailbox, source_pass="new")).json()
+        assert (first["added"], second["added"], second["updated_credentials"]) == (1, 0, 1)
+        assert first["mailbox_id"] == second["mailbox_id"]
+
+        db = SessionLocal()
+        assert db.query(Mailbox).filter(Mailbox.job_id == job_id).count() == 1
+        assert db.query(Job.total_mailboxes).filter(Job.id == job_id).scalar() == 1
+        # The count moves with the inserts, in ingest's own transaction
+        import ingest
+        ingest.ingest(db, job_id, {("two@x", "two@y"): ("p", "p"), ("one@x", "one@y"): ("p", "p")})
+        db.expire_all()
+        assert db.query(Job.total_mailboxes).filter(Job.id == job_id).scalar() == 2
+        with pytest.raises(IntegrityError):
+            db.execute(insert(Mailbox), [{"job_id": job_id, "source_user": "one@x", "source_pass": "p",
+                                          "target_user": "one@y", "target_pass": "p"}])
+            db.commit()
+        db.rollback()
+        db.close()
+
+
+class TestQueryCounts:
+    """Test that dashboard endpoints issue a constant number of queries as data grows (see bench_load.py)"""
+
+    def _queries(self, counter, http, label, url):
+        before = counter.counts.get(label, 0)
+        assert http.get(url, headers={"x-bench-label": label}).status_code == 200
+        return counter.counts.get(label, 0) - before
+
+    def test_queries_do_not_grow_with_mailboxes(self):
+        """Test get_job, list_jobs and stats against a small and a 50x larger seeded job"""
+        from fastapi.testclient import TestClient
+        from bench_load import QueryCounter, labelled
+        from seed_data import seed
+        from main import app
+        small, = seed(1, 6, log_fraction=0, random_seed=3)
+        large, = seed(1, 300, log_fraction=0, random_seed=3)
+        counter, http = QueryCounter(), TestClient(labelled(app))
+        counter.install()
+        try:
+            assert self._queries(counter, http, "small", f"/api/jobs/{small}") == \
+                self._queries(counter, http, "large", f"/api/jobs/{large}")
+            assert len(http.get(f"/api/jobs/{large}").json()["mailboxes"]) == 300
+            before = [self._queries(counter, http, "list", "/api/jobs?limit=50"),
+                      self._queries(counter, http, "stats", "/api/stats")]
+            seed(3, 100, log_fraction=0, random_seed=4)
+            assert [self._queries(counter, http, "list", "/api/jobs?limit=50"),
+                    self._queries(counter, http, "stats", "/api/stats")] == before
+        finally:
+            counter.remove()
+
+
+class TestEstimator:
+    """Test throughput learning and ETA prediction"""
+
+    def test_fit_separates_overhead_and_rate(self):
+        """Test that the fit recovers the per-session overhead and transfer rate"""
+        from estimator import fit
+        rates = fit([(5 + n, n * 100_000, n * 10) for n in range(1, 6)])
+        assert (rates["bytes_per_sec"], rates["overhead_seconds"], rates["runs"]) == (100_000, 5, 5)
+
+    def test_job_estimate_uses_own_runs_and_slots(self):
+        """Test that finished runs and scanned sizes predict the remaining work over the job's slots"""
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Mailbox
+        job_id = client.post("/api/jobs", json={"source_host": "est-src.example", "target_host": "est-dst.example",
+                                                "max_concurrency": 2,
+                                                "scheduled_start": "2099-01-01T00:00:00Z"}).json()["id"]
+        db = SessionLocal()
+        start = datetime(2026, 1, 1)
+        db.add_all([Mailbox(job_id=job_id, status="success", started_at=start,
+                            finished_at=start + timedelta(seconds=5 + n), data_transferred=n * 100_000)
+                    for n in range(1, 6)])
+        db.add_all([Mailbox(job_id=job_id, status="pending", size_bytes=1_000_000) for _ in range(3)])
+        db.add(Mailbox(job_id=job_id, status="pending"))  # Not scanned: the scanned average applies
+        db.commit()
+        db.close()
+
+        estimate = client.get(f"/api/jobs/{job_id}/estimate").json()
+        assert estimate["rates"]["source"] == "job"
+        assert estimate["concurrency"] == 2
+        # Each pending mailbox takes 5 + 10 s; four of them on two slots, after the scheduled start
+        starts_in = (datetime(2099, 1, 1) - datetime.utcnow()).total_seconds()
+        assert abs(estimate["remaining_seconds"] - (starts_in + 30)) < 5
+        assert [round(mb["eta_seconds"] - starts_in) for mb in estimate["mailboxes"]] == [15, 15, 30, 30]
+
+    def test_copied_bytes_count_the_current_run_only(self):
+        """Test that samples kept from an earlier (failed) run don't count as copied by the running one"""
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Mailbox, ThroughputSample
+        from estimator import _copied_bytes
+        db = SessionLocal()
+        mailbox = Mailbox(job_id="copied-job", status="running", size_bytes=1_000_000)
+        db.add(mailbox)
+        db.commit()
+        started = datetime(2026, 3, 1, 12, 0, 3)
+        db.add_all([
+            # Downsampled minute of the failed first attempt
+            ThroughputSample(mailbox_id=mailbox.id, ts=started - timedelta(hours=1), seconds=60, bytes=900_000),
+            # This run: its first 5s bucket starts before started_at
+            ThroughputSample(mailbox_id=mailbox.id, ts=datetime(2026, 3, 1, 12, 0, 0), seconds=5, bytes=100_000),
+            ThroughputSample(mailbox_id=mailbox.id, ts=datetime(2026, 3, 1, 12, 0, 5), seconds=5, bytes=50_000),
+        ])
+        db.commit()
+        assert _copied_bytes(db, {mailbox.id: started}) == {mailbox.id: 150_000}
+        db.close()
+
+
+class TestMailboxDelta:
+    """Test that job polling can fetch only the mailboxes changed since the last response"""
+
+    def test_only_changed_rows_after_cursor(self):
+        """Test full list first, then just the rows written since the cursor"""
+        from datetime import datetime, timedelta
+        from database import SessionLocal, Mailbox
+        from status_writer import StatusWriter
+        job_id = client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com",
+                                                "scheduled_start": "2099-01-01T00:00:00Z"}).json()["id"]
+        db = SessionLocal()
+        rows = [Mailbox(job_id=job_id, source_user=f"u{n}@a.com", target_user=f"u{n}@b.com") for n in range(5)]
+        db.add_all(rows)
+        db.commit()
+        ids = [mb.id for mb in rows]
+        # Written well before the client's first poll
+        db.query(Mailbox).filter(Mailbox.id.in_(ids)).update(
+            {Mailbox.updated_at: datetime.utcnow() - timedelta(hours=1)}, synchronize_session=False)
+        db.commit()
+        db.close()
+
+        full = client.get(f"/api/jobs/{job_id}").json()
+        assert full["delta"] is False
+        assert [mb["id"] for mb in full["mailboxes"]] == ids
+
+        writer = StatusWriter(flush_seconds=3600)
+        writer.update(ids[2], message="copying INBOX")
+        writer.flush()
+        delta = client.get(f"/api/jobs/{job_id}", params={"since": full["cursor"]}).json()
+        assert delta["delta"] is True
+        assert [(mb["id"], mb["msg"]) for mb in delta["mailboxes"]] == [(ids[2], "copying INBOX")]
+        assert delta["total"] == full["total"]
+
+        assert client.get(f"/api/jobs/{job_id}", params={"since": "yesterday"}).status_code == 400
+
+
+class TestLogSearch:
+    """Test indexing of error / key-event log lines and the cross-job search"""
+
+    def test_parser_emits_error_and_event_lines(self):
+        """Test that only error and key-event lines reach on_event, across chunk borders"""
+        from output_pipe import SummaryParser
+        events = []
+        parser = SummaryParser(on_event=lambda kind, line: events.append((kind, line)))
+        parser.feed(b"msg INBOX/1 {1000} copied to INBOX/7\nErr 1/2: could not fetch INBOX/9\nFol")
+        parser.feed(b"der Sent\nExiting with return value 11")
+        parser.finish()
+        assert events == [("error", "Err 1/2: could not fetch INBOX/9"), ("event", "Exiting with return value 11")]
+
+    def _mailbox(self, job_id, user):
+        from database import SessionLocal, Mailbox
+        db = SessionLocal()
+        mb = Mailbox(job_id=job_id, source_user=user, target_user=user, status="failed")
+        db.add(mb)
+        db.commit()
+        mailbox_id = mb.id
+        db.close()
+        return mailbox_id
+
+    def test_search_across_jobs(self):
+        """Test prefix matching of every word, the job filter, grouping per mailbox and run replacement"""
+        from log_index import LogIndexer
+        jobs = [client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com",
+                                               "scheduled_start": "2099-01-01T00:00:00Z"}).json()["id"]
+                for _ in range(2)]
+        first, second = self._mailbox(jobs[0], "one@a.com"), self._mailbox(jobs[1], "two@a.com")
+        indexer = LogIndexer(flush_seconds=3600)
+        indexer.add(first, jobs[0], "error", "Host1 failure: Error login: 2 NO [AUTHENTICATIONFAILED] zqxsearch")
+        indexer.add(first, jobs[0], "error", "Err 2/3: zqxsearch timed out on INBOX")
+        indexer.add(second, jobs[1], "error", "Host2 failure: Error login: NO [AUTHENTICATIONFAILED] zqxsearch")
+        indexer.flush()
+
+        found = client.get("/api/search/logs", params={"q": "zqxsearch authentication"}).json()
+        assert found["total_lines"] == 2
+        assert sorted(mb["user"] for mb in found["mailboxes"]) == ["one@a.com", "two@a.com"]
+
+        only = client.get("/api/search/logs", params={"q": "zqxsearch", "job_id": jobs[0]}).json()
+        assert [(mb["id"], len(mb["lines"])) for mb in only["mailboxes"]] == [(first, 2)]
+
+        # A new run replaces the lines of the previous one
+        indexer.start_run(first)
+        indexer.add(first, jobs[0], "event", "Exiting with return value 0 zqxsearch")
+        indexer.flush()
+        again = client.get("/api/search/logs", params={"q": "zqxsearch", "job_id": jobs[0]}).json()
+        assert [line["kind"] for mb in again["mailboxes"] for line in mb["lines"]] == ["event"]
+
+        assert client.get("/api/search/logs", params={"q": "zqxsearch", "kind": "warning"}).status_code == 422
+
+
+class TestSqliteMode:
+    """Test SQLite production mode: connection pragmas and the single writer thread"""
+
+    def test_pragmas_applied(self):
+        """Test that pooled SQLite connections run in WAL mode with a busy timeout"""
+        from sqlalchemy import text
+        from database import engine, SQLITE_FILE, SQLITE_BUSY_TIMEOUT_MS
+        if not SQLITE_FILE:
+            pytest.skip("not a SQLite database file")
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == SQLITE_BUSY_TIMEOUT_MS
+
+    def test_writer_batches_and_isolates_failures(self):
+        """Test that concurrent writes share the writer's transactions and only a failing write raises"""
+        import threading
+        from database import SessionLocal, Job
+        from db_writer import DbWriter
+        job_ids = [client.post("/api/jobs", json={"source_host": "a.com", "target_host": "b.com",
+                                                  "scheduled_start": "2099-01-01T00:00:00Z"}).json()["id"]
+                   for _ in range(6)]
+        writer = DbWriter(enabled=True)
+        errors = {}
+
+        def rename(job_id, n):
+            def write(db):
+                if n == 3:
+                    raise ValueError("bad write")
+                return db.query(Job).filter(Job.id == job_id).update({Job.name: f"renamed-{n}"})
+            try:
+                assert writer.run(write) == 1
+            except ValueError as e:
+                errors[n] = str(e)
+
+        threads = [threading.Thread(target=rename, args=(job_id, n)) for n, job_id in enumerate(job_ids)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == {3: "bad write"}
+        db = SessionLocal()
+        names = dict(db.query(Job.id, Job.name).filter(Job.id.in_(job_ids)))
+        db.close()
+        assert [names[job_id] == f"renamed-{n}" for n, job_id in enumerate(job_ids)] == \
+            [True, True, True, False, True, True]
+        assert writer.writes == 6 and writer.failures == 1
+        assert writer.batches <= 6
+
+
+class TestUidCache:
+    """Test persistent UID cache directory management"""
+
+    def test_acquire_and_reuse(self, tmp_path):
+        """Test that the same account pair maps to one directory across jobs"""
+        from types import SimpleNamespace
+        from uid_cache import UidCacheManager
+
+        manager = UidCacheManager(root=str(tmp_path), quota_bytes=10 ** 6)
+        job = SimpleNamespace(source_host="imap.a.com", target_host="imap.b.com")
+        mailbox = SimpleNamespace(source_user="User@a.com", target_user="user@b.com")
+
+        path, has_cache = manager.acquire(job, mailbox)
+        assert has_cache is False
+        (tmp_path / os.path.basename(path) / "uidmap").write_bytes(b"x" * 100)
+        manager.release(path)
+
+        other_job = SimpleNamespace(source_host="IMAP.A.COM", target_host="imap.b.com")
+        same_path, has_cache = manager.acquire(other_job, SimpleNamespace(source_user="user@a.com", target_user="user@b.com"))
+        assert same_path == path
+        assert has_cache is True
+        assert manager.usage()["bytes"] == 100
+
+    def test_lru_eviction_under_quota(self, tmp_path):
+        """Test that the least recently used caches are evicted once over quota"""
+        import time
+        from types import SimpleNamespace
+        from uid_cache import UidCacheManager
+
+        manager = UidCacheManager(root=str(tmp_path), quota_bytes=250, min_idle_seconds=0)
+        job = SimpleNamespace(source_host="a", target_host="b")
+        paths = []
+        for i in range(3):
+            path, _ = manager.acquire(job, SimpleNamespace(source_user=f"u{i}", target_user=f"u{i}"))
+            with open(os.path.join(path, "uidmap"), "wb") as f:
+                f.write(b"x" * 100)
+            manager.release(path)
+            paths.append(path)
+            time.sleep(0.01)
+
+        assert not os.path.exists(paths[0])
+        assert os.path.exists(paths[1]) and os.path.exists(paths[2])
+        assert manager.usage()["bytes"] == 200
+
+    def test_concurrent_runs_of_one_pair(self, tmp_path):
+        """Test that a directory used by two runs at once stays protected until both release it"""
+        from types import SimpleNamespace
+        from uid_cache import UidCacheManager
+
+        manager = UidCacheManager(root=str(tmp_path), quota_bytes=50, min_idle_seconds=0)
+        job = SimpleNamespace(source_host="a", target_host="b")
+        mailbox = SimpleNamespace(source_user="u", target_user="u")
+        path, _ = manager.acquire(job, mailbox)
+        manager.acquire(job, mailbox)
+        with open(os.path.join(path, "uidmap"), "wb") as f:
+            f.write(b"x" * 100)
+
+        manager.release(path)
+        assert os.path.exists(path)
+        manager.release(path)
+        assert not os.path.exists(path)
+
+
+class TestJobOptions:
+    """Test job option validation and imapsync tuning profiles"""
+
+    def test_invalid_options_rejected(self):
+        """Test that unknown profiles, unknown keys and out-of-range values fail job creation"""
+        base = {"source_host": "a.com", "target_host": "b.com"}
+        for options in ({"profile": "aol"}, {"bufsize": 1}, {"split1": 0}, {"useheader": ["Bad Header"]}):
+            response = client.post("/api/jobs", json={**base, "options": options})
+            assert response.status_code == 422, options
+
+    def test_options_persisted(self):
+        """Test that options are stored as a structured value and returned on the job"""
+        job_id = client.post("/api/jobs", json={
+            "source_host": "imap.gmail.com", "target_host": "b.com",
+            "options": {"profile": "gmail", "split1": 50, "dry_run": True}
+        }).json()["id"]
+        options = client.get(f"/api/jobs/{job_id}").json()["options"]
+        assert options["profile"] == "gmail"
+        assert options["split1"] == 50
+        assert options["dry_run"] is True
+        assert "buffersize" not in options
+
+    def test_profile_args(self):
+        """Test that profiles supply defaults and explicit values override them"""
+        from job_options import JobOptions, build_imapsync_args, load_job_options
+
+        office = build_imapsync_args(JobOptions(profile="office365"))
+        assert office[office.index("--split1") + 1] == "100"
+        assert office[office.index("--maxsize") + 1] == "45000000"
+        assert "--compress1" not in office and "--nofoldersizes" in office
+        # Size not known yet: the profile's --nofoldersizes gives way, an explicit setting doesn't
+        assert "--nofoldersizes" not in build_imapsync_args(JobOptions(profile="office365"), scan_sizes=True)
+        assert "--nofoldersizes" in build_imapsync_args(JobOptions(nofoldersizes=True), scan_sizes=True)
+
+        dovecot = build_imapsync_args(JobOptions(profile="dovecot", compress2=False, split1=20))
+        assert "--compress1" in dovecot and "--compress2" not in dovecot
+        assert dovecot[dovecot.index("--split1") + 1] == "20"
+
+        gmail = build_imapsync_args(JobOptions(profile="gmail", skip_trash=True))
+        assert gmail[gmail.index("--useheader") + 1] == "Message-Id"
+        assert "--exclude" in gmail
+
+        # Legacy rows stored a JSON string; unknown keys are ignored
+        legacy = load_job_options('{"sync_internal_dates": true, "old_flag": 1}')
+        assert legacy.sync_internal_dates is True and legacy.profile == "generic"
+
+    def test_list_profiles(self):
+        """Test the profile defaults endpoint"""
+        response = client.get("/api/profiles")
+        assert response.status_code == 200
+        assert set(response.json()) == {"generic", "gmail", "office365", "dovecot"}
+
+
 class TestHTMLPages:
     """Test that HTML pages are served correctly"""
     
@@ -165,6 +1821,74 @@ class TestHTMLPages:
         response = client.get("/guide.html")
         assert response.status_code == 200
 
+    def test_html_etag_not_modified(self):
+        """Test that a matching ETag returns 304 without a body"""
+        response = client.get("/index.html")
+        etag = response.headers["etag"]
+        assert response.headers["cache-control"] == "no-cache"
+
+        response = client.get("/index.html", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_html_gzip_variant(self):
+        """Test that gzip is served when requested"""
+        response = client.get("/guide.html", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert "accept-encoding" in response.headers["vary"].lower()
+
+    def test_hashed_asset_urls(self):
+        """Test that pages reference content-hashed assets served as immutable"""
+        import re
+        html = client.get("/job-detail.html").text
+        js_path = re.search(r'src="(js/app\.[0-9a-f]{8}\.js)"', html).group(1)
+        css_path = re.search(r'href="(css/style\.[0-9a-f]{8}\.css)"', html).group(1)
+
+        for path in (js_path, css_path):
+            response = client.get(f"/{path}")
+            assert response.status_code == 200
+            assert "immutable" in response.headers["cache-control"]
+
+        # Plain names still work but must revalidate
+        response = client.get("/js/app.js")
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "no-cache"
+
+    def test_unknown_asset(self):
+        """Test that unknown static files return 404"""
+        response = client.get("/js/missing.js")
+        assert response.status_code == 404
+
+    def test_assets_in_subdirectories(self, tmp_path):
+        """Test that files below css/ and js/ subdirectories are served like the old static mounts"""
+        from static_assets import AssetStore
+        (tmp_path / "js" / "vendor").mkdir(parents=True)
+        (tmp_path / "js" / "vendor" / "lib.js").write_text("var lib = 1;")
+        store = AssetStore(str(tmp_path))
+        asset, is_hashed = store.asset("js/vendor/lib.js")
+        assert asset.content == b"var lib = 1;" and not is_hashed
+        assert client.get("/js/vendor/../../main.py").status_code == 404
+
+    def test_accept_encoding_q_values(self):
+        """Test that codings refused with q=0 are not served"""
+        from static_assets import _accepted_encodings, _acceptable
+        accepted = _accepted_encodings("gzip;q=0.8, br;q=0, identity")
+        assert (_acceptable(accepted, "br"), _acceptable(accepted, "gzip")) == (False, True)
+        assert _acceptable(_accepted_encodings("*;q=0.5"), "br")
+        response = client.get("/guide.html", headers={"Accept-Encoding": "br;q=0, gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+
+    def test_head_requests(self):
+        """Test that HEAD on pages and assets returns the GET headers without a body"""
+        for url in ("/guide.html", "/js/app.js"):
+            got = client.get(url, headers={"Accept-Encoding": "gzip"})
+            head = client.head(url, headers={"Accept-Encoding": "gzip"})
+            assert head.status_code == 200 and head.content == b""
+            assert head.headers["etag"] == got.headers["etag"]
+            assert head.headers["content-length"] == got.headers["content-length"]
+            assert head.headers["content-encoding"] == got.headers["content-encoding"] == "gzip"
+
 
 class TestNoAuthRequired:
     """Verify that authentication is NOT required for endpoints"""
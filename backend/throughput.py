@@ -0,0 +1,216 @@
+"""
+Per-mailbox throughput history.
+
+Running syncs are registered with the process-wide recorder together with their
+SummaryParser, whose copied_bytes / copied_messages grow with every "copied to"
+line. One sampler thread reads those counters every THROUGHPUT_SAMPLE_SECONDS
+(no work in the worker threads, no I/O per mailbox) and keeps only intervals
+with progress. Every THROUGHPUT_FLUSH_SECONDS it bulk-inserts the new samples,
+plus per-job per-minute totals into job_throughput, so job charts read a few
+rows per minute instead of the samples. When a sync ends, its 5s samples are
+merged into 1min samples.
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import func
+from database import ThroughputSample, JobThroughput
+from db_writer import db_writer
+
+SAMPLE_SECONDS = int(os.getenv("THROUGHPUT_SAMPLE_SECONDS", 5))
+FLUSH_SECONDS = int(os.getenv("THROUGHPUT_FLUSH_SECONDS", 30))
+DOWNSAMPLE_SECONDS = 60
+
+
+def _floor(ts: datetime, seconds: int) -> datetime:
+    """Start of the `seconds`-long bucket containing ts (seconds divides an hour)."""
+    ts = ts.replace(microsecond=0)
+    return ts - timedelta(seconds=(ts.minute * 60 + ts.second) % seconds)
+
+
+class _Run:
+    __slots__ = ("mailbox_id", "job_id", "parser", "bytes", "messages")
+
+    def __init__(self, mailbox_id, job_id, parser):
+        self.mailbox_id = mailbox_id
+        self.job_id = job_id
+        self.parser = parser
+        self.bytes = 0
+        self.messages = 0
+
+
+class ThroughputRecorder:
+    def __init__(self, sample_seconds: int = SAMPLE_SECONDS, flush_seconds: int = FLUSH_SECONDS):
+        self.sample_seconds = sample_seconds
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._runs = {}         # mailbox_id -> _Run
+        self._samples = []      # (mailbox_id, ts, bytes, messages) not yet written
+        self._job_minutes = {}  # (job_id, minute) -> [bytes, messages] not yet written
+        self._finished = []     # mailbox ids whose samples are to be downsampled
+        self._thread = None
+        self._flush_lock = threading.Lock()
+        self.samples_written = 0
+        self.downsampled = 0
+
+    def track(self, mailbox_id: int, job_id: str, parser):
+        with self._lock:
+            self._runs[mailbox_id] = _Run(mailbox_id, job_id, parser)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="throughput", daemon=True)
+                self._thread.start()
+
+    def untrack(self, mailbox_id: int):
+        """Takes the last sample of a finished run and queues its history for downsampling."""
+        with self._lock:
+            run = self._runs.pop(mailbox_id, None)
+            if run:
+                self._take(run, datetime.utcnow())
+                self._finished.append(mailbox_id)
+
+    def _take(self, run: _Run, now: datetime):
+        copied_bytes, copied_messages = run.parser.copied_bytes, run.parser.copied_messages
+        delta_bytes, delta_messages = copied_bytes - run.bytes, copied_messages - run.messages
+        if delta_bytes <= 0 and delta_messages <= 0:
+            return
+        run.bytes, run.messages = copied_bytes, copied_messages
+        self._samples.append((run.mailbox_id, _floor(now, self.sample_seconds), delta_bytes, delta_messages))
+        totals = self._job_minutes.setdefault((run.job_id, _floor(now, DOWNSAMPLE_SECONDS)), [0, 0])
+        totals[0] += delta_bytes
+        totals[1] += delta_messages
+
+    def sample(self, now: datetime = None):
+        now = now or datetime.utcnow()
+        with self._lock:
+            for run in list(self._runs.values()):
+                self._take(run, now)
+
+    def pending_for(self, mailbox_id: int):
+        """Samples of this process not written yet, so live charts aren't a flush behind."""
+        with self._lock:
+            return [(ts, self.sample_seconds, data, messages)
+                    for mid, ts, data, messages in self._samples if mid == mailbox_id]
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                samples, self._samples = self._samples, []
+                job_minutes, self._job_minutes = self._job_minutes, {}
+                finished, self._finished = self._finished, []
+            if not samples and not job_minutes and not finished:
+                return
+            def write(db):
+                if samples:
+                    db.bulk_insert_mappings(ThroughputSample, [
+                        {"mailbox_id": mailbox_id, "ts": ts, "seconds": self.sample_seconds,
+                         "bytes": data, "messages": messages}
+                        for mailbox_id, ts, data, messages in samples])
+                if job_minutes:
+                    db.bulk_insert_mappings(JobThroughput, [
+                        {"job_id": job_id, "minute": minute, "bytes": data, "messages": messages}
+                        for (job_id, minute), (data, messages) in job_minutes.items()])
+                for mailbox_id in finished:
+                    _downsample(db, mailbox_id)
+
+            try:
+                db_writer.run(write)
+            except Exception:
+                with self._lock:
+                    self._samples = samples + self._samples
+                    for key, (data, messages) in job_minutes.items():
+                        totals = self._job_minutes.setdefault(key, [0, 0])
+                        totals[0] += data
+                        totals[1] += messages
+                    self._finished = finished + self._finished
+                raise
+            self.samples_written += len(samples)
+            self.downsampled += len(finished)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "tracked": len(self._runs),
+                "queued_samples": len(self._samples),
+                "samples_written": self.samples_written,
+                "downsampled_runs": self.downsampled,
+            }
+
+    def _loop(self):
+        last_flush = time.monotonic()
+        while True:
+            time.sleep(self.sample_seconds)
+            try:
+                self.sample()
+                if time.monotonic() - last_flush >= self.flush_seconds:
+                    last_flush = time.monotonic()
+                    self.flush()
+            except Exception as e:
+                print(f"Throughput recording failed: {e}")
+
+
+def _downsample(db, mailbox_id: int):
+    """Replaces a finished run's short samples with one sample per minute."""
+    rows = db.query(ThroughputSample).filter(ThroughputSample.mailbox_id == mailbox_id,
+                                             ThroughputSample.seconds < DOWNSAMPLE_SECONDS).all()
+    if not rows:
+        return
+    minutes = {}
+    for row in rows:
+        totals = minutes.setdefault(_floor(row.ts, DOWNSAMPLE_SECONDS), [0, 0])
+        totals[0] += row.bytes or 0
+        totals[1] += row.messages or 0
+    db.query(ThroughputSample).filter(ThroughputSample.id.in_([row.id for row in rows])) \
+        .delete(synchronize_session=False)
+    db.bulk_insert_mappings(ThroughputSample, [
+        {"mailbox_id": mailbox_id, "ts": minute, "seconds": DOWNSAMPLE_SECONDS, "bytes": data, "messages": messages}
+        for minute, (data, messages) in sorted(minutes.items())])
+
+
+def _series(points):
+    """[(ts, seconds, bytes, messages)] -> chart points with rates, and their summary."""
+    samples = [{
+        "t": ts.isoformat(),
+        "seconds": seconds,
+        "bytes": data,
+        "messages": messages,
+        "bytes_per_sec": round(data / seconds, 1),
+        "msgs_per_sec": round(messages / seconds, 3),
+    } for ts, seconds, data, messages in sorted(points, key=lambda p: p[0])]
+    active_seconds = sum(p["seconds"] for p in samples)
+    return {
+        "samples": samples,
+        "peak_bytes_per_sec": max((p["bytes_per_sec"] for p in samples), default=0),
+        "avg_bytes_per_sec": round(sum(p["bytes"] for p in samples) / active_seconds, 1) if active_seconds else 0,
+    }
+
+
+def mailbox_series(db, mailbox_id: int):
+    points = [(row.ts, row.seconds, row.bytes or 0, row.messages or 0) for row in db.query(
+        ThroughputSample.ts, ThroughputSample.seconds, ThroughputSample.bytes, ThroughputSample.messages
+    ).filter(ThroughputSample.mailbox_id == mailbox_id)]
+    points.extend(recorder.pending_for(mailbox_id))
+    return _series(points)
+
+
+def job_series(db, job_id: str):
+    points = [(row.minute, DOWNSAMPLE_SECONDS, int(row.bytes or 0), int(row.messages or 0)) for row in db.query(
+        JobThroughput.minute, func.sum(JobThroughput.bytes).label("bytes"),
+        func.sum(JobThroughput.messages).label("messages")
+    ).filter(JobThroughput.job_id == job_id).group_by(JobThroughput.minute)]
+    return _series(points)
+
+
+def delete_history(db, mailbox_ids=None, job_id: str = None):
+    if mailbox_ids:
+        db.query(ThroughputSample).filter(ThroughputSample.mailbox_id.in_(mailbox_ids)) \
+            .delete(synchronize_session=False)
+    if job_id:
+        db.query(JobThroughput).filter(JobThroughput.job_id == job_id).delete(synchronize_session=False)
+
+
+recorder = ThroughputRecorder()
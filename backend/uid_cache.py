@@ -0,0 +1,137 @@
+"""
+Persistent imapsync UID cache directories.
+
+Each source/target account pair gets its own --tmpdir under CACHE_DIR, keyed by
+host and user so retries, delta passes and even a later job for the same pair
+reuse it. Usage is tracked in memory (one directory scan on first use), and
+least-recently-used directories are evicted once the total exceeds the quota.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+
+CACHE_DIR = os.getenv("IMAPSYNC_CACHE_DIR", "cache")
+CACHE_QUOTA_BYTES = int(float(os.getenv("IMAPSYNC_CACHE_QUOTA_MB", 1024)) * 1024 * 1024)
+
+# Never evict a directory touched this recently: another worker process may be using it
+EVICT_MIN_IDLE_SECONDS = 3600
+
+
+def cache_key(job, mailbox) -> str:
+    raw = f"{job.source_host}|{mailbox.source_user}|{job.target_host}|{mailbox.target_user}".lower()
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class UidCacheManager:
+    def __init__(self, root: str = CACHE_DIR, quota_bytes: int = CACHE_QUOTA_BYTES,
+                 min_idle_seconds: float = EVICT_MIN_IDLE_SECONDS):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.min_idle_seconds = min_idle_seconds
+        self._lock = threading.Lock()
+        self._index = None  # key -> [size_bytes, last_used]
+        self._in_use = Counter()  # key -> runs using the directory right now
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        index = {}
+        if os.path.isdir(self.root):
+            for entry in os.scandir(self.root):
+                if entry.is_dir():
+                    index[entry.name] = [_dir_size(entry.path), entry.stat().st_mtime]
+        self._index = index
+
+    def acquire(self, job, mailbox):
+        """
+        Returns (path, has_cache) for the pair's cache directory, creating it if needed.
+        The directory is protected from eviction until every acquire() has been released.
+        """
+        key = cache_key(job, mailbox)
+        path = os.path.join(self.root, key)
+        with self._lock:
+            self._ensure_index()
+            os.makedirs(path, exist_ok=True)
+            os.utime(path)
+            self._in_use[key] += 1
+            entry = self._index.setdefault(key, [0, time.time()])
+            entry[1] = time.time()
+            has_cache = entry[0] > 0
+        return path, has_cache
+
+    def release(self, path: str):
+        """Records the directory's new size after a run and enforces the quota."""
+        key = os.path.basename(path)
+        size = _dir_size(path) if os.path.isdir(path) else 0
+        with self._lock:
+            self._ensure_index()
+            # The same pair may run twice at once (e.g. in two jobs): protected until the last release
+            self._in_use[key] -= 1
+            if self._in_use[key] <= 0:
+                del self._in_use[key]
+            if os.path.isdir(path):
+                self._index[key] = [size, time.time()]
+            else:
+                self._index.pop(key, None)
+            self._evict_locked()
+
+    def _evict_locked(self):
+        total = sum(size for size, _ in self._index.values())
+        if total <= self.quota_bytes:
+            return
+        now = time.time()
+        for key, (size, last_used) in sorted(self._index.items(), key=lambda kv: kv[1][1]):
+            if total <= self.quota_bytes:
+                break
+            if key in self._in_use or now - last_used < self.min_idle_seconds:
+                continue
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            del self._index[key]
+            total -= size
+
+    def remove(self, pairs):
+        """Deletes the caches of (job, mailbox) pairs, e.g. when their job is deleted."""
+        with self._lock:
+            self._ensure_index()
+            for job, mailbox in pairs:
+                key = cache_key(job, mailbox)
+                if key in self._in_use:
+                    continue
+                shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+                self._index.pop(key, None)
+
+    def clear(self):
+        """Deletes every cache directory not currently in use."""
+        with self._lock:
+            self._ensure_index()
+            for key in list(self._index):
+                if key in self._in_use:
+                    continue
+                shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+                del self._index[key]
+
+    def usage(self):
+        with self._lock:
+            self._ensure_index()
+            return {
+                "entries": len(self._index),
+                "bytes": sum(size for size, _ in self._index.values()),
+                "quota_bytes": self.quota_bytes,
+            }
+
+
+uid_caches = UidCacheManager()
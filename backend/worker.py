@@ -8,12 +8,68 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import tempfile
 import signal
+import socket
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
-from database import SessionLocal, Mailbox, engine, Job
+from database import SessionLocal, Mailbox, engine, Job, SyncPass
+from uid_cache import uid_caches
+from job_options import load_job_options, build_imapsync_args
+from archive import BUSY_STATUSES
+from output_pipe import log_writer, pump, SummaryParser
+from control import ensure_poller
+from status_writer import status_writer
+from db_writer import db_writer
+from admission import limit_child_memory
+from throughput import recorder
+from log_index import log_index
 
 # Global registry for running processes {mailbox_id: process_object}
 active_processes = {}
 
+# Identifies this worker in mailbox rows; override when hostnames aren't stable
+WORKER_HOST = os.getenv("WORKER_HOST") or socket.gethostname()
+
+# A running mailbox whose heartbeat is older than this is considered orphaned
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", 120))
+HEARTBEAT_INTERVAL = max(5, LEASE_SECONDS // 4)
+# A validating row of another host (or not yet picked up by a pre-flight) untouched this long was abandoned
+PREFLIGHT_STALE_SECONDS = int(os.getenv("PREFLIGHT_STALE_SECONDS", 900))
+
+# Set on SIGTERM / app shutdown: no new claims, running syncs are checkpointed
+shutting_down = threading.Event()
+
+INTERRUPTED_MESSAGE = "Interrupted by shutdown, will resume"
+
+# Jobs whose pending mailboxes must not be claimed (outside their run window, see
+# run_windows.py, or being archived/deleted, see archive.py)
+INACTIVE_JOB_STATUSES = ('paused', 'scheduled') + BUSY_STATUSES
+
+# Why a sync was terminated {mailbox_id: message}: checkpointed ones return to
+# pending to be resumed later, stopped ones fail with the message
+checkpoint_requests = {}
+stop_requests = {}
+
+# Mailboxes claimed by this process whose imapsync isn't registered in active_processes yet
+# (decrypting, capability probe, building the command). A stop or checkpoint arriving then is
+# kept in the requests above and applied right before Popen, or right after registering.
+starting = set()
+_process_lock = threading.Lock()
+
+
+class TerminatedBeforeStart(Exception):
+    """A stop or checkpoint arrived between the claim and the start of imapsync."""
+
+
+def _requested_termination(mailbox_id: int):
+    """(status, message) for a stop/checkpoint requested for this mailbox, or None."""
+    if mailbox_id in checkpoint_requests:
+        return 'pending', checkpoint_requests[mailbox_id]
+    if mailbox_id in stop_requests:
+        return 'failed', stop_requests[mailbox_id]
+    return None
+
 def kill_sync(mailbox_id: int):
     """
     Terminates the sync process for a specific mailbox.
@@ -29,16 +85,240 @@ def kill_sync(mailbox_id: int):
             return False
     return False
 
+def _terminate_with(requests: dict, mailbox_id: int, message: str) -> bool:
+    with _process_lock:
+        if mailbox_id in starting:
+            # Not started yet; run_imapsync applies it (see `starting`)
+            requests[mailbox_id] = message
+            return True
+    if mailbox_id not in active_processes:
+        return False
+    requests[mailbox_id] = message
+    if kill_sync(mailbox_id):
+        return True
+    requests.pop(mailbox_id, None)
+    return False
+
+def checkpoint_sync(mailbox_id: int, message: str) -> bool:
+    """Stops a running sync so that it returns to pending with `message` instead of failing."""
+    return _terminate_with(checkpoint_requests, mailbox_id, message)
+
+def stop_sync(mailbox_id: int, message: str) -> bool:
+    """Stops a running sync and fails it with `message`."""
+    return _terminate_with(stop_requests, mailbox_id, message)
+
+def claim_mailbox(db: Session, mailbox_id: int) -> bool:
+    """
+    Atomically moves a mailbox from pending to running.
+    Fails if it was already claimed (duplicate enqueue), stopped/cancelled while queued,
+    or its job is paused (paused jobs keep their pending rows until resumed) or being
+    archived / deleted. The caller commits.
+    """
+    if shutting_down.is_set():
+        return False
+
+    now = datetime.utcnow()
+    active_jobs = select(Job.id).where(Job.status.notin_(INACTIVE_JOB_STATUSES))
+    claimed = db.query(Mailbox).filter(
+        Mailbox.id == mailbox_id,
+        Mailbox.status == 'pending',
+        Mailbox.job_id.in_(active_jobs)
+    ).update({
+        Mailbox.status: 'running',
+        Mailbox.message: "Starting imapsync...",
+        Mailbox.attempts: func.coalesce(Mailbox.attempts, 0) + 1,
+        Mailbox.worker_host: WORKER_HOST,
+        Mailbox.owner_pid: os.getpid(),
+        Mailbox.worker_pid: None,
+        Mailbox.started_at: now,
+        Mailbox.heartbeat_at: now,
+    }, synchronize_session=False)
+    return claimed == 1
+
+# --- Lease heartbeat ---
+_heartbeat_thread = None
+_heartbeat_lock = threading.Lock()
+
+def _heartbeat_loop():
+    while not shutting_down.wait(HEARTBEAT_INTERVAL):
+        mailbox_ids = list(active_processes.keys())
+        if not mailbox_ids:
+            continue
+        try:
+            db_writer.run(lambda db: db.query(Mailbox).filter(Mailbox.id.in_(mailbox_ids), Mailbox.status == 'running')
+                          .update({Mailbox.heartbeat_at: datetime.utcnow()}, synchronize_session=False))
+        except Exception as e:
+            print(f"Heartbeat update failed: {e}")
+
+def ensure_heartbeat():
+    """Starts the single lease-renewal thread for this process (idempotent)."""
+    global _heartbeat_thread
+    with _heartbeat_lock:
+        if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="lease-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
+# --- Orphan recovery ---
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _is_imapsync_process(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"imapsync" in f.read()
+    except OSError:
+        return False
+
+def recover_orphans(db: Session):
+    """
+    Startup sweep. Returns the ids of mailboxes that should be (re-)enqueued:
+
+    - running rows of this host whose owning process is gone are orphans: a still-alive
+      imapsync child can't be re-attached (its stdout pipe died with its parent), so it is
+      terminated and the row re-queued; imapsync only copies what is missing on re-run.
+      Rows owned by a live sibling process (uvicorn --workers N) with a valid lease are left alone.
+    - running rows of other hosts are re-queued only once their lease has expired.
+    - validating rows whose pre-flight process is gone are queued without the check; rows of
+      another host (or not yet picked up) only once untouched for PREFLIGHT_STALE_SECONDS.
+    - pending rows of non-paused jobs lost their in-memory executor slot and are re-enqueued.
+    """
+    now = datetime.utcnow()
+    expired = now - timedelta(seconds=LEASE_SECONDS)
+
+    stale = db.query(Mailbox.id, Mailbox.worker_host, Mailbox.owner_pid, Mailbox.worker_pid, Mailbox.heartbeat_at) \
+        .filter(Mailbox.status == 'running').all()
+
+    requeue_ids = []
+    for row in stale:
+        if row.id in active_processes:
+            continue
+        if row.worker_host == WORKER_HOST:
+            lease_valid = row.heartbeat_at is not None and row.heartbeat_at >= expired
+            if lease_valid and row.owner_pid and row.owner_pid != os.getpid() and _pid_alive(row.owner_pid):
+                continue
+            if row.worker_pid and _is_imapsync_process(row.worker_pid):
+                try:
+                    os.kill(row.worker_pid, signal.SIGTERM)
+                    print(f"Terminated orphaned imapsync pid {row.worker_pid} (mailbox {row.id})")
+                except OSError as e:
+                    print(f"Could not terminate orphan pid {row.worker_pid}: {e}")
+            requeue_ids.append(row.id)
+        elif row.heartbeat_at is None or row.heartbeat_at < expired:
+            requeue_ids.append(row.id)
+
+    if requeue_ids:
+        db.query(Mailbox).filter(Mailbox.id.in_(requeue_ids), Mailbox.status == 'running').update({
+            Mailbox.status: 'pending',
+            Mailbox.message: 'Re-queued after worker restart',
+            Mailbox.worker_pid: None,
+        }, synchronize_session=False)
+        db.commit()
+
+    # A pre-flight check interrupted by the restart: queue without it rather than strand the rows.
+    # A live sibling process may still be validating its own rows; those are left alone.
+    stale_before = now - timedelta(seconds=PREFLIGHT_STALE_SECONDS)
+    interrupted = []
+    for row in db.query(Mailbox.id, Mailbox.worker_host, Mailbox.owner_pid, Mailbox.updated_at) \
+            .filter(Mailbox.status == 'validating'):
+        if row.worker_host == WORKER_HOST and row.owner_pid:
+            if row.owner_pid == os.getpid() or _pid_alive(row.owner_pid):
+                continue
+        elif row.updated_at is not None and row.updated_at >= stale_before:
+            continue
+        interrupted.append(row.id)
+    if interrupted:
+        db.query(Mailbox).filter(Mailbox.id.in_(interrupted), Mailbox.status == 'validating').update({
+            Mailbox.status: 'pending',
+            Mailbox.message: 'Pre-flight interrupted by restart, queued without check',
+            Mailbox.preflight_status: 'skipped',
+        }, synchronize_session=False)
+        db.commit()
+
+    active_jobs = select(Job.id).where(Job.status.notin_(INACTIVE_JOB_STATUSES))
+    pending_ids = [row.id for row in db.query(Mailbox.id).filter(
+        Mailbox.status == 'pending',
+        Mailbox.job_id.in_(active_jobs)
+    )]
+    return pending_ids
+
+# --- Graceful shutdown ---
+def shutdown(drain_seconds: float = 0):
+    """
+    Stops claiming new mailboxes, waits up to drain_seconds for running syncs to finish,
+    then terminates the rest and checkpoints them back to pending so the next start resumes them.
+    """
+    shutting_down.set()
+
+    deadline = time.time() + drain_seconds
+    while active_processes and time.time() < deadline:
+        time.sleep(0.5)
+
+    remaining = list(active_processes.keys())
+    for mailbox_id in remaining:
+        kill_sync(mailbox_id)
+
+    # Give worker threads a moment to record the checkpoint themselves
+    deadline = time.time() + 5
+    while active_processes and time.time() < deadline:
+        time.sleep(0.2)
+
+    # Whatever the write-behind queue still holds must land before the process exits
+    try:
+        status_writer.flush()
+        recorder.flush()
+        log_index.flush()
+    except Exception as e:
+        print(f"Final status flush failed: {e}")
+
+    if remaining:
+        db = SessionLocal()
+        try:
+            db.query(Mailbox).filter(Mailbox.id.in_(remaining), Mailbox.status == 'running').update({
+                Mailbox.status: 'pending',
+                Mailbox.message: INTERRUPTED_MESSAGE,
+                Mailbox.worker_pid: None,
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+    return remaining
+
 def run_imapsync(mailbox_id: int):
     """
     Executes the real imapsync process.
     """
+    # Tracked from before the claim commits, so no stop/checkpoint for it can be missed
+    with _process_lock:
+        starting.add(mailbox_id)
+    # Claims of syncs starting together share one transaction
+    try:
+        claimed = db_writer.run(lambda claim_db: claim_mailbox(claim_db, mailbox_id))
+    except Exception:
+        with _process_lock:
+            starting.discard(mailbox_id)
+        raise
+    if not claimed:
+        with _process_lock:
+            starting.discard(mailbox_id)
+        return
+
     db: Session = SessionLocal()
     mailbox = db.query(Mailbox).filter(Mailbox.id == mailbox_id).first()
     if not mailbox:
+        with _process_lock:
+            starting.discard(mailbox_id)
+        db.close()
         return
 
     job = db.query(Job).filter(Job.id == mailbox.job_id).first()
+    job_id = mailbox.job_id
+    pass_number = mailbox.pass_number or 1
     
     log_dir = "logs"
     if not os.path.exists(log_dir):
@@ -46,14 +326,18 @@ def run_imapsync(mailbox_id: int):
         
     log_file_path = f"{log_dir}/{mailbox.id}.log"
     
+    total_bytes = 0
+    messages_transferred = 0
+    cache_dir = None
+    # A later pass only narrows to recent mail once a full sync of the mailbox has completed;
+    # a mailbox that never finished one (a failed row picked up by the pass) gets a full sync
+    is_delta = pass_number > 1 and mailbox.last_synced_at is not None
+    # Final column values, handed to the status writer when the run ends
+    result = {}
+    
     try:
-        mailbox.status = 'running'
-        mailbox.message = "Starting imapsync..."
-        db.commit()
-
         # Decrypt passwords
         from database import decrypt_password
-        import json
         
         source_pass = decrypt_password(mailbox.source_pass)
         target_pass = decrypt_password(mailbox.target_pass)
@@ -70,13 +354,9 @@ def run_imapsync(mailbox_id: int):
             f_pass2.flush()
             pass2_path = f_pass2.name
         
-        # Parse Options
-        options = {}
-        if job.options:
-            try:
-                options = json.loads(job.options)
-            except:
-                pass
+        options = load_job_options(job.options)
+        from capabilities import job_capabilities  # ssl / imaplib: loaded with the first sync, not the API
+        capabilities = job_capabilities(db, job, mailbox, source_pass, target_pass)
 
         # Build Command
         cmd = [
@@ -89,8 +369,7 @@ def run_imapsync(mailbox_id: int):
             '--port2', str(job.target_port),
             '--user2', mailbox.target_user,
             '--passfile2', pass2_path,
-            '--automap',
-            '--nofoldersizes'
+            '--automap'
         ]
         
         # Security Flags
@@ -104,114 +383,141 @@ def run_imapsync(mailbox_id: int):
         elif job.target_security == "STARTTLS":
             cmd.append('--tls2')
             
-        # Feature Flags
-        if options.get('sync_internal_dates'):
-            cmd.append('--syncinternaldates')
-        
-        if options.get('skip_trash'):
-             # Common trash folder names, can be expanded
-            cmd.extend(['--exclude', 'Trash', '--exclude', 'Bin', '--exclude', 'Deleted Items'])
-            
-        if options.get('dry_run'):
-            cmd.append('--dry')
+        # Profile tuning adjusted to the servers' capabilities, and feature flags
+        cmd.extend(build_imapsync_args(options, capabilities,
+                                       scan_sizes=not is_delta and mailbox.size_bytes is None))
+
+        # Persistent UID cache for this account pair: retries and later passes skip the full comparison
+        cache_dir, has_cache = uid_caches.acquire(job, mailbox)
+        cmd.extend(['--usecache', '--tmpdir', cache_dir])
+
+        # Delta pass: only compare recent messages and trust the cached UID maps
+        if is_delta:
+            sync_pass = db.query(SyncPass).filter(SyncPass.job_id == job.id, SyncPass.pass_number == mailbox.pass_number).first()
+            if sync_pass and sync_pass.max_age_days:
+                cmd.extend(['--maxage', str(sync_pass.max_age_days)])
+            # --useuid trusts the cache completely; only safe once a cached run has populated it,
+            # and the target must return new UIDs on APPEND (UIDPLUS) to keep the cache current
+            if has_cache and capabilities.get('target', {}).get('uidplus', True):
+                cmd.append('--useuid')
 
-        # Execute
-        with open(log_file_path, "w") as log_file:
+        # Everything needed is loaded; don't hold a pooled connection for the whole run
+        db.close()
+        run_started = datetime.utcnow()
+
+        # Execute: raw pipe, drained by output_pipe (parsing in-thread, log writes batched elsewhere)
+        log_sink = log_writer.open(log_file_path)
+        log_index.start_run(mailbox_id)
+        try:
+            if _requested_termination(mailbox_id):
+                raise TerminatedBeforeStart()
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
+                bufsize=0
             )
             
-            # Register process
-            active_processes[mailbox_id] = process
+            # Register process; requests from now on signal it directly
+            with _process_lock:
+                active_processes[mailbox_id] = process
+                starting.discard(mailbox_id)
+            if _requested_termination(mailbox_id):
+                # Arrived while imapsync was being spawned
+                kill_sync(mailbox_id)
+            limit_child_memory(process.pid)
+            ensure_heartbeat()
+            ensure_poller()
+            status_writer.update(mailbox_id, worker_pid=process.pid)
             
-            # Stream logs
-            import re
-            total_bytes = 0
-            
-            for line in process.stdout:
-                log_file.write(line)
-                log_file.flush()
-                
-                # Parse Data Transfer
-                # Parse Data Transfer
-                # Pattern 1: Final summary "Total bytes transferred : 123456"
-                if "Total bytes transferred" in line:
-                    match = re.search(r'Total bytes transferred.*?:\s*(\d+)', line, re.IGNORECASE)
-                    if match:
-                         try:
-                             total_bytes = int(match.group(1))
-                         except: pass
-                
-                # Pattern 2: "Detected 12 messages ... Total size: 123456 bytes" (Estimation)
-                # Use this if we haven't found the final yet, but accurate final is better.
-                elif "Total size" in line and "bytes" in line and total_bytes == 0:
-                     match = re.search(r'Total size.*?:\s*(\d+)', line, re.IGNORECASE)
-                     if match:
-                         try:
-                             total_bytes = int(match.group(1))
-                         except: pass
-
+            # The estimator keeps the size from the full sync; a delta pass's scan doesn't replace it
+            keep_sizes = is_delta and mailbox.size_bytes is not None
+            parser = SummaryParser(
+                on_sizes=None if keep_sizes else
+                lambda size, count: status_writer.update(mailbox_id, size_bytes=size, size_messages=count),
+                on_event=lambda kind, line: log_index.add(mailbox_id, job_id, kind, line))
+            recorder.track(mailbox_id, job_id, parser)
+            pump(process.stdout, log_sink, parser)
             process.wait()
-            
-            # Update Stats
-            if total_bytes > 0:
-                mailbox.data_transferred = total_bytes
-                job.data_transferred += total_bytes
-            
-            # Cleanup registry
-            if mailbox_id in active_processes:
-                del active_processes[mailbox_id]
-
-            # Cleanup temp files
-            if os.path.exists(pass1_path): os.unlink(pass1_path)
-            if os.path.exists(pass2_path): os.unlink(pass2_path)
-
-            if process.returncode == 0:
-                mailbox.status = 'success'
-                mailbox.message = "Sync Completed Successfully"
-                job.completed += 1
-            elif process.returncode == -15 or process.returncode == -9: # Terminated
-                mailbox.status = 'failed'
-                mailbox.message = "Stopped by user"
+        finally:
+            # Make sure the log is on disk before the final status is visible
+            log_sink.close()
+        result["finished_at"] = datetime.utcnow()
+        total_bytes = parser.total_bytes
+        messages_transferred = parser.messages_transferred
+        messages_skipped = parser.messages_skipped
+
+        # Update Stats (delta passes add to what earlier passes moved; job totals are recounted on write)
+        if total_bytes > 0:
+            if is_delta:
+                result["data_transferred"] = (mailbox.data_transferred or 0) + total_bytes
             else:
-                mailbox.status = 'failed'
-                mailbox.message = f"Exited with code {process.returncode}. Check logs."
+                result["data_transferred"] = total_bytes
+        if is_delta:
+            result["messages_transferred"] = (mailbox.messages_transferred or 0) + messages_transferred
+        else:
+            result["messages_transferred"] = messages_transferred
+        result["messages_skipped"] = messages_skipped
+        
+        # Cleanup registry
+        if mailbox_id in active_processes:
+            del active_processes[mailbox_id]
+
+        # Cleanup temp files
+        if os.path.exists(pass1_path): os.unlink(pass1_path)
+        if os.path.exists(pass2_path): os.unlink(pass2_path)
+
+        if process.returncode == 0:
+            result["status"] = 'success'
+            result["message"] = "Sync Completed Successfully"
+            result["last_synced_at"] = run_started
+        elif (process.returncode == -15 or process.returncode == -9) and shutting_down.is_set():
+            # Checkpoint: resume on next start instead of failing
+            result["status"] = 'pending'
+            result["message"] = INTERRUPTED_MESSAGE
+        elif (process.returncode == -15 or process.returncode == -9) and mailbox_id in checkpoint_requests:
+            # Checkpoint: resume when the job runs again (e.g. next run window)
+            result["status"] = 'pending'
+            result["message"] = checkpoint_requests[mailbox_id]
+        elif process.returncode == -15 or process.returncode == -9: # Terminated
+            result["status"] = 'failed'
+            result["message"] = stop_requests.get(mailbox_id, "Stopped by user")
+        else:
+            result["status"] = 'failed'
+            result["message"] = f"Exited with code {process.returncode}. Check logs."
 
 
+    except TerminatedBeforeStart:
+        result["status"], result["message"] = _requested_termination(mailbox_id)
+        result["finished_at"] = datetime.utcnow()
+        for path in (pass1_path, pass2_path):
+            if os.path.exists(path): os.unlink(path)
     except Exception as e:
-        mailbox.status = 'failed'
-        mailbox.message = str(e)
+        result["status"] = 'failed'
+        result["message"] = str(e)
+        result["finished_at"] = datetime.utcnow()
         # if job: job.failed += 1 # Don't update blindly
         with open(log_file_path, "a") as log_file:
             log_file.write(f"\nCRITICAL ERROR: {str(e)}\n")
             
     finally:
         # Final cleanup safety
+        with _process_lock:
+            starting.discard(mailbox_id)
         if mailbox_id in active_processes:
             del active_processes[mailbox_id]
+        checkpoint_requests.pop(mailbox_id, None)
+        stop_requests.pop(mailbox_id, None)
+        recorder.untrack(mailbox_id)
+        
+        if cache_dir:
+            try:
+                uid_caches.release(cache_dir)
+            except Exception as e:
+                print(f"UID cache accounting failed for {cache_dir}: {e}")
         
-        # Recalculate Job Stats to avoid race conditions and check completion
-            # Recalculate Job Stats to avoid race conditions and check completion
-        if job:
-            from sqlalchemy import func
-            completed_count = db.query(Mailbox).filter(Mailbox.job_id == job.id, Mailbox.status == 'success').count()
-            failed_count = db.query(Mailbox).filter(Mailbox.job_id == job.id, Mailbox.status == 'failed').count()
-            
-            # Recalculate Data Transferred
-            total_job_bytes = db.query(func.sum(Mailbox.data_transferred)).filter(Mailbox.job_id == job.id).scalar() or 0
-            job.data_transferred = total_job_bytes
-
-            job.completed = completed_count
-            job.failed = failed_count
-            
-            # Check completion
-            if (job.completed + job.failed) >= job.total_mailboxes:
-                job.status = 'completed'
-
-        db.commit()
         db.close()
 
+        # Durable before returning; the job's counters and completion are recounted in the same write
+        status_writer.finish(mailbox_id, job_id, result, pass_number=pass_number,
+                             pass_bytes=total_bytes, pass_messages=messages_transferred)
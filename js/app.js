@@ -16,6 +16,100 @@ const request = async (url, options = {}) => {
 // --- Page Logic ---
 
 // 1. Dashboard Logic
+const JOBS_PAGE_SIZE = 50;
+let jobsNextCursor = null;
+
+const formatBytes = (bytes) => {
+    if (bytes > 1024 ** 3) return `${(bytes / 1024 ** 3).toFixed(2)} GB`;
+    if (bytes > 1024 ** 2) return `${(bytes / 1024 ** 2).toFixed(2)} MB`;
+    if (bytes > 1024) return `${(bytes / 1024).toFixed(2)} KB`;
+    return `${bytes} B`;
+};
+
+const formatDuration = (seconds) => {
+    if (seconds < 60) return `${Math.max(0, Math.round(seconds))}s`;
+    const minutes = Math.round(seconds / 60);
+    if (minutes < 60) return `${minutes}m`;
+    const hours = Math.floor(minutes / 60);
+    if (hours < 48) return `${hours}h ${minutes % 60}m`;
+    return `${Math.floor(hours / 24)}d ${hours % 24}h`;
+};
+
+const getJobStatusClasses = (status) => {
+    const statusMap = {
+        'running': 'bg-blue-100 text-blue-700 border border-blue-200',
+        'completed': 'bg-emerald-100 text-emerald-700 border border-emerald-200',
+        'success': 'bg-emerald-100 text-emerald-700 border border-emerald-200',
+        'failed': 'bg-red-100 text-red-700 border border-red-200',
+        'pending': 'bg-amber-100 text-amber-700 border border-amber-200',
+        'paused': 'bg-gray-200 text-gray-700 border border-gray-300',
+        'scheduled': 'bg-indigo-100 text-indigo-700 border border-indigo-200',
+        'archiving': 'bg-slate-100 text-slate-600 border border-slate-200',
+        'archived': 'bg-slate-100 text-slate-600 border border-slate-200',
+        'deleting': 'bg-red-50 text-red-500 border border-red-100'
+    };
+    return statusMap[status] || 'bg-gray-100 text-gray-700 border border-gray-200';
+};
+
+const renderJobRow = (job) => `
+    <tr class="hover:bg-blue-50/50 transition-colors">
+        <td class="px-6 py-4">
+            <div class="font-medium text-gray-900">${job.name}</div>
+            <div class="text-sm text-gray-500">${new Date(job.created_at).toLocaleString()}</div>
+        </td>
+        <td class="px-6 py-4">
+            <span class="inline-flex items-center px-2.5 py-1 rounded-full text-xs font-semibold ${getJobStatusClasses(job.status)}">
+                ${job.status === 'running' ? '<span class="w-2 h-2 bg-blue-500 rounded-full mr-1.5 animate-pulse"></span>' : ''}
+                ${job.status}
+            </span>
+        </td>
+        <td class="px-6 py-4">
+            <div class="flex items-center gap-2">
+                <span class="text-sm font-medium text-gray-700 min-w-[35px]">${job.progress}%</span>
+                <div class="w-20 h-2 bg-gray-200 rounded-full overflow-hidden">
+                    <div class="h-full progress-gradient rounded-full transition-all duration-500" style="width: ${job.progress}%"></div>
+                </div>
+            </div>
+        </td>
+        <td class="px-6 py-4">
+            <div class="text-sm font-medium text-gray-900">${job.source}</div>
+            <div class="text-sm text-gray-500">→ ${job.target}</div>
+        </td>
+        <td class="px-6 py-4 text-right">
+            <a href="job-detail.html?id=${job.id}" class="inline-flex items-center gap-1 px-3 py-1.5 bg-gray-100 text-gray-700 text-sm font-medium rounded-lg hover:bg-gray-200 transition-colors">
+                Xem
+            </a>
+        </td>
+    </tr>
+`;
+
+// Fetches one page of jobs (newest first); the next page's cursor comes back in X-Next-Cursor
+const fetchJobsPage = async (cursor) => {
+    const params = new URLSearchParams({ limit: JOBS_PAGE_SIZE });
+    if (cursor) params.set('cursor', cursor);
+    const res = await request(`${API_BASE}/jobs?${params}`);
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    jobsNextCursor = res.headers.get('X-Next-Cursor');
+    document.getElementById('load-more-jobs-btn')?.classList.toggle('hidden', !jobsNextCursor);
+    return res.json();
+};
+
+window.loadMoreJobs = async () => {
+    const jobListEl = document.getElementById('jobs-table-body');
+    const btn = document.getElementById('load-more-jobs-btn');
+    if (!jobListEl || !jobsNextCursor) return;
+
+    if (btn) btn.disabled = true;
+    try {
+        const jobs = await fetchJobsPage(jobsNextCursor);
+        jobListEl.insertAdjacentHTML('beforeend', jobs.map(renderJobRow).join(''));
+    } catch (e) {
+        window.showToast('Lỗi tải jobs: ' + e.message, 'error');
+    } finally {
+        if (btn) btn.disabled = false;
+    }
+};
+
 const initDashboard = async () => {
     const jobListEl = document.getElementById('jobs-table-body');
     const emptyState = document.getElementById('empty-state');
@@ -26,19 +120,7 @@ const initDashboard = async () => {
     jobListEl.innerHTML = '<tr><td colspan="5" class="px-6 py-12 text-center text-gray-500"><div class="flex items-center justify-center gap-2"><svg class="animate-spin h-5 w-5 text-blue-600" xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24"><circle class="opacity-25" cx="12" cy="12" r="10" stroke="currentColor" stroke-width="4"></circle><path class="opacity-75" fill="currentColor" d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"></path></svg>Đang tải...</div></td></tr>';
 
     try {
-        const res = await request(`${API_BASE}/jobs`);
-        const jobs = await res.json();
-
-        const getStatusClasses = (status) => {
-            const statusMap = {
-                'running': 'bg-blue-100 text-blue-700 border border-blue-200',
-                'completed': 'bg-emerald-100 text-emerald-700 border border-emerald-200',
-                'success': 'bg-emerald-100 text-emerald-700 border border-emerald-200',
-                'failed': 'bg-red-100 text-red-700 border border-red-200',
-                'pending': 'bg-amber-100 text-amber-700 border border-amber-200'
-            };
-            return statusMap[status] || 'bg-gray-100 text-gray-700 border border-gray-200';
-        };
+        const jobs = await fetchJobsPage(null);
 
         if (jobs.length === 0) {
             // Show empty state
@@ -48,37 +130,7 @@ const initDashboard = async () => {
             jobsTable?.classList.remove('hidden');
             emptyState?.classList.add('hidden');
 
-            jobListEl.innerHTML = jobs.map(job => `
-                <tr class="hover:bg-blue-50/50 transition-colors">
-                    <td class="px-6 py-4">
-                        <div class="font-medium text-gray-900">${job.name}</div>
-                        <div class="text-sm text-gray-500">${new Date(job.created_at).toLocaleString()}</div>
-                    </td>
-                    <td class="px-6 py-4">
-                        <span class="inline-flex items-center px-2.5 py-1 rounded-full text-xs font-semibold ${getStatusClasses(job.status)}">
-                            ${job.status === 'running' ? '<span class="w-2 h-2 bg-blue-500 rounded-full mr-1.5 animate-pulse"></span>' : ''}
-                            ${job.status}
-                        </span>
-                    </td>
-                    <td class="px-6 py-4">
-                        <div class="flex items-center gap-2">
-                            <span class="text-sm font-medium text-gray-700 min-w-[35px]">${job.progress}%</span>
-                            <div class="w-20 h-2 bg-gray-200 rounded-full overflow-hidden">
-                                <div class="h-full progress-gradient rounded-full transition-all duration-500" style="width: ${job.progress}%"></div>
-                            </div>
-                        </div>
-                    </td>
-                    <td class="px-6 py-4">
-                        <div class="text-sm font-medium text-gray-900">${job.source}</div>
-                        <div class="text-sm text-gray-500">→ ${job.target}</div>
-                    </td>
-                    <td class="px-6 py-4 text-right">
-                        <a href="job-detail.html?id=${job.id}" class="inline-flex items-center gap-1 px-3 py-1.5 bg-gray-100 text-gray-700 text-sm font-medium rounded-lg hover:bg-gray-200 transition-colors">
-                            Xem
-                        </a>
-                    </td>
-                </tr>
-            `).join('');
+            jobListEl.innerHTML = jobs.map(renderJobRow).join('');
         }
 
         // Fetch System Stats
@@ -88,7 +140,7 @@ const initDashboard = async () => {
             document.getElementById('stat-total-jobs').textContent = stats.total_jobs;
             document.getElementById('stat-active-jobs').textContent = stats.active_jobs;
             document.getElementById('stat-completed-mailboxes').textContent = stats.completed_mailboxes;
-            document.getElementById('stat-data-transferred').textContent = stats.data_transferred;
+            document.getElementById('stat-data-transferred').textContent = formatBytes(stats.data_transferred_bytes ?? 0);
         }
 
     } catch (e) {
@@ -125,7 +177,7 @@ window.deleteAllJobs = async () => {
             const res = await request(`${API_BASE}/jobs`, { method: 'DELETE' });
             if (!res.ok) throw new Error("Failed to delete jobs");
 
-            window.showToast("Đã xóa toàn bộ lịch sử", "success");
+            window.showToast("Đang xóa toàn bộ lịch sử...", "success");
 
             // Refresh dashboard
             await initDashboard();
@@ -272,6 +324,7 @@ const initCreateJob = () => {
 
         // Collect Options
         const options = {
+            profile: document.getElementById('opt-profile')?.value || 'generic',
             sync_internal_dates: document.getElementById('opt-sync-dates')?.checked || false,
             skip_trash: document.getElementById('opt-skip-trash')?.checked || false,
             dry_run: document.getElementById('opt-dry-run')?.checked || false,
@@ -290,9 +343,29 @@ const initCreateJob = () => {
             target_port: parseInt(formData.get('target_port') || 993),
             source_security: formData.get('source_security'),
             target_security: formData.get('target_security'),
-            options: options
+            options: options,
+            priority: parseInt(document.getElementById('opt-priority')?.value || 5),
+            max_concurrency: options.concurrency
         };
 
+        // Off-hours scheduling: start time from the local clock, nightly window in the browser's timezone
+        const scheduledStart = document.getElementById('opt-scheduled-start')?.value;
+        if (scheduledStart) {
+            jobPayload.scheduled_start = new Date(scheduledStart).toISOString();
+        }
+        const windowStart = document.getElementById('opt-window-start')?.value;
+        const windowEnd = document.getElementById('opt-window-end')?.value;
+        if (windowStart && windowEnd) {
+            jobPayload.run_windows = {
+                timezone: Intl.DateTimeFormat().resolvedOptions().timeZone || 'UTC',
+                windows: [{
+                    days: document.getElementById('opt-window-weekdays')?.checked ? [0, 1, 2, 3, 4] : [0, 1, 2, 3, 4, 5, 6],
+                    start: windowStart,
+                    end: windowEnd
+                }]
+            };
+        }
+
         try {
             // 1. Create Job
             const res = await request(`${API_BASE}/jobs`, {
@@ -311,7 +384,8 @@ const initCreateJob = () => {
                     const uploadData = new FormData();
                     uploadData.append('file', fileInput.files[0]);
 
-                    const uploadRes = await request(`${API_BASE}/upload/${job.id}`, {
+                    const preflight = document.getElementById('opt-preflight')?.checked ? '?preflight=true' : '';
+                    const uploadRes = await request(`${API_BASE}/upload/${job.id}${preflight}`, {
                         method: 'POST',
                         body: uploadData
                     });
@@ -543,7 +617,9 @@ window.showConfirm = (message, callback) => {
 // 3. Job Detail Logic
 let isJobPolling = false;
 let forcePollRestart = false;
-let currentMailboxes = [];
+let mailboxCursor = null;
+let mailboxEtas = {};
+const ESTIMATE_INTERVAL = 15000;
 
 const initJobDetail = async () => {
     const params = new URLSearchParams(window.location.search);
@@ -567,14 +643,41 @@ const initJobDetail = async () => {
         });
     }
 
+    // Estimates move slowly; refresh them less often than the job itself
+    let estimateFetchedAt = 0;
+    const updateEstimate = async () => {
+        estimateFetchedAt = Date.now();
+        try {
+            const res = await request(`${API_BASE}/jobs/${jobId}/estimate`);
+            if (!res.ok) return;
+            const estimate = await res.json();
+            mailboxEtas = Object.fromEntries(estimate.mailboxes.map(mb => [mb.id, mb.eta_seconds]));
+            refreshEtaLabels();
+            const etaEl = document.getElementById('stat-eta');
+            if (!etaEl) return;
+            if (!estimate.remaining_mailboxes) {
+                etaEl.textContent = '-';
+                etaEl.title = '';
+                return;
+            }
+            etaEl.textContent = formatDuration(estimate.remaining_seconds);
+            const rate = estimate.rates;
+            etaEl.title = `Finish ~${new Date(estimate.finish_at + 'Z').toLocaleString()}, ` +
+                `${formatBytes(rate.bytes_per_sec)}/s per session (${rate.source}, ${rate.runs} runs), ` +
+                `${estimate.concurrency} concurrent`;
+        } catch (e) {
+            console.error(e);
+        }
+    };
+
     const updateUI = async () => {
         try {
-            const res = await request(`${API_BASE}/jobs/${jobId}`);
+            // After the first response only mailboxes changed since the last one are sent
+            const since = mailboxCursor ? `?since=${encodeURIComponent(mailboxCursor)}` : '';
+            const res = await request(`${API_BASE}/jobs/${jobId}${since}`);
             if (!res.ok) throw new Error('Job not found');
             const job = await res.json();
-
-            // Store mailboxes for filtering
-            currentMailboxes = job.mailboxes || [];
+            mailboxCursor = job.cursor;
 
             // Status badge classes helper
             const getStatusBadge = (status) => {
@@ -583,7 +686,13 @@ const initJobDetail = async () => {
                     'completed': 'bg-emerald-100 text-emerald-700',
                     'success': 'bg-emerald-100 text-emerald-700',
                     'failed': 'bg-red-100 text-red-700',
-                    'pending': 'bg-amber-100 text-amber-700'
+                    'pending': 'bg-amber-100 text-amber-700',
+                    'validating': 'bg-violet-100 text-violet-700',
+                    'paused': 'bg-gray-200 text-gray-700',
+                    'scheduled': 'bg-indigo-100 text-indigo-700',
+                    'archiving': 'bg-slate-100 text-slate-600',
+                    'archived': 'bg-slate-100 text-slate-600',
+                    'deleting': 'bg-red-50 text-red-500'
                 };
                 return statusMap[status] || 'bg-gray-100 text-gray-700';
             };
@@ -596,17 +705,21 @@ const initJobDetail = async () => {
             document.getElementById('source-host').textContent = job.source;
             document.getElementById('target-host').textContent = job.target;
 
-            // Show/hide Cancel All button
-            const cancelAllBtn = document.getElementById('cancel-all-btn');
-            if (cancelAllBtn) {
-                if (job.status === 'running') {
-                    cancelAllBtn.classList.remove('hidden');
-                    cancelAllBtn.classList.add('inline-flex');
-                } else {
-                    cancelAllBtn.classList.add('hidden');
-                    cancelAllBtn.classList.remove('inline-flex');
-                }
-            }
+            // Show/hide job control buttons
+            const toggleButton = (id, visible) => {
+                const btn = document.getElementById(id);
+                if (!btn) return;
+                btn.classList.toggle('hidden', !visible);
+                btn.classList.toggle('inline-flex', visible);
+            };
+            toggleButton('cancel-all-btn', ['running', 'paused', 'scheduled'].includes(job.status));
+            toggleButton('pause-btn', job.status === 'running' || job.status === 'scheduled');
+            toggleButton('resume-btn', job.status === 'paused');
+            const jobBusy = ['archiving', 'archived', 'deleting'].includes(job.status);
+            toggleButton('retry-failed-btn', job.failed > 0 && job.status !== 'paused' && !jobBusy);
+            toggleButton('archive-btn', job.status === 'completed');
+            toggleButton('delete-job-btn', !jobBusy || job.status === 'archived');
+            toggleButton('delta-sync-btn', job.status === 'completed' && job.completed > 0);
 
             // Stats
             document.getElementById('stat-total').textContent = job.total;
@@ -622,10 +735,14 @@ const initJobDetail = async () => {
             document.getElementById('main-progress-bar').style.width = `${job.progress}%`;
             document.getElementById('progress-percent').textContent = `${job.progress}%`;
 
+            if (Date.now() - estimateFetchedAt > ESTIMATE_INTERVAL) {
+                await updateEstimate();
+            }
+
             // Render mailboxes
-            renderMailboxes(currentMailboxes, getStatusBadge);
+            renderMailboxes(job.mailboxes || [], job.delta, getStatusBadge);
 
-            if (job.status === 'running' || job.status === 'pending' || forcePollRestart) {
+            if (['running', 'pending', 'paused', 'scheduled'].includes(job.status) || forcePollRestart) {
                 if (forcePollRestart) forcePollRestart = false;
                 setTimeout(updateUI, 2000);
             } else {
@@ -642,52 +759,142 @@ const initJobDetail = async () => {
     updateUI();
 };
 
-function renderMailboxes(mailboxes, getStatusBadge) {
-    const tableBody = document.getElementById('mailbox-list');
-    const emptyState = document.getElementById('mailbox-empty-state');
+// Mailbox table: one <tr> per mailbox id, created once and then patched in place.
+// Updates are collected and applied together in the next animation frame.
+const mailboxRows = new Map();      // id -> { data, el, eta }
+const pendingMailboxPatches = new Map();
+const pendingMailboxRemovals = new Set();
+let mailboxPatchFrame = null;
+let mailboxBadge = () => '';
+let mailboxQuery = '';
+
+function renderMailboxes(mailboxes, isDelta, getStatusBadge) {
+    mailboxBadge = getStatusBadge;
+    if (!isDelta) {
+        // A full list replaces what we have: rows missing from it are gone
+        const ids = new Set(mailboxes.map(mb => mb.id));
+        for (const id of mailboxRows.keys()) {
+            if (!ids.has(id)) pendingMailboxRemovals.add(id);
+        }
+    }
+    for (const mb of mailboxes) {
+        const entry = mailboxRows.get(mb.id);
+        if (entry && entry.data.status === mb.status && entry.data.msg === mb.msg) continue;
+        pendingMailboxPatches.set(mb.id, mb);
+    }
+    scheduleMailboxPatch();
+}
 
-    if (mailboxes && mailboxes.length > 0) {
-        emptyState?.classList.add('hidden');
-        tableBody.innerHTML = mailboxes.map(mb => `
-            <tr class="hover:bg-blue-50/50 transition-colors" data-user="${mb.user?.toLowerCase()}" data-target="${mb.target_user?.toLowerCase()}">
-                <td class="px-6 py-4 font-mono text-sm text-gray-900">${mb.user}</td>
-                <td class="px-6 py-4 font-mono text-sm text-gray-900">${mb.target_user}</td>
-                <td class="px-6 py-4">
-                    <span class="inline-flex items-center px-2.5 py-1 rounded-full text-xs font-semibold ${getStatusBadge(mb.status === 'success' ? 'completed' : mb.status)}">
-                        ${mb.status === 'running' ? '<span class="w-2 h-2 bg-blue-500 rounded-full mr-1.5 animate-pulse"></span>' : ''}
-                        ${mb.status}
-                    </span>
-                </td>
-                <td class="px-6 py-4 text-sm text-gray-600 max-w-xs truncate" title="${mb.msg || ''}">${mb.msg || '-'}</td>
-                <td class="px-6 py-4 text-right">
-                    <div class="flex justify-end items-center gap-2">
-                        <button onclick="viewLogs(${mb.id})" class="px-2.5 py-1.5 text-xs font-medium bg-gray-100 text-gray-700 rounded-lg hover:bg-gray-200 transition-colors">Log</button>
-                        ${mb.status === 'running' ? `<button onclick="stopSync(${mb.id})" class="px-2.5 py-1.5 text-xs font-medium bg-red-100 text-red-600 rounded-lg hover:bg-red-200 transition-colors">Stop</button>` : ''}
-                        ${mb.status === 'failed' ? `<button onclick="retrySync(${mb.id})" class="px-2.5 py-1.5 text-xs font-medium bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition-colors">Retry</button>` : ''}
-                    </div>
-                </td>
-            </tr>
-        `).join('');
-    } else {
-        emptyState?.classList.remove('hidden');
-        tableBody.innerHTML = '';
+function refreshEtaLabels() {
+    for (const [id, entry] of mailboxRows) {
+        if (etaText(entry.data) !== entry.eta && !pendingMailboxPatches.has(id)) {
+            pendingMailboxPatches.set(id, entry.data);
+        }
     }
+    scheduleMailboxPatch();
 }
 
-function filterMailboxes(query) {
-    const rows = document.querySelectorAll('#mailbox-list tr');
-    const lowerQuery = query.toLowerCase();
+function scheduleMailboxPatch() {
+    if (mailboxPatchFrame !== null) return;
+    if (!pendingMailboxPatches.size && !pendingMailboxRemovals.size && mailboxRows.size) return;
+    mailboxPatchFrame = requestAnimationFrame(applyMailboxPatches);
+}
 
-    rows.forEach(row => {
-        const user = row.dataset.user || '';
-        const target = row.dataset.target || '';
+function applyMailboxPatches() {
+    mailboxPatchFrame = null;
+    const tableBody = document.getElementById('mailbox-list');
+    const emptyState = document.getElementById('mailbox-empty-state');
 
-        if (user.includes(lowerQuery) || target.includes(lowerQuery)) {
-            row.style.display = '';
+    for (const id of pendingMailboxRemovals) {
+        mailboxRows.get(id)?.el.remove();
+        mailboxRows.delete(id);
+    }
+    pendingMailboxRemovals.clear();
+
+    // New rows have higher ids than existing ones, so appending keeps the order
+    const added = document.createDocumentFragment();
+    for (const mb of pendingMailboxPatches.values()) {
+        const entry = mailboxRows.get(mb.id);
+        if (entry) {
+            patchMailboxRow(entry, mb);
         } else {
-            row.style.display = 'none';
+            const el = createMailboxRow(mb);
+            mailboxRows.set(mb.id, { data: mb, el, eta: etaText(mb) });
+            added.appendChild(el);
         }
-    });
+    }
+    pendingMailboxPatches.clear();
+    tableBody.appendChild(added);
+
+    emptyState?.classList.toggle('hidden', mailboxRows.size > 0);
+}
+
+function createMailboxRow(mb) {
+    const row = document.createElement('tr');
+    row.className = 'hover:bg-blue-50/50 transition-colors';
+    row.dataset.user = (mb.user || '').toLowerCase();
+    row.dataset.target = (mb.target_user || '').toLowerCase();
+    row.innerHTML = `
+        <td class="px-6 py-4 font-mono text-sm text-gray-900"></td>
+        <td class="px-6 py-4 font-mono text-sm text-gray-900"></td>
+        <td class="px-6 py-4"></td>
+        <td class="px-6 py-4 text-sm text-gray-600 max-w-xs truncate"><span></span><span class="block text-xs text-gray-400"></span></td>
+        <td class="px-6 py-4 text-right"></td>
+    `;
+    row.cells[0].textContent = mb.user;
+    row.cells[1].textContent = mb.target_user;
+    fillMailboxStatus(row, mb);
+    fillMailboxMessage(row, mb);
+    row.cells[3].lastElementChild.textContent = etaText(mb);
+    row.style.display = matchesMailboxQuery(row) ? '' : 'none';
+    return row;
+}
+
+function patchMailboxRow(entry, mb) {
+    const row = entry.el;
+    if (entry.data.status !== mb.status) fillMailboxStatus(row, mb);
+    if (entry.data.msg !== mb.msg) fillMailboxMessage(row, mb);
+    const eta = etaText(mb);
+    if (eta !== entry.eta) row.cells[3].lastElementChild.textContent = eta;
+    entry.data = mb;
+    entry.eta = eta;
+}
+
+function fillMailboxStatus(row, mb) {
+    row.cells[2].innerHTML = `
+        <span class="inline-flex items-center px-2.5 py-1 rounded-full text-xs font-semibold ${mailboxBadge(mb.status === 'success' ? 'completed' : mb.status)}">
+            ${mb.status === 'running' ? '<span class="w-2 h-2 bg-blue-500 rounded-full mr-1.5 animate-pulse"></span>' : ''}
+            ${mb.status}
+        </span>`;
+    row.cells[4].innerHTML = `
+        <div class="flex justify-end items-center gap-2">
+            <button onclick="viewLogs(${mb.id})" class="px-2.5 py-1.5 text-xs font-medium bg-gray-100 text-gray-700 rounded-lg hover:bg-gray-200 transition-colors">Log</button>
+            ${mb.status === 'running' ? `<button onclick="stopSync(${mb.id})" class="px-2.5 py-1.5 text-xs font-medium bg-red-100 text-red-600 rounded-lg hover:bg-red-200 transition-colors">Stop</button>` : ''}
+            ${mb.status === 'failed' ? `<button onclick="retrySync(${mb.id})" class="px-2.5 py-1.5 text-xs font-medium bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition-colors">Retry</button>` : ''}
+        </div>`;
+}
+
+function fillMailboxMessage(row, mb) {
+    const cell = row.cells[3];
+    cell.title = mb.msg || '';
+    cell.firstElementChild.textContent = mb.msg || '-';
+}
+
+function etaText(mb) {
+    const eta = mailboxEtas[mb.id];
+    if (eta === undefined || !['pending', 'running', 'validating'].includes(mb.status)) return '';
+    return `ETA ~${formatDuration(eta)}`;
+}
+
+function matchesMailboxQuery(row) {
+    return (row.dataset.user || '').includes(mailboxQuery) || (row.dataset.target || '').includes(mailboxQuery);
+}
+
+function filterMailboxes(query) {
+    mailboxQuery = query.toLowerCase();
+    for (const { el } of mailboxRows.values()) {
+        el.style.display = matchesMailboxQuery(el) ? '' : 'none';
+    }
 }
 
 window.cancelAllMailboxes = async () => {
@@ -708,6 +915,103 @@ window.cancelAllMailboxes = async () => {
     });
 };
 
+const restartJobPolling = () => {
+    if (!isJobPolling) {
+        forcePollRestart = true;
+        initJobDetail();
+    } else {
+        forcePollRestart = true;
+    }
+};
+
+const postJobAction = async (action, query = '') => {
+    const params = new URLSearchParams(window.location.search);
+    const jobId = params.get('id');
+    const res = await request(`${API_BASE}/jobs/${jobId}/${action}${query}`, { method: 'POST' });
+    const data = await res.json().catch(() => ({}));
+    if (!res.ok) throw new Error(data.detail || `Failed to ${action}`);
+    return data;
+};
+
+window.retryFailedMailboxes = async () => {
+    window.showConfirm('Thử lại TẤT CẢ mailbox bị lỗi?', async () => {
+        try {
+            const data = await postJobAction('retry-failed');
+            window.showToast(`Đang retry ${data.retried} mailbox...`, 'success');
+            restartJobPolling();
+        } catch (e) {
+            window.showToast('Lỗi: ' + e.message, 'error');
+        }
+    });
+};
+
+window.pauseJob = async () => {
+    try {
+        await postJobAction('pause');
+        window.showToast('Đã tạm dừng job (các mailbox đang chạy sẽ hoàn tất)', 'info');
+        restartJobPolling();
+    } catch (e) {
+        window.showToast('Lỗi: ' + e.message, 'error');
+    }
+};
+
+window.resumeJob = async () => {
+    try {
+        const data = await postJobAction('resume');
+        window.showToast(`Đã tiếp tục job (${data.queued} mailbox trong hàng đợi)`, 'success');
+        restartJobPolling();
+    } catch (e) {
+        window.showToast('Lỗi: ' + e.message, 'error');
+    }
+};
+
+window.startDeltaSync = async () => {
+    window.showConfirm('Chạy delta sync: chỉ đồng bộ email mới cho các mailbox đã thành công?', async () => {
+        try {
+            const params = new URLSearchParams(window.location.search);
+            const jobId = params.get('id');
+            const res = await request(`${API_BASE}/jobs/${jobId}/delta-sync`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({})
+            });
+            const data = await res.json().catch(() => ({}));
+            if (!res.ok) throw new Error(data.detail || 'Failed to start delta sync');
+            window.showToast(`Delta pass ${data.pass_number}: ${data.queued} mailbox`, 'success');
+            restartJobPolling();
+        } catch (e) {
+            window.showToast('Lỗi: ' + e.message, 'error');
+        }
+    });
+};
+
+window.archiveJob = async () => {
+    window.showConfirm('Lưu trữ job này? Mailbox và logs sẽ được chuyển sang kho lưu trữ (chỉ xem, không sync lại).', async () => {
+        try {
+            await postJobAction('archive');
+            window.showToast('Đang lưu trữ job...', 'info');
+            restartJobPolling();
+        } catch (e) {
+            window.showToast('Lỗi: ' + e.message, 'error');
+        }
+    });
+};
+
+window.deleteJob = async () => {
+    window.showConfirm('Xóa job này cùng toàn bộ logs? Hành động này không thể hoàn tác.', async () => {
+        try {
+            const params = new URLSearchParams(window.location.search);
+            const res = await request(`${API_BASE}/jobs/${params.get('id')}`, { method: 'DELETE' });
+            const data = await res.json().catch(() => ({}));
+            if (!res.ok) throw new Error(data.detail || 'Failed to delete job');
+            window.showToast('Đang xóa job...', 'info');
+            window.location.href = 'index.html';
+        } catch (e) {
+            window.showToast('Lỗi: ' + e.message, 'error');
+        }
+    });
+};
+
 window.stopSync = async (mailboxId) => {
     window.showConfirm('Bạn có chắc muốn dừng sync này?', async () => {
         try {
@@ -797,8 +1101,9 @@ window.closeModal = () => {
     }
 };
 
-// --- Download All Logs ---
-window.downloadAllLogs = async () => {
+// --- Download All Logs / Report ---
+// The server streams these; let the browser save them directly instead of buffering in JS
+const downloadJobExport = (path) => {
     const params = new URLSearchParams(window.location.search);
     const jobId = params.get('id');
 
@@ -807,84 +1112,17 @@ window.downloadAllLogs = async () => {
         return;
     }
 
-    const downloadBtn = document.getElementById('download-logs-btn');
-    const originalText = downloadBtn?.innerHTML;
-
-    // Show loading state
-    if (downloadBtn) {
-        downloadBtn.disabled = true;
-        downloadBtn.innerHTML = `
-            <svg class="animate-spin h-4 w-4" xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24">
-                <circle class="opacity-25" cx="12" cy="12" r="10" stroke="currentColor" stroke-width="4"></circle>
-                <path class="opacity-75" fill="currentColor" d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"></path>
-            </svg>
-            Đang tải...
-        `;
-    }
-
-    try {
-        // Get job details with mailboxes
-        const jobRes = await request(`${API_BASE}/jobs/${jobId}`);
-        if (!jobRes.ok) throw new Error('Không thể tải thông tin job');
-        const job = await jobRes.json();
-
-        // Fetch all logs
-        let allLogs = `========================================\n`;
-        allLogs += `IMAP SYNC PRO - LOGS EXPORT\n`;
-        allLogs += `Job: ${job.name}\n`;
-        allLogs += `Source: ${job.source} → Target: ${job.target}\n`;
-        allLogs += `Exported at: ${new Date().toLocaleString('vi-VN')}\n`;
-        allLogs += `========================================\n\n`;
-
-        if (job.mailboxes && job.mailboxes.length > 0) {
-            for (const mb of job.mailboxes) {
-                allLogs += `\n========================================\n`;
-                allLogs += `MAILBOX: ${mb.user} → ${mb.target_user}\n`;
-                allLogs += `Status: ${mb.status}\n`;
-                allLogs += `Message: ${mb.msg || 'N/A'}\n`;
-                allLogs += `========================================\n\n`;
-
-                try {
-                    const logRes = await request(`${API_BASE}/mailboxes/${mb.id}/logs`);
-                    if (logRes.ok) {
-                        const logData = await logRes.json();
-                        allLogs += logData.logs || 'No logs available';
-                    } else {
-                        allLogs += 'Failed to fetch logs for this mailbox';
-                    }
-                } catch (e) {
-                    allLogs += `Error fetching logs: ${e.message}`;
-                }
-                allLogs += '\n\n';
-            }
-        } else {
-            allLogs += 'No mailboxes found in this job.\n';
-        }
-
-        // Create and download file
-        const blob = new Blob([allLogs], { type: 'text/plain;charset=utf-8' });
-        const url = window.URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.href = url;
-        a.download = `imap_sync_logs_${job.name.replace(/[^a-z0-9]/gi, '_')}_${new Date().toISOString().split('T')[0]}.txt`;
-        document.body.appendChild(a);
-        a.click();
-        document.body.removeChild(a);
-        window.URL.revokeObjectURL(url);
-
-        window.showToast('Đã tải logs thành công!', 'success');
-
-    } catch (e) {
-        window.showToast('Lỗi: ' + e.message, 'error');
-    } finally {
-        // Restore button
-        if (downloadBtn) {
-            downloadBtn.disabled = false;
-            downloadBtn.innerHTML = originalText;
-        }
-    }
+    const a = document.createElement('a');
+    a.href = `${API_BASE}/jobs/${jobId}/${path}`;
+    a.download = '';
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
 };
 
+window.downloadAllLogs = () => downloadJobExport('logs.zip');
+window.downloadReport = () => downloadJobExport('report.csv');
+
 // ============================================
 // Dark Mode Toggle
 // ============================================
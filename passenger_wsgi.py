@@ -17,7 +17,11 @@ load_dotenv(env_path)
 
 # 4. Import the ASGI app
 #    Adjust 'backend.main' if your folder structure or file name is different.
-from backend.main import app as asgi_app
+from backend.main import app as asgi_app, startup
+
+#    a2wsgi does not run the ASGI lifespan, so kick off deferred init here.
+#    It doesn't touch the database; run `python backend/migrate.py` after deploys.
+startup()
 
 # 3. Wrap it with a2wsgi to make it WSGI-compatible
 from a2wsgi import ASGIMiddleware